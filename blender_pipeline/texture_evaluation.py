@@ -8,7 +8,10 @@ import json
 ######################################################################################
 #                                Texture Evaluation                                  #
 ######################################################################################
-params_file_path = Path(__file__).parent / "params_textureEvaluation.json"
+# parameter file: first argument after "--" (blender --background --python texture_evaluation.py -- <params file>),
+# default: params_textureEvaluation.json next to this script
+argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+params_file_path = Path(argv[0]) if argv else Path(__file__).parent / "params_textureEvaluation.json"
 # load parameters from parameter file
 with open(params_file_path, 'r') as file:
     params = json.load(file)
@@ -17,8 +20,9 @@ with open(params_file_path, 'r') as file:
 # "io": {
 #     "obj_path": r'C:\Users\Tobias\Documents\Masterarbeit_lokal\synthetic_pipeline\objects\Dodekaeder\Mesh-Dateien\Wuerfel_12s\12S.obj',    # Path to the object file
 #     "label_images": 1,               # how to label rendered images
-#     "output_path: r'C'
-# },
+#     "output_path: r'C',
+#     "jobs": [{"obj_path": r'C:...', "output_path": r'C:...'}, ...]   # optional: several objects rendered with the same scene
+# },                                                                   # (cameras and lights are created once, only the object is swapped)
 # # Position and movement of the object
 # "motion": {
 #     "s0": [0, 0, 1],            # [m] set x,y,z position of the object at t=0s
@@ -77,13 +81,6 @@ from functions import (
 bpy.ops.object.select_all(action='SELECT')
 bpy.ops.object.delete()
 #------------------------------------------------------------------------------------
-# Load objects
-bpy.ops.wm.obj_import(filepath=str(params["io"]["obj_path"]))   # Import the OBJ model
-obj = bpy.context.active_object                                 # Retrieve the last imported object (this is now the active object)
-bpy.ops.object.origin_set(type='ORIGIN_CENTER_OF_VOLUME', center='BOUNDS')  # Recalculate the object's bounding box to update its center of mass
-params["motion"]["a"] =[0,0,0]; params["motion"]["v0"] =[0,0,0]
-params["motion"] = translate_obj(0,params["motion"],obj)        # Set the position of the object at t=0s
-#------------------------------------------------------------------------------------
 # Create cameras
 if params["cam"]["even_dist"] == True:
     create_evenly_distributed_cameras(params["cam"])
@@ -95,7 +92,24 @@ set_render_settings(params["render"])
 # Create light sources
 create_lightsources(params["light"],params["cam"]["focuspoint"])
 #------------------------------------------------------------------------------------
-# Rendering of all cameras in the scene
-image_count = 0; t_count = 0; camera_data = []
+# Render every job (object, output folder) with the same cameras and lights
+jobs = params["io"].get("jobs") or [{"obj_path": params["io"]["obj_path"], "output_path": params["io"]["output_path"]}]
+params["motion"]["a"] =[0,0,0]; params["motion"]["v0"] =[0,0,0]
 params["exiftool"]["mod"] = 0
-image_count,camera_data,_ = renderCameras(params,t_count,image_count,camera_data)
+for job in jobs:
+    print(f"Texture evaluation: render {job['obj_path']} --> {job['output_path']}")
+    params["io"]["obj_path"] = job["obj_path"]; params["io"]["output_path"] = job["output_path"]
+    Path(job["output_path"]).mkdir(parents=True, exist_ok=True)
+    # Load objects
+    objects_scene = set(bpy.data.objects)
+    bpy.ops.wm.obj_import(filepath=str(params["io"]["obj_path"]))   # Import the OBJ model
+    obj = bpy.context.active_object                                 # Retrieve the last imported object (this is now the active object)
+    bpy.ops.object.origin_set(type='ORIGIN_CENTER_OF_VOLUME', center='BOUNDS')  # Recalculate the object's bounding box to update its center of mass
+    translate_obj(0,params["motion"],obj)                           # Set the position of the object at t=0s
+    # Rendering of all cameras in the scene
+    image_count = 0; t_count = 0; camera_data = []
+    image_count,camera_data,_ = renderCameras(params,t_count,image_count,camera_data)
+    # Remove the imported objects and their data (meshes, materials, textures) --> the scene only contains the cameras and lights
+    for obj_imported in set(bpy.data.objects) - objects_scene:
+        bpy.data.objects.remove(obj_imported, do_unlink=True)
+    bpy.data.orphans_purge(do_recursive=True)
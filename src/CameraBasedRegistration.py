@@ -0,0 +1,107 @@
+import numpy as np
+import sys
+import importlib
+importlib.reload(sys.modules['src.TransMatrix_Utils']) if 'src.TransMatrix_Utils' in sys.modules else None
+from src.TransMatrix_Utils import rotation_matrix_x
+
+# -----------------------------------------------------------------------
+def UmeyamaSimilarity(src, dst, with_scale=True):
+    # Closed-form least squares similarity transformation dst = s*R@src + t (Umeyama, 1991)
+    # src, dst: (N,3) or stacked (H,N,3) point sets --> s: (H,), R: (H,3,3), t: (H,3)
+    src = np.asarray(src, dtype=float); dst = np.asarray(dst, dtype=float)
+    single = src.ndim == 2
+    if single: src = src[None]; dst = dst[None]
+    mu_src = src.mean(axis=1); mu_dst = dst.mean(axis=1)
+    src_c = src - mu_src[:,None,:]; dst_c = dst - mu_dst[:,None,:]
+    var_src = np.mean(np.sum(src_c**2, axis=2), axis=1)
+    Sigma = np.einsum('hni,hnj->hij', dst_c, src_c) / src.shape[1]      # cross covariance matrix
+    U, D, Vt = np.linalg.svd(Sigma)
+    S = np.ones([len(D),3]); S[:,2] = np.sign(np.linalg.det(U) * np.linalg.det(Vt))   # avoid reflections
+    S[S[:,2] == 0, 2] = 1
+    R = U @ (S[:,:,None] * Vt)
+    s = np.sum(D*S, axis=1) / var_src if with_scale else np.ones(len(D))
+    t = mu_dst - s[:,None] * np.einsum('hij,hj->hi', R, mu_src)
+    if single: return s[0], R[0], t[0]
+    return s, R, t
+
+def Similarity2Transformation4x4(s, R, t):
+    T = np.eye(4)
+    T[:3,:3] = s*R
+    T[:3,3] = t
+    return T
+
+# -----------------------------------------------------------------------
+def RANSACSimilarity(src, dst, threshold, confidence=0.999, max_trials=2000, batch_size=256, seed=42):
+    # Robust estimation of a similarity transformation from matched points
+    # minimal samples of three correspondences, a batch of hypotheses is estimated and scored at once
+    n = len(src)
+    if n < 3: return None, None
+    rng = np.random.default_rng(seed)
+    best_n_inliers = 0; best_inliers = None
+    trials = 0; required_trials = max_trials
+    while trials < min(required_trials, max_trials):
+        n_batch = min(batch_size, max_trials-trials)
+        samples = np.argsort(rng.random([n_batch,n]), axis=1)[:,:3] if n < 64 else rng.integers(0, n, size=[n_batch,3])
+        s, R, t = UmeyamaSimilarity(src[samples], dst[samples])
+        # residuals of all correspondences for all hypotheses (hypotheses, points)
+        residuals = np.linalg.norm(s[:,None,None]*np.einsum('hij,nj->hni', R, src) + t[:,None,:] - dst[None], axis=2)
+        is_inlier = residuals <= threshold
+        n_inliers = np.sum(is_inlier, axis=1)
+        best = np.argmax(n_inliers)
+        if n_inliers[best] > best_n_inliers:
+            best_n_inliers = n_inliers[best]; best_inliers = is_inlier[best]
+            inlier_ratio = best_n_inliers / n            # adaptive number of trials
+            if inlier_ratio >= 1: required_trials = 0
+            else: required_trials = int(np.ceil(np.log(1-confidence) / np.log(1-inlier_ratio**3)))
+        trials += n_batch
+    if best_n_inliers < 3: return None, None
+    # refit on the consensus set until it does not change anymore
+    inliers = best_inliers
+    for _ in range(10):
+        s, R, t = UmeyamaSimilarity(src[inliers], dst[inliers])
+        inliers_new = np.linalg.norm(s*src@R.T + t - dst, axis=1) <= threshold
+        if np.array_equal(inliers_new, inliers) or np.sum(inliers_new) < 3: break
+        inliers = inliers_new
+    return Similarity2Transformation4x4(s, R, t), inliers
+
+##############################################################################################################
+#                                 MAIN FUNCTION  --> CameraBasedRegistration                                 #
+##############################################################################################################
+
+def CameraBasedRegistration(cams_rec,cams_ref,obj_moving,objs,obj0,focuspoint,threshold=0.01,robust=True):
+    # Estimate the transformation T (reconstruction --> reference object) from the matched camera centers
+    # T has the same meaning as the transformation of the mesh registration (see camera_reconstructed.Transformation2WorldCoordinateSystem):
+    #   camera to world = translation(focuspoint_z) @ T @ rot_x(180°) @ camera to meshroom
+    # --> src: reconstructed camera centers in the reconstruction coordinate system
+    # --> dst: reference camera centers of the static scene in the reference coordinate system
+    rot_x_meshroom_plot_cam = rotation_matrix_x(np.deg2rad(180))[:3,:3]
+    if isinstance(getattr(cams_ref,"CorrespondigIndex",None), np.ndarray) and isinstance(getattr(cams_rec,"Location",None), np.ndarray):
+        # array-backed cameras: all matched cameras at once
+        ind_ref = np.flatnonzero(cams_ref.CorrespondigIndex >= 0)
+        if obj_moving:      # convert the dynamic scene into the static scene (object fixed)
+            cams_ref.Dynamic2StaticScene(objs, obj0.Transformation, focuspoint, indices=ind_ref)
+        src = cams_rec.Location[cams_ref.CorrespondigIndex[ind_ref]] @ rot_x_meshroom_plot_cam.T
+        dst = cams_ref.TransformationStatic[ind_ref,:3,3] - np.array([0,0,focuspoint[2]])
+    else:
+        src = []; dst = []
+        for cam in cams_ref:
+            if cam.CorrespondigIndex is None: continue
+            if obj_moving:      # convert the dynamic scene into the static scene (object fixed)
+                cam.Dynamic2StaticScene(objs[cam.CorrespondigIndexObject].Transformation, obj0.Transformation,focuspoint)
+            src.append(rot_x_meshroom_plot_cam @ np.asarray(cams_rec[cam.CorrespondigIndex].Location, dtype=float))
+            dst.append(cam.TransformationStatic[:3,3] - np.array([0,0,focuspoint[2]]))
+        src = np.array(src); dst = np.array(dst)
+    if len(src) < 3:
+        print("Warning: Less than three cameras were reconstructed. No camera based registration possible.")
+        return None, None
+    if robust:
+        T, inliers = RANSACSimilarity(src, dst, threshold)
+        if T is None:
+            print("Warning: RANSAC could not find a valid consensus set for the camera based registration.")
+            return None, None
+    else:
+        T = Similarity2Transformation4x4(*UmeyamaSimilarity(src, dst)); inliers = np.ones(len(src), dtype=bool)
+    residuals = np.linalg.norm(src @ T[:3,:3].T + T[:3,3] - dst, axis=1)
+    print(f"Camera based registration: scale = {np.linalg.norm(T[:3,0]):.5f}, {np.sum(inliers)} of {len(src)} cameras are inliers, "
+          f"RMSE (inliers) = {np.sqrt(np.mean(residuals[inliers]**2))*1000:.2f}mm")
+    return T, inliers
@@ -2,37 +2,100 @@ import numpy as np
 import sys
 import importlib
 importlib.reload(sys.modules['src.TransMatrix_Utils']) if 'src.TransMatrix_Utils' in sys.modules else None
-from src.TransMatrix_Utils import Get_Location_Rotation3x3_Scale_from_Transformation4x4
+from src.TransMatrix_Utils import Get_Location_Rotation3x3_Scale_from_Transformation4x4, \
+                            Get_Location_Rotation3x3_Scale_from_Transformation4x4_stacked, \
+                            GeodesicRotationDistance
 import matplotlib.pyplot as plt
 from pathlib import Path
 
 def CreateCameraDataSets(cams_rec,cams_ref,scene = "dynamic"):
-    x = np.ones([len(cams_rec),3])*(42)
-    y = np.ones([len(cams_rec),3])*(42)
-    Rx = []
-    Ry = []
-    empty_rows = []
-    for i,cam_rec in enumerate(cams_rec):
-        ind_ref = cam_rec.CorrespondigIndex
-        if ind_ref != None:
-            cam_ref = cams_ref[ind_ref]
-            if scene == "dynamic":
-                cam_ref_T = cam_ref.TransformationDynamic; cam_rec_T = cam_rec.TransformationDynamic
-            else:
-                cam_ref_T = cam_ref.TransformationStatic; cam_rec_T = cam_rec.TransformationStatic
-            location_ref,rotation_ref,_ = Get_Location_Rotation3x3_Scale_from_Transformation4x4(cam_ref_T)
-            location_rec,rotation_rec,_ = Get_Location_Rotation3x3_Scale_from_Transformation4x4(cam_rec_T)
-            x[i,:] = location_rec; Rx.append(rotation_rec)
-            y[i,:] = location_ref; Ry.append(rotation_ref)
-        else:
-            empty_rows.append(i)
-    empty_rows
-    # filter x and y
-    pos_x = np.delete(x, empty_rows, axis=0)
-    pos_y = np.delete(y, empty_rows, axis=0)
+    T_rec, T_ref, CorrespondingIndex, _, _ = StackCameraTransformations(cams_rec,cams_ref,scene)
+    matched = CorrespondingIndex >= 0
+    location_rec,rotation_rec,_ = Get_Location_Rotation3x3_Scale_from_Transformation4x4_stacked(T_rec[matched])
+    location_ref,rotation_ref,_ = Get_Location_Rotation3x3_Scale_from_Transformation4x4_stacked(T_ref[CorrespondingIndex[matched]])
+    pos_x = location_rec.copy(); Rx = list(rotation_rec)
+    pos_y = location_ref.copy(); Ry = list(rotation_ref)
     print(f"{len(cams_rec)} cameras from {len(cams_ref)} cameras were reconstructed ({len(cams_rec)/len(cams_ref)*100} %)")
     return pos_x,pos_y,Rx,Ry
 
+def StackCameraTransformations(cams_rec,cams_ref,scene = "dynamic"):
+    # Stacked (N,4,4) transformations of the reconstructed and reference cameras and the correspondence vector
+    # (index of the reference camera for each reconstructed camera, -1 if none)
+    # cams_rec / cams_ref: lists of camera objects or CameraSet (arrays are used directly)
+    attr = "TransformationDynamic" if scene == "dynamic" else "TransformationStatic"
+    def stack(cams):
+        T = getattr(cams, attr, None)
+        if isinstance(T, np.ndarray): return T
+        return np.array([np.full([4,4], np.nan) if getattr(cam, attr) is None else getattr(cam, attr) for cam in cams], dtype=float).reshape(-1,4,4)
+    CorrespondingIndex = getattr(cams_rec, "CorrespondigIndex", None)
+    if not isinstance(CorrespondingIndex, np.ndarray):
+        CorrespondingIndex = np.array([-1 if cam.CorrespondigIndex is None else cam.CorrespondigIndex for cam in cams_rec], dtype=np.int64)
+    TimeStep = getattr(cams_ref, "TimeStep", None)
+    if not isinstance(TimeStep, np.ndarray):
+        TimeStep = np.array([-1 if cam.TimeStep is None else cam.TimeStep for cam in cams_ref], dtype=np.int64)
+    # camera id: position of the reference camera within its time step (cameras are rendered in the same order in every time step)
+    order = np.argsort(TimeStep, kind="stable")
+    _, first, counts = np.unique(TimeStep[order], return_index=True, return_counts=True)
+    CameraId = np.empty(len(TimeStep), dtype=np.int64)
+    CameraId[order] = np.arange(len(TimeStep)) - np.repeat(first, counts)
+    return stack(cams_rec), stack(cams_ref), CorrespondingIndex, TimeStep, CameraId
+
+#-----------------------------------------------------------------------
+CameraPoseErrorDtype = np.dtype([("rec_index", np.int64), ("ref_index", np.int64), ("time_step", np.int64), ("camera_id", np.int64),
+                                 ("dx", float), ("dy", float), ("dz", float), ("abs_error", float), ("distance", float),
+                                 ("rel_error", float), ("angle_error", float)])
+CameraPoseErrorGroupDtype = np.dtype([("key", np.int64), ("count", np.int64), ("mean_abs_error", float), ("std_abs_error", float),
+                                      ("max_abs_error", float), ("mean_rel_error", float), ("std_rel_error", float),
+                                      ("mean_angle_error", float), ("std_angle_error", float), ("max_angle_error", float)])
+
+def CameraPoseErrors(T_rec,T_ref,CorrespondingIndex,focuspoint=[0,0,1],TimeStep=None,CameraId=None):
+    # Pose errors of all reconstructed cameras in a few batched calls
+    #   T_rec: (N_rec,4,4), T_ref: (N_ref,4,4), CorrespondingIndex: (N_rec,) index of the reference camera (-1: not matched)
+    #   TimeStep, CameraId: (N_ref,) time step and camera id of the reference cameras (for the aggregates)
+    # Returns a structured array with one row per matched camera (CameraPoseErrorDtype, order of the reconstructed cameras)
+    # and the aggregates per time step and per camera id (CameraPoseErrorGroupDtype)
+    CorrespondingIndex = np.asarray(CorrespondingIndex, dtype=np.int64)
+    rec_index = np.flatnonzero(CorrespondingIndex >= 0); ref_index = CorrespondingIndex[rec_index]
+    T_rec = np.asarray(T_rec, dtype=float)[rec_index]; T_ref = np.asarray(T_ref, dtype=float)[ref_index]
+    location_rec, rotation_rec, _ = Get_Location_Rotation3x3_Scale_from_Transformation4x4_stacked(T_rec)
+    location_ref, rotation_ref, _ = Get_Location_Rotation3x3_Scale_from_Transformation4x4_stacked(T_ref)
+    errors = np.zeros(len(rec_index), dtype=CameraPoseErrorDtype)
+    errors["rec_index"] = rec_index; errors["ref_index"] = ref_index
+    errors["time_step"] = -1 if TimeStep is None else np.asarray(TimeStep)[ref_index]
+    errors["camera_id"] = -1 if CameraId is None else np.asarray(CameraId)[ref_index]
+    delta = location_rec - location_ref
+    errors["dx"] = delta[:,0]; errors["dy"] = delta[:,1]; errors["dz"] = delta[:,2]
+    errors["abs_error"] = np.linalg.norm(delta, axis=1)
+    errors["distance"] = np.linalg.norm(location_ref - np.asarray(focuspoint, dtype=float), axis=1)     # distance reference camera - focus point
+    errors["rel_error"] = errors["abs_error"] / errors["distance"]
+    errors["angle_error"] = np.rad2deg(GeodesicRotationDistance(rotation_rec, rotation_ref))
+    per_timestep = AggregateCameraPoseErrors(errors, "time_step")
+    per_camera = AggregateCameraPoseErrors(errors, "camera_id")
+    return errors, per_timestep, per_camera
+
+def AggregateCameraPoseErrors(errors,key):
+    # count, mean, std and max of the errors grouped by key ("time_step" or "camera_id") with bincount
+    keys, group = np.unique(errors[key], return_inverse=True)
+    aggregates = np.zeros(len(keys), dtype=CameraPoseErrorGroupDtype)
+    aggregates["key"] = keys
+    count = np.bincount(group, minlength=len(keys)); aggregates["count"] = count
+    for name in ("abs_error", "rel_error", "angle_error"):
+        mean = np.bincount(group, weights=errors[name], minlength=len(keys)) / count
+        aggregates["mean_"+name] = mean
+        if "std_"+name in aggregates.dtype.names:
+            var = np.bincount(group, weights=(errors[name]-mean[group])**2, minlength=len(keys)) / count
+            aggregates["std_"+name] = np.sqrt(var)
+        if "max_"+name in aggregates.dtype.names:
+            maximum = np.full(len(keys), -np.inf); np.maximum.at(maximum, group, errors[name])
+            aggregates["max_"+name] = maximum
+    return aggregates
+
+def SaveCameraPoseErrors(evaluation_path,errors,per_timestep,per_camera):
+    import pandas as pd
+    pd.DataFrame(errors).to_csv(Path(evaluation_path) / 'CamPoseErrors.csv', index=False)
+    pd.DataFrame(per_timestep).rename(columns={"key": "time_step"}).to_csv(Path(evaluation_path) / 'CamPoseErrorsPerTimeStep.csv', index=False)
+    pd.DataFrame(per_camera).rename(columns={"key": "camera_id"}).to_csv(Path(evaluation_path) / 'CamPoseErrorsPerCamera.csv', index=False)
+
 def PlotAbsPositionError_for_xyz(evaluation_path,pos_x,pos_y, DisplayPlots=False):
     fig, axs = plt.subplots(1, 3, figsize=(15, 5))
 
@@ -71,14 +134,9 @@ def PositionError(evaluation_path,pos_x,pos_y,outlier_criterion=0.005, focuspoin
     fig.savefig(Path(evaluation_path) / 'CamPositionError.pdf',format='pdf',bbox_inches='tight')
     return mean_error, std_deviation, mean_error_rel, std_deviation_rel, outliers_count
    
-def OrientationError(Rx,Ry,outlier_criterion_angle = 1):   
-    from scipy.spatial.transform import Rotation
-    angle_diff = np.zeros([len(Rx),1])
-    for i in range (len(Rx)):
-        rot_x = Rotation.from_matrix(Rx[i]) 
-        rot_y = Rotation.from_matrix(Ry[i])
-        rot_diff = rot_x.inv() * rot_y
-        angle_diff[i] = rot_diff.magnitude() * 180 / np.pi
+def OrientationError(Rx,Ry,outlier_criterion_angle = 1, DisplayPlots = True):   
+    # geodesic distance between the rotations of all cameras at once
+    angle_diff = np.rad2deg(GeodesicRotationDistance(np.asarray(Rx).reshape(-1,3,3), np.asarray(Ry).reshape(-1,3,3)))[:,None]
     fig = plt.figure(figsize=(5, 5))
     plt.hist(angle_diff, bins=15, color='skyblue', edgecolor='black')
     plt.xlabel(r"Rotation Difference $\alpha$ in $^\circ$")
@@ -91,4 +149,5 @@ def OrientationError(Rx,Ry,outlier_criterion_angle = 1):
     print(f"Standard deviation: {std_angle_deviation:.2f}°")
     print(f"Number of Inliers: {len(Rx)-outliers_count} (angle error <= {outlier_criterion_angle}°)")
     print(f"Number of Outliers: {outliers_count} (angle error > {outlier_criterion_angle}°)")
-    plt.show()
\ No newline at end of file
+    if DisplayPlots: plt.show()
+    return mean_angle_error, std_angle_deviation, outliers_count
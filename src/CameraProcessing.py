@@ -1,88 +1,294 @@
 from pathlib import Path
 import json
 import os
+import re
 import pandas as pd
 import numpy as np
 import importlib
 import sys
 importlib.reload(sys.modules['src.classes']) if 'src.classes' in sys.modules else None
-from src.classes import camera_reconstructed, camera_reference, object
+from src.classes import camera_reconstructed, camera_reference, object, CameraSet, ObjectTrajectory
 importlib.reload(sys.modules['src.TransMatrix_Utils']) if 'src.TransMatrix_Utils' in sys.modules else None
-from src.TransMatrix_Utils import Get_Location_Rotation3x3_Scale_from_Transformation4x4, RotationMatrix3x3_To_EulerAngles
+from src.TransMatrix_Utils import Get_Location_Rotation3x3_Scale_from_Transformation4x4, RotationMatrix3x3_To_EulerAngles, TransMatrix_from_EulerAngle_and_Location_stacked
 
 #-----------------------------------------------------------------------
-def read_camera_alignment_reconstruction(basebase_file_path_meshroom):
+def read_camera_alignment_reconstruction(basebase_file_path_meshroom,cams_ref=None,scaling_estimator=None,batch_size=16,CameraSetOutput=False):
     # load camera data from Meshroom
+    # scaling_estimator (e.g. IncrementalScalingFactor): is fed with the camera centers of complete timesteps while the SfM-File is read
+    # --> the matching reference cameras (cams_ref) are required, batch_size: number of complete timesteps per update
+    # CameraSetOutput: return the cameras as CameraSet (arrays) instead of a list of camera_reconstructed objects
     base_file_path_meshroom = Path(basebase_file_path_meshroom) / 'MeshroomCache' / 'StructureFromMotion'
     folder_name = os.listdir(base_file_path_meshroom)
     sfm_data_path =  base_file_path_meshroom / folder_name[0] / "cameras.sfm"
+    ImageFileNames = []; Poses = []
     if sfm_data_path.is_file():
-        with open(sfm_data_path, 'r') as file:
-            sfm_data = json.load(file)
-        # save all camera objects in a list    
-        cams_rec = []
-        n_img = len(sfm_data["views"])
-        n_pose = len(sfm_data["poses"])
-        for i in range(n_pose):
-            Pose = sfm_data["poses"][i]["pose"]["transform"]
-            poseId = sfm_data["poses"][i]["poseId"]
-            for j in range(n_img):
-                viewId = sfm_data["views"][j]["viewId"]
-                if poseId == viewId:
-                    img_path = sfm_data["views"][j]["path"]
-                    ImageFileName = os.path.basename(img_path)
-                    break
-            cam = camera_reconstructed(ImageFileName,Pose)
-            cams_rec.append(cam)
-    else: cams_rec = []; print("Warning: SfM-File is not existing. Reconstruction not successful.")
-    return cams_rec
+        feeder = _TimeStepFeeder(cams_ref,scaling_estimator,batch_size) if scaling_estimator is not None else None
+        for ImageFileName, Pose in read_sfm_poses(sfm_data_path):
+            ImageFileNames.append(ImageFileName); Poses.append(Pose)
+            if feeder is not None: feeder.add(ImageFileName,np.asarray(Pose["center"],dtype=float))
+        if feeder is not None: feeder.flush()
+    else: print("Warning: SfM-File is not existing. Reconstruction not successful.")
+    if CameraSetOutput:
+        Location = np.array([Pose["center"] for Pose in Poses], dtype=float).reshape(-1,3)
+        Rotation = np.array([Pose["rotation"] for Pose in Poses], dtype=float).reshape(-1,3,3)
+        return CameraSet(ImageFileNames,Location,Rotation=Rotation,reconstructed=True)
+    # save all camera objects in a list
+    return [camera_reconstructed(ImageFileName,Pose) for ImageFileName, Pose in zip(ImageFileNames,Poses)]
+
+class _TimeStepFeeder:
+    # Collects the reconstructed camera centers per timestep while the poses are parsed
+    # A timestep is passed to the scaling estimator as soon as all of its cameras are reconstructed,
+    # the remaining (incomplete) timesteps are passed at the end of the SfM-File
+    def __init__(self, cams_ref, scaling_estimator, batch_size):
+        self.estimator = scaling_estimator
+        self.batch_size = batch_size
+        self.n_cam = scaling_estimator.n_cam
+        n_TimeSteps = len(cams_ref) // self.n_cam
+        n = n_TimeSteps*self.n_cam
+        # reference cameras are ordered by timestep --> index k of a camera: timestep k // n_cam, camera k % n_cam
+        self.index = {}
+        if isinstance(getattr(cams_ref,"Location",None), np.ndarray):       # array-backed cameras (CameraSet)
+            for k, ImageFileName in enumerate(cams_ref.ImageFileName[:n]): self.index.setdefault(ImageFileName, k)
+            self.pos_ref = cams_ref.Location[:n].reshape(n_TimeSteps,self.n_cam,3)
+        else:
+            for k in range(n): self.index.setdefault(cams_ref[k].ImageFileName, k)
+            self.pos_ref = np.array([cams_ref[k].Location for k in range(n)], dtype=float).reshape(n_TimeSteps,self.n_cam,3)
+        self.pos_rec = np.zeros([n_TimeSteps,self.n_cam,3])
+        self.IsReconstructed = np.zeros([n_TimeSteps,self.n_cam], dtype=bool)
+        self.IsFed = np.zeros(n_TimeSteps, dtype=bool)
+        self.complete = []
+
+    def add(self, ImageFileName, Location):
+        k = self.index.get(ImageFileName)
+        if k is None: return
+        t, c = divmod(k, self.n_cam)
+        if self.IsReconstructed[t,c]: return                # only the first reconstructed camera of an image is used (as in match_cameras)
+        self.pos_rec[t,c] = Location; self.IsReconstructed[t,c] = True
+        if self.IsReconstructed[t].all():
+            self.complete.append(t)
+            if len(self.complete) >= self.batch_size: self.feed(self.complete)
+
+    def flush(self):
+        self.feed(np.flatnonzero(~self.IsFed))
+
+    def feed(self, TimeSteps):
+        TimeSteps = np.asarray(TimeSteps, dtype=np.int64)
+        if len(TimeSteps) > 0:
+            self.estimator.add_batch(self.pos_ref[TimeSteps],self.pos_rec[TimeSteps],self.IsReconstructed[TimeSteps])
+            self.IsFed[TimeSteps] = True
+            result = self.estimator.result()
+            if result is not None:
+                print(f"Scaling factor after {result['timesteps']} of {len(self.IsFed)} timesteps: {result['median']:.5f}")
+        self.complete = []
+#-----------------------------------------------------------------------
+def read_sfm_poses(sfm_data_path):
+    # Generator over the reconstructed poses of a Meshroom sfm file: (ImageFileName, Pose["pose"]["transform"])
+    # Only the sections "views" and "poses" are decoded, all other sections (intrinsics, structure, ...) are skipped
+    # The image path of a pose is found with a hash index viewId --> path, which is built once
+    path_index = None; poses_before_views = []
+    for key, elements in read_sfm_sections(sfm_data_path, ("views","poses")):
+        if key == "views":
+            path_index = {view["viewId"]: view["path"] for view in elements}
+        elif path_index is None:
+            poses_before_views = list(elements)             # unusual order of the sections --> keep poses until the views are read
+        else:
+            yield from _assign_image_file_names(elements, path_index)
+    if poses_before_views:
+        yield from _assign_image_file_names(poses_before_views, path_index or {})
+
+def _assign_image_file_names(poses, path_index):
+    for pose in poses:
+        img_path = path_index.get(pose["poseId"])
+        if img_path is None:
+            print(f"Warning: No view found for pose {pose['poseId']}. Pose is skipped.")
+            continue
+        yield os.path.basename(img_path), pose["pose"]["transform"]
 #-----------------------------------------------------------------------
-def read_camera_alignment_reference(base_file_path_blender):
+def read_sfm_sections(sfm_data_path, keys, chunk_size=2**20):
+    # Generator over the requested top-level sections of a (large) sfm file: (key, iterator over the array elements)
+    # The file is read in chunks of chunk_size characters. The elements of the requested arrays are decoded one after another,
+    # all other sections (e.g. structure) are passed over by a bracket/string-aware scanner without building any objects
+    with open(sfm_data_path, 'r') as file:
+        stream = _JsonStream(file, chunk_size)
+        if stream.peek() != "{": raise ValueError(f"Invalid SfM-File: {sfm_data_path}")
+        stream.pos += 1
+        while stream.peek() != "}":
+            key = stream.read_value()
+            stream.peek(); stream.pos += 1                  # skip ":"
+            if key in keys and stream.peek() == "[":
+                stream.pos += 1
+                state = {"skip": False}
+                elements = _array_elements(stream, state)
+                yield key, elements
+                state["skip"] = True                        # elements that were not requested by the caller are only scanned
+                for _ in elements: pass
+            else:
+                stream.skip_value()                         # skip the section
+            if stream.peek() == ",": stream.pos += 1
+
+def _array_elements(stream, state):
+    # decode the elements of a json array one after another, the stream is positioned after the array afterwards
+    while stream.peek() != "]":
+        if state["skip"]: stream.skip_value()
+        else: yield stream.read_value()
+        if stream.peek() == ",": stream.pos += 1
+    stream.pos += 1
+
+_WHITESPACE = re.compile(r'\s*')
+_STRUCTURE_TOKEN = re.compile(r'[][{}"]')                   # tokens outside of a string
+_STRING_TOKEN = re.compile(r'["\\]')                        # tokens inside of a string
+_SCALAR_END = re.compile(r'[,}\]\s]')
+
+class _JsonStream:
+    # Buffered json text of a file, which is read chunk by chunk
+    # pos is the current position in the buffer, everything before pos is consumed and dropped with the next chunk
+    def __init__(self, file, chunk_size):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+
+    def fill(self):
+        # read the next chunk, returns the number of dropped characters (None at the end of the file)
+        chunk = self.file.read(self.chunk_size)
+        if not chunk: return None
+        dropped = self.pos
+        self.buffer = self.buffer[dropped:] + chunk; self.pos = 0
+        return dropped
+
+    def peek(self):
+        # next character that is not a whitespace, pos is moved to this character
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer): return self.buffer[self.pos]
+            if self.fill() is None: raise ValueError("Unexpected end of the SfM-File")
+
+    def read_value(self):
+        end = self.scan(keep=True)
+        value = json.loads(self.buffer[self.pos:end])
+        self.pos = end
+        return value
+
+    def skip_value(self):
+        self.pos = self.scan(keep=False)
+
+    def scan(self, keep):
+        # end position of the value starting at the next character, the buffer is extended as far as necessary
+        # keep=False: the scanned characters are not needed --> they are dropped while scanning
+        first = self.peek()
+        i = self.pos
+        if first not in '{["':                              # number, true, false, null
+            while True:
+                m = _SCALAR_END.search(self.buffer, i)
+                if m is not None: return m.start()
+                i = len(self.buffer)
+                dropped = self.fill()
+                if dropped is None: return len(self.buffer)
+                i -= dropped
+        depth = 0; in_string = False; escape = False
+        while True:
+            if escape and i < len(self.buffer):
+                i += 1; escape = False                      # escaped character inside of a string
+            m = None if escape else (_STRING_TOKEN if in_string else _STRUCTURE_TOKEN).search(self.buffer, i)
+            if m is None:                                   # the value continues in the next chunk
+                if not keep: self.pos = len(self.buffer)
+                i = len(self.buffer)
+                dropped = self.fill()
+                if dropped is None: raise ValueError("Unexpected end of the SfM-File")
+                i -= dropped
+                continue
+            token = m.group(); i = m.end()
+            if in_string:
+                if token == "\\": escape = True
+                else:
+                    in_string = False
+                    if depth == 0: return i
+            elif token == '"': in_string = True
+            elif token in "{[": depth += 1
+            else:
+                depth -= 1
+                if depth == 0: return i
+
+#-----------------------------------------------------------------------
+def read_camera_alignment_reference(base_file_path_blender,UseSidecar=False,CameraSetOutput=False):
     # load camera data from blender
-    cams_ref = []
     cam_pos_file_path = Path(base_file_path_blender) / "CameraPositioningInMeters.csv"
-    cam_pos_blender = pd.read_csv(cam_pos_file_path)
-    cam_pos_blender["TimeStep"] -= cam_pos_blender["TimeStep"][0]-1 # Adjusts the time step --> starts from 1
-    for i in range(len(cam_pos_blender)):         # Iterates over all images
-        cam = cam_pos_blender.iloc[i]
-        ImageFileName = cam["ImageFileName"]
-        TimeStep = cam["TimeStep"]
-        Location = [cam["PositionX"],cam["PositionY"],cam["PositionZ"]]
-        EulerAngle = [cam["RotationEulerX"],cam["RotationEulerY"],cam["RotationEulerZ"]]
-        cam = camera_reference(ImageFileName,Location,EulerAngle,TimeStep)
-        cam.CorrespondigIndexObject = TimeStep-1
-        cam.Transformation2WorldCoordinateSystem()
+    columns = read_pose_columns(cam_pos_file_path,UseSidecar)
+    TimeStep = columns["TimeStep"] - (columns["TimeStep"][0]-1)     # Adjusts the time step --> starts from 1
+    # transformation of Blender camera coordinate convention into camera plot convention (180° around the x-axis), all cameras at once
+    EulerAngle_plot = columns["EulerAngle"].copy(); EulerAngle_plot[:,0] += np.deg2rad(180)
+    transformation_4x4 = TransMatrix_from_EulerAngle_and_Location_stacked(columns["Location"],EulerAngle_plot)
+    if CameraSetOutput:
+        return CameraSet(columns["ImageFileName"],columns["Location"],EulerAngle=columns["EulerAngle"],TimeStep=TimeStep,
+                         CorrespondigIndexObject=TimeStep-1,TransformationStatic=transformation_4x4.copy(),TransformationDynamic=transformation_4x4)
+    cams_ref = []
+    for i in range(len(TimeStep)):         # Iterates over all images
+        cam = camera_reference(str(columns["ImageFileName"][i]),list(columns["Location"][i]),list(columns["EulerAngle"][i]),TimeStep[i])
+        cam.CorrespondigIndexObject = TimeStep[i]-1
+        # saving the matrix, could be dynamic or static case
+        cam.TransformationDynamic = transformation_4x4[i]; cam.TransformationStatic = transformation_4x4[i]
         cams_ref.append(cam)
     return cams_ref
 #-----------------------------------------------------------------------
-def read_object_alignment(base_file_path_blender):
-    objects = []
+def read_object_alignment(base_file_path_blender,UseSidecar=False,ObjectTrajectoryOutput=False):
     path = Path(base_file_path_blender) / "ObjectPositioningInMeters.csv"
     if path.exists():
-        obj_positions = pd.read_csv(path)
-        obj_positions["TimeStep"] -= obj_positions["TimeStep"][1]-1 # Adjusts the time step --> starts from 1
-        obj_positions.at[0, "TimeStep"] = 0
-        for i in range(len(obj_positions)):
-            obj = obj_positions.iloc[i]
-            TimeStep = obj["TimeStep"]
-            Location = np.array([obj["PositionX"],obj["PositionY"],obj["PositionZ"]])
-            EulerAngle =  np.array([obj["RotationEulerX"],obj["RotationEulerY"],obj["RotationEulerZ"]])
-            obj = object(TimeStep,Location,EulerAngle)
-            obj.Transformation2WorldCoordinateSystem()
+        columns = read_pose_columns(path,UseSidecar)
+        TimeStep = columns["TimeStep"] - (columns["TimeStep"][1]-1)     # Adjusts the time step --> starts from 1
+        TimeStep[0] = 0
+        transformation_4x4 = TransMatrix_from_EulerAngle_and_Location_stacked(columns["Location"],columns["EulerAngle"])
+        if ObjectTrajectoryOutput:
+            objects = ObjectTrajectory(TimeStep,columns["Location"],columns["EulerAngle"],transformation_4x4)
+            return ObjectTrajectory(TimeStep[1:],columns["Location"][1:],columns["EulerAngle"][1:],transformation_4x4[1:]), objects[0]
+        objects = []
+        for i in range(len(TimeStep)):
+            obj = object(TimeStep[i],columns["Location"][i],columns["EulerAngle"][i],transformation_4x4[i])
             objects.append(obj)
         return objects[1:],objects[0]    
     else: 
         return None,None 
+#-----------------------------------------------------------------------
+def read_pose_columns(csv_path,UseSidecar=False):
+    # read the pose file of Blender (camera or object positioning) into typed numpy columns
+    # UseSidecar: the columns are stored in a binary file (.npz) next to the csv file and reused as long as the csv file is not newer
+    csv_path = Path(csv_path)
+    sidecar_path = csv_path.with_suffix(".npz")
+    if UseSidecar and sidecar_path.is_file() and sidecar_path.stat().st_mtime >= csv_path.stat().st_mtime:
+        with np.load(sidecar_path, allow_pickle=False) as data:
+            return {key: data[key] for key in data.files}
+    data = pd.read_csv(csv_path)
+    columns = {
+        "TimeStep": data["TimeStep"].to_numpy(dtype=np.int64),
+        "Location": data[["PositionX","PositionY","PositionZ"]].to_numpy(dtype=float),
+        "EulerAngle": data[["RotationEulerX","RotationEulerY","RotationEulerZ"]].to_numpy(dtype=float)
+    }
+    if "ImageFileName" in data.columns:
+        columns["ImageFileName"] = data["ImageFileName"].to_numpy(dtype=str)
+    if UseSidecar:
+        try: np.savez(sidecar_path, **columns)
+        except OSError as e: print(f"Warning: Sidecar file could not be written: {e}")
+    return columns
     
 #-----------------------------------------------------------------------   
 def match_cameras(cams_rec,cams_ref):
+    # For each reference camera find the corresponding reconstructed camera using the image file name as comparator (hash join)
+    rec_index = {}
+    if isinstance(getattr(cams_rec,"CorrespondigIndex",None), np.ndarray) and isinstance(getattr(cams_ref,"CorrespondigIndex",None), np.ndarray):
+        # array-backed cameras: the mapping is written into the index arrays of both sets at once
+        for j,ImageFileName in enumerate(cams_rec.ImageFileName): rec_index.setdefault(ImageFileName, j)
+        j = np.array([rec_index.get(ImageFileName,-1) for ImageFileName in cams_ref.ImageFileName], dtype=np.int64)
+        i = np.flatnonzero(j >= 0); j = j[i]
+        cams_ref.CorrespondigIndex[i] = j;   cams_rec.CorrespondigIndex[j] = i
+        cams_rec.TimeStep[j] = cams_ref.TimeStep[i]
+        return cams_rec, cams_ref
+    for j,cam_rec in enumerate(cams_rec):
+        rec_index.setdefault(cam_rec.ImageFileName, j)     # first reconstructed camera with this image file name
     for i, cam_ref in enumerate(cams_ref):      # Iterates over all images (reference)
-        for j,cam_rec in enumerate(cams_rec):       # For each reference camera find the corresponding reconstructed camera using the image file name as comparator 
-            if cam_rec.ImageFileName == cam_ref.ImageFileName:
-                cam_ref.CorrespondigIndex = j;   cam_rec.CorrespondigIndex = i    # Save the mapping of the images
-                cam_rec.TimeStep = cam_ref.TimeStep
-                cams_ref[i] = cam_ref; cams_rec[j] = cam_rec;     
-                break
+        j = rec_index.get(cam_ref.ImageFileName)
+        if j is not None:
+            cam_rec = cams_rec[j]
+            cam_ref.CorrespondigIndex = j;   cam_rec.CorrespondigIndex = i    # Save the mapping of the images
+            cam_rec.TimeStep = cam_ref.TimeStep
     return cams_rec, cams_ref  
 #-----------------------------------------------------------------------
 def ExportCameras2Blender(cams,evaluation_path, static_scene = True):
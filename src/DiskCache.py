@@ -0,0 +1,77 @@
+import numpy as np
+import hashlib
+import json
+import os
+from pathlib import Path
+
+# -----------------------------------------------------------------------
+_FileHashes = {}        # (path, size, mtime) --> content hash, avoids hashing the same file again in one session
+
+def FileContentHash(path, chunk_size=2**20):
+    # sha256 of the file content (independent of file name and location)
+    path = Path(path); stat = path.stat()
+    file_id = (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+    if file_id not in _FileHashes:
+        h = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                h.update(chunk)
+        _FileHashes[file_id] = h.hexdigest()
+    return _FileHashes[file_id]
+
+# -----------------------------------------------------------------------
+class DiskCache:
+    # Persistent cache of numpy arrays (one .npz file per entry) with LRU eviction and a size cap
+    # The last access of an entry is its file modification time --> no index file, several processes can share the cache
+    def __init__(self, cache_dir, max_size_bytes=500*2**20):
+        self.cache_dir = Path(cache_dir)
+        self.max_size_bytes = max_size_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(**parts):
+        # key of an entry from its describing parameters (content hash, voxel size, sampling parameters, ...)
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+    def path(self, key):
+        return self.cache_dir / (key + ".npz")
+
+    def get(self, key):
+        # dict of arrays or None (cache miss / broken entry)
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError, EOFError):
+            return None
+        try: os.utime(path)         # mark as recently used
+        except OSError: pass
+        return arrays
+
+    def put(self, key, arrays):
+        # write to a temporary file first, so that other processes never read half written entries
+        path = self.path(key)
+        tmp_path = self.cache_dir / f"{key}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        # delete the least recently used entries until the cache is smaller than the size cap
+        entries = []
+        for path in self.cache_dir.glob("*.npz"):
+            if path.name.endswith(".tmp.npz"): continue
+            try: stat = path.stat()
+            except OSError: continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total_size <= self.max_size_bytes: break
+            if keep is not None and path == keep: continue
+            try: path.unlink(); total_size -= size
+            except OSError: pass
+        return total_size
+
+    def clear(self):
+        for path in self.cache_dir.glob("*.npz"):
+            path.unlink(missing_ok=True)
@@ -1,55 +1,159 @@
-import trimesh
-import copy
 from tabulate import tabulate
 import numpy as np
 import pandas as pd
+from scipy.spatial import ConvexHull, cKDTree
+import importlib
+import sys
+importlib.reload(sys.modules['src.MeshStore']) if 'src.MeshStore' in sys.modules else None
+from src.MeshStore import LoadMesh
 
-def EvaluateVolumeSurfaceArea(evaluation_path,mesh_gt_path,T_global,T):
-    # Load reconstructed mesh and apply transformation (scaling factor)
-    tri_mesh_r_path = evaluation_path / "texturedMesh.obj"
-    if (tri_mesh_r_path.is_file()) and (T is not None) and (T_global is not None):
-        tri_mesh_r = trimesh.load_mesh(tri_mesh_r_path)
-        tri_mesh_r_cc = copy.deepcopy(tri_mesh_r)
-        tri_mesh_r.apply_transform(T_global)
-        tri_mesh_r_cc.apply_transform(T)
-        flag_rec = True
-    else:  flag_rec = False; print("Warning: Morphological parameters could not be determined for the reconstructed object.")
+# Morphology of a mesh under similarity transformations x' = s*R*x + t without transforming (or copying) the mesh:
+# the base quantities are computed once from the untransformed arrays, the values for any number of transformations follow from
+# the scale s (and the rotation R):  volume ~ s³, area ~ s², lengths ~ s, second moments ~ s⁵ (axes rotated with R)
+MorphologyDtype = np.dtype([("scale", float), ("volume", float), ("surface", float), ("sauter_diameter", float),
+                            ("surf2vol", float), ("sphericity", float), ("hull_volume", float), ("solidity", float),
+                            ("feret_max", float), ("feret_min", float), ("centroid", float, (3,)),
+                            ("principal_moments", float, (3,)), ("principal_axes", float, (3,3))])
+MorphologyHeaders = {"volume": "Volume (m^3)", "surface": "Surface Area (m^2)", "sauter_diameter": "Sauter Diameter (mm)",
+                     "surf2vol": "Specific Surface Area (m^2/m^3)", "sphericity": "Sphericity [-]", "hull_volume": "Convex Hull Volume (m^3)",
+                     "solidity": "Solidity [-]", "feret_max": "Max. Feret Diameter (m)", "feret_min": "Min. Feret Diameter (m)"}
+
+# -----------------------------------------------------------------------
+def MeshMoments(vertices, triangles, chunk_size=1024):
+    # base quantities of a closed triangle mesh (untransformed), vectorized over all triangles
+    # volume and moments from the signed tetrahedra (origin, v0, v1, v2): V = Σ det/6, ∫x dV = Σ det/24 (v0+v1+v2),
+    # ∫x xᵀ dV = Σ det/120 (Σ vi viᵀ + s sᵀ) with s = v0+v1+v2
+    vertices = np.asarray(vertices, dtype=float); triangles = np.asarray(triangles, dtype=np.int64)
+    v0 = vertices[triangles[:,0]]; v1 = vertices[triangles[:,1]]; v2 = vertices[triangles[:,2]]
+    cross = np.cross(v1 - v0, v2 - v0)
+    area = float(np.linalg.norm(cross, axis=1).sum() / 2)
+    det = np.einsum('ij,ij->i', v0, np.cross(v1, v2))
+    volume = float(det.sum() / 6)
+    s = v0 + v1 + v2
+    centroid = (det @ s) / (24*volume)
+    second_moment = (np.einsum('n,ni,nj->ij', det, v0, v0) + np.einsum('n,ni,nj->ij', det, v1, v1) + np.einsum('n,ni,nj->ij', det, v2, v2)
+                     + np.einsum('n,ni,nj->ij', det, s, s)) / 120
+    second_moment -= volume * np.outer(centroid, centroid)          # central second moment (about the centroid)
+    # convex hull and Feret diameters (calipers on the hull): max --> largest distance of two hull vertices,
+    # min --> smallest width of the hull (facet / antipodal vertex pairs and antipodal edge / edge pairs)
+    hull = ConvexHull(vertices)
+    feret_max = FeretDiameterMax(vertices[hull.vertices], chunk_size)
+    feret_min = FeretDiameterMin(hull, chunk_size)
+    return {"volume": volume, "area": area, "centroid": centroid, "second_moment": second_moment,
+            "hull_volume": float(hull.volume), "feret_max": feret_max, "feret_min": float(feret_min)}
+
+def FeretDiameterMax(points, chunk_size=1024):
+    # largest distance of two points, evaluated block by block (chunk_size x chunk_size distances at a time --> bounded memory)
+    # the points are sorted along their main axis, so that the blocks are compact: block pairs are visited in the order of the
+    # upper bound of their distance (bounding boxes) and the search stops as soon as no block pair can exceed the current maximum
+    points = np.asarray(points, dtype=float)
+    points = points - points.mean(axis=0)                          # centered --> no cancellation in |a|² + |b|² - 2 a·b
+    axis = np.linalg.svd(points, full_matrices=False)[2][0]
+    points = points[np.argsort(points @ axis)]
+    starts = np.arange(0, len(points), chunk_size)
+    lower = np.array([points[i:i+chunk_size].min(axis=0) for i in starts])
+    upper = np.array([points[i:i+chunk_size].max(axis=0) for i in starts])
+    block_i, block_j = np.triu_indices(len(starts))
+    bound = np.sum(np.maximum(np.abs(upper[block_j] - lower[block_i]), np.abs(upper[block_i] - lower[block_j]))**2, axis=1)
+    norm_sq = np.einsum('ij,ij->i', points, points)
+    feret_max_sq = 0.0
+    for k in np.argsort(-bound):
+        if bound[k] <= feret_max_sq: break
+        i = starts[block_i[k]]; j = starts[block_j[k]]
+        d_sq = norm_sq[i:i+chunk_size,None] + norm_sq[None,j:j+chunk_size] - 2*points[i:i+chunk_size] @ points[j:j+chunk_size].T
+        feret_max_sq = max(feret_max_sq, float(d_sq.max()))
+    return float(np.sqrt(feret_max_sq))
+
+def FeretDiameterMin(hull, chunk_size=1024, eps=1e-12, h_short=0.1):
+    # smallest width of a convex polyhedron: the minimum is reached perpendicular to a facet (facet / antipodal vertex) or
+    # perpendicular to two edges (antipodal edge / edge pair) --> both candidate sets, block by block (bounded memory)
+    points = hull.points[hull.vertices]; normals = hull.equations[:,:3]
+    feret_min = np.inf
+    for start in range(0, len(hull.equations), chunk_size):
+        eq = hull.equations[start:start+chunk_size]
+        depth = np.zeros(len(eq))                                   # largest distance of a hull vertex behind each facet
+        for start_p in range(0, len(points), chunk_size):
+            depth = np.maximum(depth, -(points[start_p:start_p+chunk_size] @ eq[:,:3].T + eq[:,3]).min(axis=0))
+        feret_min = min(feret_min, float(depth.min()))
+    # hull edges (once per pair of neighbouring facets), edges inside a flat face are covered by the facet widths
+    facet = np.repeat(np.arange(len(hull.simplices)), 3); neighbour = hull.neighbors.ravel()
+    opposite = np.tile(np.arange(3), len(hull.simplices))
+    start_vertex = hull.simplices[facet, (opposite+1) % 3]; end_vertex = hull.simplices[facet, (opposite+2) % 3]
+    n_a = normals[facet]; n_b = normals[neighbour]
+    keep = (facet < neighbour) & (np.einsum('ij,ij->i', n_a, n_b) < 1 - eps)
+    a = hull.points[start_vertex[keep]]; d = hull.points[end_vertex[keep]] - a; n_a = n_a[keep]; n_b = n_b[keep]
+    orientation = np.sign(np.einsum('ij,ij->i', np.cross(n_a, n_b), d))    # the normal cone of an edge is the arc n_a --> n_b
+    # candidate pairs from the Gauss map: the arc of edge i (centre m_i, half angle h_i) has to meet the mirrored arc of edge j
+    # --> |angle(m_i, -m_j)| <= h_i + h_j, searched in a KD-tree of the mirrored centres of the edges with short arcs (h_j <= h_short),
+    # the few edges with long arcs (e.g. the border of large flat faces) are paired with all edges
+    m = n_a + n_b; m /= np.linalg.norm(m, axis=1, keepdims=True)
+    half = np.arccos(np.clip(np.einsum('ij,ij->i', n_a, n_b), -1, 1)) / 2
+    short = half <= h_short
+    ind_short = np.flatnonzero(short); ind_long = np.flatnonzero(~short)
+    radius = 2*np.sin(np.minimum(half + h_short, np.pi/2)) + eps                 # chord length of the angle h_i + h_short
+    neighbours = cKDTree(-m[ind_short]).query_ball_point(m, radius, return_sorted=False) if len(ind_short) else [[] for _ in m]
+    counts = np.array([len(k) for k in neighbours])
+    pair_i = np.concatenate([np.repeat(np.arange(len(a)), counts), np.repeat(np.arange(len(a)), len(ind_long))])
+    pair_j = np.concatenate([ind_short[np.concatenate(neighbours).astype(np.int64)] if counts.sum() else np.empty(0, dtype=np.int64),
+                             np.tile(ind_long, len(a))])
+    def InNormalCone(n, k):
+        # n (perpendicular to the direction of edge k) lies on the arc between the normals of the two facets of the edge
+        tol = -eps*np.linalg.norm(d[k], axis=1)
+        return ((np.einsum('ij,ij->i', np.cross(n_a[k], n), d[k])*orientation[k] >= tol) &
+                (np.einsum('ij,ij->i', np.cross(n, n_b[k]), d[k])*orientation[k] >= tol))
+    for start in range(0, len(pair_i), chunk_size**2):
+        i = pair_i[start:start+chunk_size**2]; j = pair_j[start:start+chunk_size**2]
+        n = np.cross(d[i], d[j])                                    # direction perpendicular to both edges
+        length = np.linalg.norm(n, axis=1)
+        parallel = length <= eps*np.linalg.norm(d[i], axis=1)*np.linalg.norm(d[j], axis=1)
+        n /= np.where(parallel, 1, length)[:,None]
+        width = np.einsum('ij,ij->i', a[i] - a[j], n)
+        n *= np.where(width < 0, -1, 1)[:,None]; width = np.abs(width)      # edge i on the side of n, edge j opposite
+        antipodal = ~parallel & InNormalCone(n, i) & InNormalCone(-n, j)
+        if antipodal.any(): feret_min = min(feret_min, float(width[antipodal].min()))
+    return feret_min
 
-    # Load ground truth mesh
+def MorphologyUnderTransforms(moments, T):
+    # morphology of the mesh transformed with each similarity transformation T (K,4,4) or (4,4) --> structured array (K,) MorphologyDtype
+    T = np.asarray(T, dtype=float).reshape(-1,4,4)
+    det = np.linalg.det(T[:,:3,:3])
+    scale = np.cbrt(np.abs(det)); R = T[:,:3,:3] / scale[:,None,None]
+    record = np.zeros(len(T), dtype=MorphologyDtype)
+    record["scale"] = scale
+    record["volume"] = np.sign(det) * moments["volume"] * scale**3
+    record["surface"] = moments["area"] * scale**2
+    record["sauter_diameter"] = 6 * record["volume"] / record["surface"] * 1000
+    record["surf2vol"] = record["surface"] / record["volume"]
+    # sphericity (how closely the shape of an object resembles that of a perfect sphere)
+    record["sphericity"] = np.pi**(1/3) * (6*record["volume"])**(2/3) / record["surface"]
+    record["hull_volume"] = moments["hull_volume"] * scale**3
+    record["solidity"] = record["volume"] / record["hull_volume"]
+    record["feret_max"] = moments["feret_max"] * scale; record["feret_min"] = moments["feret_min"] * scale
+    record["centroid"] = np.einsum('kij,j->ki', T[:,:3,:3], moments["centroid"]) + T[:,:3,3]
+    # inertia tensor (unit density) of the untransformed mesh: I = tr(M) E - M, principal moments ~ s⁵, principal axes rotated with R
+    M = moments["second_moment"]
+    moments_0, axes_0 = np.linalg.eigh(np.trace(M)*np.eye(3) - M)
+    record["principal_moments"] = np.abs(det)[:,None]**(5/3) * moments_0
+    record["principal_axes"] = R @ axes_0
+    return record
+
+# -----------------------------------------------------------------------
+def EvaluateVolumeSurfaceArea(evaluation_path,mesh_gt_path,T_global,T):
+    # Morphology of the reconstructed mesh (scaled with the global registration T_global and the fine registration T) and of the
+    # ground truth mesh --> dict {"rec", "rec_CC", "ref"} of records (MorphologyDtype), None if the mesh does not exist
+    morphology = {"rec": None, "rec_CC": None, "ref": None}
+    mesh_r_path = evaluation_path / "texturedMesh.obj"
+    if (mesh_r_path.is_file()) and (T is not None) and (T_global is not None):
+        mesh_r = LoadMesh(mesh_r_path)
+        morphology["rec"], morphology["rec_CC"] = MorphologyUnderTransforms(MeshMoments(mesh_r.vertices, mesh_r.triangles), [T_global, T])
+    else: print("Warning: Morphological parameters could not be determined for the reconstructed object.")
     if mesh_gt_path.is_file():
-        tri_mesh_gt = trimesh.load_mesh(mesh_gt_path)
-        flag_gt = True
-    else:  flag_gt = False; print("Warning: Morphological parameters could not be determined for the reference object.")
-    # calculate volume
-    volume_r = tri_mesh_r.volume if flag_rec else None
-    volume_gt = tri_mesh_gt.volume if flag_gt else None
-    volume_r_cc = tri_mesh_r_cc.volume if flag_rec else None
-    # calculate surface area
-    surface_area_r = tri_mesh_r.area if flag_rec else None
-    surface_area_gt = tri_mesh_gt.area if flag_gt else None
-    surface_area_r_cc = tri_mesh_r_cc.area if flag_rec else None
-    # calculate sauter diameter
-    sauter_diameter_r = 6 * volume_r / surface_area_r *1000 if flag_rec else None
-    sauter_diameter_gt = 6 * volume_gt / surface_area_gt * 1000 if flag_gt else None
-    sauter_diameter_r_cc = 6 * volume_r_cc / surface_area_r_cc *1000 if flag_rec else None
-    # calculate specific surface area
-    specific_surface_r =  surface_area_r / volume_r if flag_rec else None
-    specific_surface_gt =  surface_area_gt / volume_gt if flag_gt else None
-    specific_surface_r_cc = surface_area_r_cc / volume_r_cc  if flag_rec else None
-    # calculate sphericity (how closely the shape of an object resembles that of a perfect sphere)
-    sphericity_r = np.pi**(1/3)*(6*volume_r)**(2/3)/surface_area_r if flag_rec else None
-    sphericity_gt = np.pi**(1/3)*(6*volume_gt)**(2/3)/surface_area_gt if flag_gt else None
-    sphericity_r_cc = np.pi**(1/3)*(6*volume_r_cc)**(2/3)/surface_area_r_cc if flag_rec else None 
-    # Define the data as a list of lists
-    data = [
-        ["Reconstructed Obj.", volume_r, surface_area_r, sauter_diameter_r,specific_surface_r,sphericity_r],
-        ["Reconstructed Obj. (Scaling by CloudCompare)", volume_r_cc, surface_area_r_cc, sauter_diameter_r_cc,specific_surface_r_cc,sphericity_r_cc],
-        ["Ground Truth", volume_gt, surface_area_gt, sauter_diameter_gt,specific_surface_gt,sphericity_gt]
-    ]
-    # Define the headers with units
-    headers = ["Object", f"Volume (m^3)", f"Surface Area (m^2)", f"Sauter Diameter (mm)","Specific Surface Area (m^2/m^3)","Sphericity [-]"]
-    # Print the data as a tabled
-    dataframe = pd.DataFrame(data, columns=headers)
+        mesh_gt = LoadMesh(mesh_gt_path)
+        morphology["ref"] = MorphologyUnderTransforms(MeshMoments(mesh_gt.vertices, mesh_gt.triangles), np.eye(4))[0]
+    else: print("Warning: Morphological parameters could not be determined for the reference object.")
+    # Print the data as a table
+    names = {"rec": "Reconstructed Obj.", "rec_CC": "Reconstructed Obj. (Scaling by CloudCompare)", "ref": "Ground Truth"}
+    data = [[names[key]] + [None if record is None else float(record[field]) for field in MorphologyHeaders] for key, record in morphology.items()]
+    dataframe = pd.DataFrame(data, columns=["Object"] + list(MorphologyHeaders.values()))
     print(tabulate(dataframe, headers='keys', tablefmt='pretty', showindex=False))
-
-    return dataframe
\ No newline at end of file
+    return morphology
@@ -0,0 +1,244 @@
+import numpy as np
+import itertools
+import json
+import time
+from pathlib import Path
+from scipy.spatial import cKDTree
+import importlib
+import sys
+importlib.reload(sys.modules['src.MeshStore']) if 'src.MeshStore' in sys.modules else None
+from src.MeshStore import LoadMesh
+
+# In-process replacement of the CloudCompare stage (FineMeshRegistration_and_MeshToMeshDistance):
+#   scaled point to plane ICP of the reconstructed mesh onto the ground truth mesh and exact cloud to mesh distances
+#   (vertices of the reconstructed mesh to the triangles of the ground truth mesh) before and after the alignment
+# No external executable is needed, the KD-tree queries run multithreaded (workers=-1 --> all CPUs)
+
+# -----------------------------------------------------------------------
+def ReadObjMesh(obj_path):
+    # vertices (N,3) and triangles (M,3) of an OBJ file, parsed once and read from the shared mesh store afterwards (see MeshStore)
+    mesh = LoadMesh(obj_path)
+    return mesh.vertices, mesh.triangles
+
+# -----------------------------------------------------------------------
+def ClosestPointOnTriangles(P, A, B, C):
+    # exact closest points on the triangles (A,B,C) for the points P, all (M,3) (Ericson, Real-Time Collision Detection, 5.1.5)
+    # the Voronoi regions are assigned in reverse order of their priority, so that the later assignments win
+    AB = B - A; AC = C - A; AP = P - A; BP = P - B; CP = P - C
+    dot = lambda X, Y: np.einsum('ij,ij->i', X, Y)
+    d1 = dot(AB, AP); d2 = dot(AC, AP); d3 = dot(AB, BP); d4 = dot(AC, BP); d5 = dot(AB, CP); d6 = dot(AC, CP)
+    va = d3*d6 - d5*d4; vb = d5*d2 - d1*d6; vc = d1*d4 - d3*d2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denom = va + vb + vc
+        Q = A + AB*(vb/denom)[:,None] + AC*(vc/denom)[:,None]                  # inside the face
+        m = (va <= 0) & (d4-d3 >= 0) & (d5-d6 >= 0)                             # edge BC
+        Q[m] = B[m] + (C[m]-B[m]) * ((d4-d3)/((d4-d3)+(d5-d6)))[m,None]
+        m = (vb <= 0) & (d2 >= 0) & (d6 <= 0)                                   # edge AC
+        Q[m] = A[m] + AC[m] * (d2/(d2-d6))[m,None]
+        m = (d6 >= 0) & (d5 <= d6)                                              # vertex C
+        Q[m] = C[m]
+        m = (vc <= 0) & (d1 >= 0) & (d3 <= 0)                                   # edge AB
+        Q[m] = A[m] + AB[m] * (d1/(d1-d3))[m,None]
+        m = (d3 >= 0) & (d4 <= d3)                                              # vertex B
+        Q[m] = B[m]
+        m = (d1 <= 0) & (d2 <= 0)                                               # vertex A
+        Q[m] = A[m]
+    bad = ~np.isfinite(Q).all(axis=1)                                           # degenerated triangles --> nearest vertex
+    if bad.any():
+        V = np.stack([A[bad], B[bad], C[bad]], axis=1)
+        Q[bad] = V[np.arange(bad.sum()), np.argmin(np.linalg.norm(V - P[bad,None,:], axis=2), axis=1)]
+    return Q
+
+# -----------------------------------------------------------------------
+class MeshDistance:
+    # Exact point to triangle distances with a KD-tree over the triangle centroids
+    #   1. the k nearest triangles (centroids) of each point are checked exactly --> upper bound u of the distance
+    #   2. the result is exact if the k-th centroid is farther away than u + largest triangle radius, otherwise all triangles with
+    #      a centroid within u + largest radius are checked (ball query), pruned with the lower bound centroid distance - radius
+    def __init__(self, vertices, triangles, workers=-1):
+        self.vertices = np.asarray(vertices, dtype=float); self.triangles = np.asarray(triangles, dtype=np.int64)
+        self.V0 = self.vertices[self.triangles[:,0]]; self.V1 = self.vertices[self.triangles[:,1]]; self.V2 = self.vertices[self.triangles[:,2]]
+        self.centroids = (self.V0 + self.V1 + self.V2) / 3
+        self.radius = np.max(np.stack([np.linalg.norm(V - self.centroids, axis=1) for V in (self.V0, self.V1, self.V2)]), axis=0)
+        self.radius_max = float(self.radius.max())
+        cross = np.cross(self.V1 - self.V0, self.V2 - self.V0)
+        self.face_normals = cross / np.maximum(np.linalg.norm(cross, axis=1, keepdims=True), 1e-300)
+        self.tree = cKDTree(self.centroids)
+        self.workers = workers
+
+    def _check_candidates(self, points, index, row, t, distances, closest, triangle):
+        # exact distances of the pairs (point index[row], triangle t), the best pair of each point replaces the current result if closer
+        P = points[index[row]]
+        Q = ClosestPointOnTriangles(P, self.V0[t], self.V1[t], self.V2[t])
+        d = np.linalg.norm(P - Q, axis=1)
+        order = np.lexsort((d, row)); first = order[np.r_[True, row[order][1:] != row[order][:-1]]]     # best pair of each point
+        first = first[d[first] < distances[index[row[first]]]]
+        rows = index[row[first]]
+        distances[rows] = d[first]; closest[rows] = Q[first]; triangle[rows] = t[first]
+
+    def closest_points(self, points, k=8, chunk_size=50000):
+        # --> distances (N,), closest points (N,3), triangle indices (N,)
+        points = np.asarray(points, dtype=float)
+        k = min(k, len(self.triangles))
+        distances = np.full(len(points), np.inf); closest = np.zeros([len(points),3]); triangle = np.zeros(len(points), dtype=np.int64)
+        for start in range(0, len(points), chunk_size):
+            index = np.arange(start, min(start+chunk_size, len(points)))
+            d_centroid, candidates = self.tree.query(points[index], k=k, workers=self.workers)
+            d_centroid = d_centroid.reshape(len(index),k); candidates = candidates.reshape(len(index),k)
+            self._check_candidates(points, index, np.repeat(np.arange(len(index)), k), candidates.ravel(), distances, closest, triangle)
+            if k == len(self.triangles): continue
+            # points for which a triangle outside of the k nearest centroids can be closer
+            index = index[d_centroid[:,-1] - self.radius_max < distances[index]]
+            if len(index) == 0: continue
+            lists = self.tree.query_ball_point(points[index], r=distances[index] + self.radius_max, workers=self.workers)
+            lengths = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+            t = np.fromiter(itertools.chain.from_iterable(lists), dtype=np.int64, count=lengths.sum())
+            row = np.repeat(np.arange(len(index)), lengths)
+            lower_bound = np.linalg.norm(points[index[row]] - self.centroids[t], axis=1) - self.radius[t]
+            keep = lower_bound < distances[index[row]]
+            if keep.any(): self._check_candidates(points, index, row[keep], t[keep], distances, closest, triangle)
+        return distances, closest, triangle
+
+    def signed_distances(self, points):
+        # sign from the angle weighted pseudonormal of the closest feature (face, edge or vertex) --> correct inside/outside
+        # decision for closed meshes (Baerentzen & Aanaes, 2005), positive: outside / in normal direction
+        distances, closest, triangle = self.closest_points(points)
+        sign = np.sign(np.einsum('ij,ij->i', np.asarray(points) - closest, self.pseudonormals(closest, triangle)))
+        sign[sign == 0] = 1
+        return sign * distances, closest, triangle
+
+    def closest_points_normals(self, points):
+        # closest points and the normals of the closest triangles (interface of the ICP, see also SignedDistanceField)
+        _, closest, triangle = self.closest_points(points)
+        return closest, self.face_normals[triangle]
+
+    def pseudonormals(self, closest, triangle, eps=1e-7):
+        if not hasattr(self, "vertex_normals"): self._compute_pseudonormals()
+        A = self.V0[triangle]; AB = self.V1[triangle] - A; AC = self.V2[triangle] - A; AQ = closest - A
+        # barycentric coordinates (a,b,c) of the closest point
+        d00 = np.einsum('ij,ij->i', AB, AB); d01 = np.einsum('ij,ij->i', AB, AC); d11 = np.einsum('ij,ij->i', AC, AC)
+        d20 = np.einsum('ij,ij->i', AQ, AB); d21 = np.einsum('ij,ij->i', AQ, AC)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            denom = d00*d11 - d01*d01
+            b = (d11*d20 - d01*d21) / denom; c = (d00*d21 - d01*d20) / denom
+        a = 1 - b - c
+        normals = self.face_normals[triangle].copy()
+        for m, edge in ((c < eps, 0), (a < eps, 1), (b < eps, 2)):                       # edges AB, BC, CA
+            normals[m] = self.edge_normals[self.triangle_edges[triangle[m], edge]]
+        for m, corner in (((b < eps) & (c < eps), 0), ((a < eps) & (c < eps), 1), ((a < eps) & (b < eps), 2)):   # vertices A, B, C
+            normals[m] = self.vertex_normals[self.triangles[triangle[m], corner]]
+        return normals
+
+    def _compute_pseudonormals(self):
+        # vertex normals weighted with the angle of the triangles at the vertex, edge normals as sum of the adjacent face normals
+        corners = np.stack([self.V0, self.V1, self.V2], axis=1)
+        self.vertex_normals = np.zeros_like(self.vertices)
+        for i in range(3):
+            e1 = corners[:,(i+1)%3] - corners[:,i]; e2 = corners[:,(i+2)%3] - corners[:,i]
+            cos_angle = np.einsum('ij,ij->i', e1, e2) / np.maximum(np.linalg.norm(e1, axis=1)*np.linalg.norm(e2, axis=1), 1e-300)
+            np.add.at(self.vertex_normals, self.triangles[:,i], np.arccos(np.clip(cos_angle, -1, 1))[:,None] * self.face_normals)
+        edges = np.sort(np.stack([self.triangles[:,[0,1]], self.triangles[:,[1,2]], self.triangles[:,[2,0]]], axis=1), axis=2)
+        _, edge_index = np.unique(edges.reshape(-1,2), axis=0, return_inverse=True)
+        self.triangle_edges = edge_index.reshape(-1,3)
+        self.edge_normals = np.zeros([self.triangle_edges.max()+1, 3])
+        np.add.at(self.edge_normals, self.triangle_edges.ravel(), np.repeat(self.face_normals, 3, axis=0))
+
+# -----------------------------------------------------------------------
+def ScaledPointToPlaneICP(points, mesh_distance, max_iterations=100, min_error_diff=1e-7, adjust_scale=True, overlap=1.0,
+                          number_of_points=50000, seed=42):
+    # ICP of a point cloud onto a mesh: the closest points and normals come from mesh_distance (exact MeshDistance or the
+    # interpolated SignedDistanceField, same interface closest_points_normals), the step minimizes the linearized
+    # point to plane error of a similarity transformation (rotation, translation and with adjust_scale an isotropic scale
+    # around the centroid of the points). Stops if the RMS decreases less than min_error_diff (like CloudCompare's -MIN_ERROR_DIFF)
+    # overlap < 1: only the given fraction of the points with the smallest residuals is used (trimmed ICP)
+    rng = np.random.default_rng(seed)
+    points = np.asarray(points, dtype=float)
+    if len(points) > number_of_points: points = points[rng.choice(len(points), number_of_points, replace=False)]
+    T_ICP = np.eye(4); T_prev = T_ICP; rms_prev = np.inf; history = []
+    for iteration in range(max_iterations):
+        p = points @ T_ICP[:3,:3].T + T_ICP[:3,3]
+        q, n = mesh_distance.closest_points_normals(p)
+        r = np.einsum('ij,ij->i', p - q, n)                     # point to plane residuals
+        if overlap < 1:
+            keep = np.argsort(np.abs(r))[:max(3, int(overlap*len(r)))]
+            p = p[keep]; n = n[keep]; r = r[keep]
+        rms = float(np.sqrt(np.mean(r**2))); history.append(rms)
+        if rms_prev - rms < min_error_diff:
+            if rms > rms_prev: T_ICP = T_prev          # last step made it worse
+            break
+        rms_prev = rms; T_prev = T_ICP
+        # linearized step: x' = (1+sigma)(I + [omega]x)(x - c) + c + t  --> r + J @ [omega, t, sigma] = 0
+        c = p.mean(axis=0); x = p - c
+        J = np.hstack([np.cross(x, n), n] + ([np.einsum('ij,ij->i', x, n)[:,None]] if adjust_scale else []))
+        delta = np.linalg.lstsq(J, -r, rcond=None)[0]
+        omega = delta[:3]; t = delta[3:6]; s = 1 + delta[6] if adjust_scale else 1
+        angle = np.linalg.norm(omega)
+        K = np.array([[0, -omega[2], omega[1]], [omega[2], 0, -omega[0]], [-omega[1], omega[0], 0]]) / max(angle, 1e-300)
+        R = np.eye(3) + np.sin(angle)*K + (1-np.cos(angle))*K@K   # Rodrigues
+        T_step = np.eye(4); T_step[:3,:3] = s*R; T_step[:3,3] = c + t - s*R@c
+        T_ICP = T_step @ T_ICP
+    return T_ICP, history
+
+def DistanceStatistics(distances):
+    return {"mean": float(np.mean(distances)), "std": float(np.std(distances)), "rms": float(np.sqrt(np.mean(distances**2))),
+            "max_abs": float(np.max(np.abs(distances)))}
+
+##############################################################################################################
+#                         MAIN FUNCTION  --> FineMeshRegistrationNative                                      #
+##############################################################################################################
+
+def FineMeshRegistrationNative(evaluation_path,mesh_gt_path,mesh_r_path,InitialTrans_path,icp_params=None,sdf_params=None):
+    # Same files as the CloudCompare stage: ICPTransformationMatrix.txt, TransformationMatrix.txt (T = T_ICP @ T_init)
+    # and the registered mesh texturedMesh_TRANSFORMED.obj
+    # The mean / std of the cloud to mesh distances before and after the ICP are saved in C2MDistance.json (instead of the log file)
+    # sdf_params: the queries use the narrow band signed distance field of the ground truth mesh (built once per object and
+    # cached on disk, see SignedDistanceField), None --> exact distances only
+    # Returns T, T_ICP and the signed distances of all vertices of the reconstructed mesh before and after the alignment
+    icp_params = icp_params or {}
+    evaluation_path = Path(evaluation_path)
+    t_start = time.perf_counter()
+    vertices_r, _ = ReadObjMesh(mesh_r_path)
+    if sdf_params:
+        from src.SignedDistanceField import LoadOrBuildSignedDistanceField
+        mesh_distance = LoadOrBuildSignedDistanceField(mesh_gt_path, **sdf_params, workers=icp_params.get("workers", -1))
+    else:
+        vertices_gt, triangles_gt = ReadObjMesh(mesh_gt_path)
+        mesh_distance = MeshDistance(vertices_gt, triangles_gt, workers=icp_params.get("workers", -1))
+    T_init = np.loadtxt(InitialTrans_path)                  # global registration and scale transformation matrix
+    points = vertices_r @ T_init[:3,:3].T + T_init[:3,3]
+    distances_before, _, _ = mesh_distance.signed_distances(points)
+    T_ICP, history = ScaledPointToPlaneICP(points, mesh_distance, max_iterations=icp_params.get("max_iterations", 100),
+                                           min_error_diff=icp_params.get("min_error_diff", 1e-7), adjust_scale=icp_params.get("adjust_scale", True),
+                                           overlap=icp_params.get("overlap", 1.0), number_of_points=icp_params.get("number_of_points", 50000))
+    T = np.dot(T_ICP, T_init)                               # overall transformation matrix
+    distances_after, _, _ = mesh_distance.signed_distances(vertices_r @ T[:3,:3].T + T[:3,3])
+    np.savetxt(evaluation_path / "ICPTransformationMatrix.txt", T_ICP)
+    np.savetxt(evaluation_path / "TransformationMatrix.txt", T)
+    TransformObjFile(mesh_r_path, evaluation_path / "texturedMesh_TRANSFORMED.obj", T)      # registered mesh (as exported by CloudCompare)
+    c2m = {"before": DistanceStatistics(distances_before), "after": DistanceStatistics(distances_after),
+           "icp_iterations": len(history), "icp_rms": history, "time": time.perf_counter()-t_start}
+    with open(evaluation_path / "C2MDistance.json", 'w') as file:
+        json.dump(c2m, file, indent=4)
+    print(f"Fine registration (ICP, {len(history)} iterations, {c2m['time']:.1f}s): cloud to mesh distance "
+          f"{c2m['before']['mean']:.6f} +- {c2m['before']['std']:.6f} --> {c2m['after']['mean']:.6f} +- {c2m['after']['std']:.6f}")
+    return T, T_ICP, distances_before, distances_after
+
+# -----------------------------------------------------------------------
+def TransformObjFile(obj_path, obj_trans_path, T):
+    # write a transformed copy of an OBJ file (vertices and normals), all other lines (texture coordinates, faces, material) are kept
+    # --> replaces the transformed mesh exported by CloudCompare, e.g. for the texture evaluation
+    A = T[:3,:3]; N = np.linalg.inv(A).T; N /= np.cbrt(np.linalg.det(N))      # normal matrix (without scale)
+    with open(obj_path, 'r') as file: lines = file.readlines()
+    vertex_rows = [i for i, line in enumerate(lines) if line.startswith('v ')]
+    normal_rows = [i for i, line in enumerate(lines) if line.startswith('vn ')]
+    if vertex_rows:
+        v = np.array([lines[i].split()[1:4] for i in vertex_rows], dtype=float) @ A.T + T[:3,3]
+        for i, row in zip(vertex_rows, v):
+            extra = lines[i].split()[4:]                                        # e.g. vertex colors
+            lines[i] = f"v {row[0]:.9g} {row[1]:.9g} {row[2]:.9g}" + "".join(" " + e for e in extra) + "\n"
+    if normal_rows:
+        vn = np.array([lines[i].split()[1:4] for i in normal_rows], dtype=float) @ N.T
+        vn /= np.maximum(np.linalg.norm(vn, axis=1, keepdims=True), 1e-12)
+        for i, row in zip(normal_rows, vn): lines[i] = f"vn {row[0]:.6f} {row[1]:.6f} {row[2]:.6f}\n"
+    with open(obj_trans_path, 'w') as file: file.writelines(lines)
+    return Path(obj_trans_path)
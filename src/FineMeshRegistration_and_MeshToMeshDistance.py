@@ -57,5 +57,6 @@ def FineMeshRegistration_and_MeshToMeshDistance(CC_path,params_CC,evaluation_pat
     T = np.dot(T_ICP,T_init)                                                                            # overall transformation matrix
     # save overall transformation matrix
     np.savetxt((evaluation_path / "TransformationMatrix.txt"),T)   
+    os.utime(mesh_r_trans_path)     # the transformed mesh belongs to this transformation matrix (see TextureEvaluation)
         
     return T,T_ICP,mesh_r_trans_path,log_path
\ No newline at end of file
@@ -1,6 +1,13 @@
 import numpy as np
 import open3d as o3d
 import copy
+import time
+import sys
+import importlib
+importlib.reload(sys.modules['src.TransMatrix_Utils']) if 'src.TransMatrix_Utils' in sys.modules else None
+from src.TransMatrix_Utils import EulerAngles_To_RotationMatrix3x3_stacked
+importlib.reload(sys.modules['src.MeshStore']) if 'src.MeshStore' in sys.modules else None
+from src.MeshStore import LoadMesh, ToOpen3D
 # -----------------------------------------------------------------------    
 def draw_registration_result(source, target, transformation):
     source_temp = copy.deepcopy(source)
@@ -40,8 +47,42 @@ def preprocess_point_cloud(pcd, voxel_size):
         o3d.geometry.KDTreeSearchParamHybrid(radius=radius_feature, max_nn=100))
     return pcd_down, pcd_fpfh
 # -----------------------------------------------------------------------  
+def sample_mesh(mesh, sampling=None, seed=None):
+    # mesh --> point cloud, sampling: None --> Poisson disk sampling with 10000 points
+    #                                 dict --> strategy ("uniform", "vertex_voxel", "poisson"), number_of_points, points_per_area (see MeshSampling)
+    if sampling is None: return mesh.sample_points_poisson_disk(number_of_points=10000)
+    from src.MeshSampling import SampleMeshOpen3D
+    return SampleMeshOpen3D(mesh, sampling.get("strategy","uniform"), sampling.get("number_of_points",10000), sampling.get("points_per_area"), seed)
+# -----------------------------------------------------------------------  
+def preprocess_target_mesh(mesh_gt_path, voxel_size, sampling=None, target_cache=None, target_mesh=None):
+    # Downsampled point cloud with normals and FPFH features of the ground truth (target) mesh
+    # The same objects are registered in many cases --> the result is stored in target_cache (DiskCache),
+    # keyed by the mesh content, the voxel size and the sampling parameters
+    if target_cache is not None:
+        from src.DiskCache import FileContentHash
+        key = target_cache.key(mesh=FileContentHash(mesh_gt_path), voxel_size=voxel_size,
+                               sampling=sampling or {"strategy": "poisson", "number_of_points": 10000},
+                               radius_normal=voxel_size*2, radius_feature=voxel_size*5)
+        data = target_cache.get(key)
+        if data is not None:
+            print(":: Target point cloud and FPFH features loaded from the cache.")
+            target_down = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(data["points"]))
+            target_down.normals = o3d.utility.Vector3dVector(data["normals"])
+            target_fpfh = o3d.pipelines.registration.Feature()
+            target_fpfh.data = data["fpfh"]
+            return target_down, target_fpfh, data["center"]
+    if target_mesh is None: target_mesh = ToOpen3D(LoadMesh(mesh_gt_path))
+    target = sample_mesh(target_mesh, sampling)
+    target_down, target_fpfh = preprocess_point_cloud(target, voxel_size)
+    target_center = target_mesh.get_center()
+    if target_cache is not None:
+        target_cache.put(key, {"points": np.asarray(target_down.points), "normals": np.asarray(target_down.normals),
+                               "fpfh": np.asarray(target_fpfh.data), "center": np.asarray(target_center)})
+    return target_down, target_fpfh, target_center
+# -----------------------------------------------------------------------  
 def execute_global_registration(source_down, target_down, source_fpfh,
-                                target_fpfh, voxel_size):
+                                target_fpfh, voxel_size, max_iteration=100000, confidence=0.9999):
+    # RANSAC stops as soon as the number of iterations required for the given confidence is reached (estimated from the inlier ratio)
     distance_threshold = voxel_size * 1.5
     print(":: RANSAC registration on downsampled point clouds.")
     print("   Since the downsampling voxel size is %.3f," % voxel_size)
@@ -55,9 +96,51 @@ def execute_global_registration(source_down, target_down, source_fpfh,
                 0.9),
             o3d.pipelines.registration.CorrespondenceCheckerBasedOnDistance(
                 distance_threshold)
-        ], o3d.pipelines.registration.RANSACConvergenceCriteria(100000, 0.9999))
+        ], o3d.pipelines.registration.RANSACConvergenceCriteria(max_iteration, confidence))
     return result
 # -----------------------------------------------------------------------  
+def target_bounding_box_diagonal(mesh_gt_path, target_cache=None, target_mesh=None):
+    # length of the bounding box diagonal of the ground truth mesh (also cached, the mesh is not read again)
+    if target_cache is not None:
+        from src.DiskCache import FileContentHash
+        key = target_cache.key(mesh=FileContentHash(mesh_gt_path), content="bounding_box")
+        data = target_cache.get(key)
+        if data is not None: return float(data["diagonal"])
+    if target_mesh is None: target_mesh = ToOpen3D(LoadMesh(mesh_gt_path))
+    diagonal = float(np.linalg.norm(target_mesh.get_max_bound() - target_mesh.get_min_bound()))
+    if target_cache is not None: target_cache.put(key, {"diagonal": np.array(diagonal)})
+    return diagonal
+# -----------------------------------------------------------------------  
+def PyramidVoxelSizes(diagonal, levels=3, coarse_fraction=0.05, fine_fraction=0.005):
+    # voxel sizes of the pyramid levels (coarse --> fine) relative to the bounding box diagonal, geometric spacing
+    if levels == 1: return [fine_fraction*diagonal]
+    return list(np.geomspace(coarse_fraction*diagonal, fine_fraction*diagonal, levels))
+# -----------------------------------------------------------------------  
+def refine_registration_pyramid(source, mesh_gt_path, T_init, voxel_sizes, target_cache=None, target_mesh=None,
+                                sampling=None, tolerance=1e-3, max_iteration=30):
+    # Refinement of the coarse (RANSAC) result on the finer pyramid levels with point to plane ICP, each level is seeded with
+    # the result of the previous level. Stops early if neither fitness nor inlier RMSE improve by more than the tolerance (relative)
+    T = T_init; levels = []
+    for voxel_size in voxel_sizes:
+        t_start = time.perf_counter()
+        distance_threshold = voxel_size * 1.5
+        source_down = source.voxel_down_sample(voxel_size)
+        target_down, _, _ = preprocess_target_mesh(mesh_gt_path, voxel_size, sampling, target_cache, target_mesh)
+        before = o3d.pipelines.registration.evaluate_registration(source_down, target_down, distance_threshold, T)
+        result = o3d.pipelines.registration.registration_icp(
+            source_down, target_down, distance_threshold, T,
+            o3d.pipelines.registration.TransformationEstimationPointToPlane(),
+            o3d.pipelines.registration.ICPConvergenceCriteria(max_iteration=max_iteration))
+        improved_fitness = result.fitness - before.fitness > tolerance
+        improved_rmse = before.inlier_rmse - result.inlier_rmse > tolerance * max(before.inlier_rmse, 1e-12)
+        if result.fitness >= before.fitness: T = result.transformation
+        levels.append({"voxel_size": voxel_size, "method": "ICP", "fitness": result.fitness, "inlier_rmse": result.inlier_rmse,
+                       "time": time.perf_counter()-t_start})
+        if not (improved_fitness or improved_rmse):
+            print(f":: Pyramid: no improvement at voxel size {voxel_size:.4f}, finer levels are skipped.")
+            break
+    return T, levels
+# -----------------------------------------------------------------------  
 def register_via_correspondences(source, target, source_points, target_points):
     corr = np.zeros((len(source_points), 2))
     corr[:, 0] = source_points
@@ -100,12 +183,24 @@ def ThreePointGobalRegistration(source,target,source_mesh,target_mesh):
 #                                       MAIN FUNCTION  --> GlobalMeshRegistration                            #
 ##############################################################################################################
 
-def GlobalMeshRegistration(mesh_r_path,mesh_gt_path,voxel_size,draw_registration,T1,ThreePointRegistration=False):
+def GlobalMeshRegistration(mesh_r_path,mesh_gt_path,voxel_size,draw_registration,T1,ThreePointRegistration=False,target_cache=None,
+                           pyramid=None,ReturnInfo=False,seed=None,R_init=None,sampling=None):
     # https://www.open3d.org/docs/release/tutorial/pipelines/global_registration.html
+    # target_cache: DiskCache for the preprocessed target (ground truth), only the source is processed per case
+    # pyramid: None --> single level with voxel_size
+    #          dict  --> coarse to fine registration, RANSAC on the coarsest level and ICP on the finer levels, the voxel sizes are
+    #                    derived from the bounding box diagonal of the ground truth mesh (keys: levels, coarse_fraction, fine_fraction,
+    #                    tolerance, ransac_max_iteration, ransac_confidence)
+    # ReturnInfo: additionally return the fitness, RMSE and time of each level
+    # seed: seed of Open3D's random generator (sampling, RANSAC), R_init: initial rotation (3x3) of the source around the target center
+    # sampling: conversion of the meshes into point clouds (None --> Poisson disk sampling with 10000 points, see sample_mesh)
+    if seed is not None and hasattr(o3d.utility, "random"): o3d.utility.random.seed(int(seed))
     # ----------------------------------------------------------------------- 
-    #Read Source and Target Meshs
-    source_mesh = o3d.io.read_triangle_mesh(str(mesh_r_path)); 
-    target_mesh = o3d.io.read_triangle_mesh(str(mesh_gt_path))  
+    #Read Source and Target Meshs (the target mesh is only needed without cache, for manual registration and plots)
+    source_mesh = ToOpen3D(LoadMesh(mesh_r_path)); 
+    target_mesh = None
+    if target_cache is None or ThreePointRegistration or draw_registration > 1:
+        target_mesh = ToOpen3D(LoadMesh(mesh_gt_path))  
     source_mesh_temp = copy.deepcopy(source_mesh)
     # -----------------------------------------------------------------------   
     #Draw Source and Target Meshs
@@ -116,54 +211,81 @@ def GlobalMeshRegistration(mesh_r_path,mesh_gt_path,voxel_size,draw_registration
     # Transform Source Mesh with the initial Transformation Matrix --> Scaling  
     source_mesh.transform(T1)
     # ----------------------------------------------------------------------- 
+    # Preprocessed target: downsampled point cloud, FPFH features and center of the mesh
+    if ThreePointRegistration == False:
+        if pyramid:
+            diagonal = target_bounding_box_diagonal(mesh_gt_path, target_cache, target_mesh)
+            voxel_sizes = PyramidVoxelSizes(diagonal, pyramid.get("levels",3), pyramid.get("coarse_fraction",0.05), pyramid.get("fine_fraction",0.005))
+            print(":: Pyramid registration with voxel sizes " + ", ".join(f"{v:.4f}" for v in voxel_sizes))
+        else: voxel_sizes = [voxel_size]
+        t_start = time.perf_counter()
+        target_down, target_fpfh, target_center_point = preprocess_target_mesh(mesh_gt_path, voxel_sizes[0], sampling, target_cache, target_mesh)
+    else:
+        target_center_point = target_mesh.get_center()
+    # ----------------------------------------------------------------------- 
     # Transform the Source Mesh so that the centers of mass are positioned at the same location
     source_center_point = source_mesh.get_center()
-    target_center_point = target_mesh.get_center()
     T2 = np.eye(4)
     T2[0,3] = target_center_point[0]-source_center_point[0]
     T2[1,3] = target_center_point[1]-source_center_point[1]
     T2[2,3] = target_center_point[2]-source_center_point[2]
     source_mesh.transform(T2)
+    # Initial rotation around the target center (multi start registration)
+    T_init = np.eye(4)
+    if R_init is not None:
+        T_init[:3,:3] = R_init; T_init[:3,3] = np.asarray(target_center_point) - R_init @ np.asarray(target_center_point)
+        source_mesh.transform(T_init)
     # -----------------------------------------------------------------------    
     # Draw Source and Target Meshs after Scaling and Translation
     if draw_registration > 3:
         draw_registration_result(source_mesh, target_mesh, np.identity(4))
     # ----------------------------------------------------------------------- 
     # Convert mesh to point cloud
-    source = source_mesh.sample_points_poisson_disk(number_of_points=10000)
-    target = target_mesh.sample_points_poisson_disk(number_of_points=10000) 
+    source = sample_mesh(source_mesh, sampling, seed)
     # ----------------------------------------------------------------------- 
     # Automated global Registration
     if ThreePointRegistration == False:
         # Draw Point clouds
         if draw_registration > 2:
-            draw_registration_result(source, target, np.identity(4))
+            draw_registration_result(source, target_down, np.identity(4))
 
-        # Preprocess point cloud
-        source_down, source_fpfh = preprocess_point_cloud(source, voxel_size)
-        target_down, target_fpfh = preprocess_point_cloud(target, voxel_size)
+        # Preprocess point cloud (source only, the target is already preprocessed)
+        source_down, source_fpfh = preprocess_point_cloud(source, voxel_sizes[0])
 
         # Draw Reduced Point clouds
         if draw_registration > 4:
             draw_registration_result(source_down, target_down, np.identity(4))
         
         # Execute Global Registration
+        ransac_criteria = {} if not pyramid else {"max_iteration": pyramid.get("ransac_max_iteration",100000), "confidence": pyramid.get("ransac_confidence",0.9999)}
         result_ransac = execute_global_registration(source_down, target_down,
                                                     source_fpfh, target_fpfh,
-                                                    voxel_size)
+                                                    voxel_sizes[0], **ransac_criteria)
         print(result_ransac)
         T3 = result_ransac.transformation
+        levels = [{"voxel_size": voxel_sizes[0], "method": "RANSAC", "fitness": result_ransac.fitness,
+                   "inlier_rmse": result_ransac.inlier_rmse, "time": time.perf_counter()-t_start}]
+        # Refinement on the finer levels of the pyramid
+        if len(voxel_sizes) > 1:
+            T3, levels_icp = refine_registration_pyramid(source, mesh_gt_path, T3, voxel_sizes[1:], target_cache, target_mesh,
+                                                         sampling, tolerance=pyramid.get("tolerance",1e-3))
+            levels += levels_icp
+        for level in levels:
+            print(f":: {level['method']:>6} voxel size {level['voxel_size']:.4f}: fitness = {level['fitness']:.4f}, "
+                  f"inlier RMSE = {level['inlier_rmse']:.5f}, time = {level['time']:.2f}s")
         if draw_registration > 0:
             draw_registration_result(source_down, target_down,T3)
     # -----------------------------------------------------------------------    
     # Manual Registration by picking 3 unique points on both point clouds
     else:
+        target = sample_mesh(target_mesh, sampling, seed)
         T3 = ThreePointGobalRegistration(source,target,source_mesh,target_mesh)
+        levels = []
         if draw_registration > 0:
             draw_registration_result(source, target,T3)      
     # -----------------------------------------------------------------------         
     # Calculate Overall Transformation Matrix
-    T = np.dot(np.dot(T3, T2), T1)
+    T = np.dot(np.dot(np.dot(T3, T_init), T2), T1)
     # -----------------------------------------------------------------------   
     # Show Meshes after the Registration process
     if draw_registration > 1:   
@@ -175,9 +297,80 @@ def GlobalMeshRegistration(mesh_r_path,mesh_gt_path,voxel_size,draw_registration
         draw_registration_result(source_mesh_temp, target_mesh,np.eye(4))
     # -----------------------------------------------------------------------    
     # Return Transformation Matrix
+    if ReturnInfo: return T, {"levels": levels}
     return T
 
 
+##############################################################################################################
+#                          Multi start global registration (best of several hypotheses)                       #
+##############################################################################################################
+
+def RotationGrid(n, seed=42):
+    # n initial rotations: identity, the other 23 rotations of the cube (multiples of 90°) and random rotations if more are needed
+    angles = np.deg2rad(np.arange(4)*90)
+    EulerAngle = np.array(np.meshgrid(angles, angles, angles, indexing='ij')).reshape(3,-1).T
+    R = np.round(EulerAngles_To_RotationMatrix3x3_stacked(EulerAngle))
+    _, index = np.unique(R.reshape(-1,9), axis=0, return_index=True)
+    R = R[np.sort(index)]                                               # 24 rotations, identity first
+    if n > len(R):
+        rng = np.random.default_rng(seed)
+        Q, R_qr = np.linalg.qr(rng.normal(size=[n-len(R),3,3]))         # uniformly distributed random rotations
+        Q *= np.sign(np.diagonal(R_qr, axis1=1, axis2=2))[:,None,:]
+        Q[np.linalg.det(Q) < 0] *= -1
+        R = np.concatenate([R, Q])
+    return R[:n]
+# -----------------------------------------------------------------------  
+def _registration_start(args):
+    # one start of the multi start registration (runs in a worker process, Open3D objects are created in the worker)
+    mesh_r_path, mesh_gt_path, voxel_size, T1, target_cache, pyramid, seed, R_init, sampling = args
+    T, info = GlobalMeshRegistration(mesh_r_path, mesh_gt_path, voxel_size, 0, T1, False, target_cache, pyramid,
+                                     ReturnInfo=True, seed=seed, R_init=R_init, sampling=sampling)
+    return T, info
+# -----------------------------------------------------------------------  
+def score_registration_candidates(mesh_r_path, mesh_gt_path, Ts, infos, number_of_points=10000, seed=42):
+    # fitness and inlier RMSE of the (last level of the) registration and the median cloud to mesh distance of the source
+    # score = fitness - inlier_rmse/threshold - c2m/threshold (higher is better, threshold = correspondence distance of the last level)
+    target_mesh = ToOpen3D(LoadMesh(mesh_gt_path))
+    scene = o3d.t.geometry.RaycastingScene()
+    scene.add_triangles(o3d.t.geometry.TriangleMesh.from_legacy(target_mesh))
+    if hasattr(o3d.utility, "random"): o3d.utility.random.seed(int(seed))
+    points = np.asarray(ToOpen3D(LoadMesh(mesh_r_path)).sample_points_uniformly(number_of_points).points)
+    candidates = []
+    for T, info in zip(Ts, infos):
+        level = info["levels"][-1]
+        threshold = 1.5 * level["voxel_size"]
+        points_T = (points @ T[:3,:3].T + T[:3,3]).astype(np.float32)
+        c2m = float(np.median(scene.compute_distance(o3d.core.Tensor(points_T)).numpy()))
+        score = level["fitness"] - level["inlier_rmse"]/threshold - c2m/threshold
+        candidates.append({"fitness": level["fitness"], "inlier_rmse": level["inlier_rmse"], "c2m_median": c2m, "score": score})
+    return candidates
+# -----------------------------------------------------------------------  
+def MultiStartGlobalRegistration(mesh_r_path, mesh_gt_path, voxel_size, T1, starts=8, RotationGridInit=False, target_cache=None,
+                                 pyramid=None, max_workers=None, seed=42, sampling=None):
+    # K independent global registrations on a process pool, each with its own seed (and initial rotation from the rotation grid)
+    # Symmetric objects often lock into a wrong symmetric pose --> the best scored hypothesis is kept
+    # Returns the best transformation and all candidates (transformation, seed, scores)
+    from concurrent.futures import ProcessPoolExecutor
+    seeds = [int(s) for s in np.random.SeedSequence(seed).generate_state(starts) % 2**31]
+    R_inits = list(RotationGrid(starts, seed)) if RotationGridInit else [None]*starts
+    args = [(mesh_r_path, mesh_gt_path, voxel_size, T1, target_cache, pyramid, s, R, sampling) for s, R in zip(seeds, R_inits)]
+    t_start = time.perf_counter()
+    if max_workers == 1: results = [_registration_start(a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(_registration_start, args))
+    Ts = [T for T, _ in results]; infos = [info for _, info in results]
+    candidates = score_registration_candidates(mesh_r_path, mesh_gt_path, Ts, infos, seed=seed)
+    for i, candidate in enumerate(candidates):
+        candidate.update({"start": i, "seed": seeds[i], "R_init": None if R_inits[i] is None else R_inits[i].tolist(),
+                          "T": np.asarray(Ts[i]).tolist(), "levels": infos[i]["levels"]})
+        print(f":: Start {i}: fitness = {candidate['fitness']:.4f}, inlier RMSE = {candidate['inlier_rmse']:.5f}, "
+              f"c2m = {candidate['c2m_median']:.5f}, score = {candidate['score']:.4f}")
+    best = int(np.argmax([candidate["score"] for candidate in candidates]))
+    print(f":: Multi start registration: best start {best} of {starts} ({time.perf_counter()-t_start:.1f}s)")
+    return np.asarray(Ts[best]), candidates, best
+
+
 if __name__ == "__main__":
     mesh_path  = r"C:\Users\Tobias\Documents\Masterarbeit_lokal\synthetic_pipeline\objects\12S\12S.obj"
     mesh = o3d.io.read_triangle_mesh(str(mesh_path))
@@ -0,0 +1,127 @@
+import numpy as np
+import copy
+import time
+from pathlib import Path
+
+# Sampling strategies to convert a triangle mesh into a point cloud (registration input)
+#   "uniform":      area weighted uniform sampling, vectorized over all triangles
+#   "vertex_voxel": voxel downsampling of the mesh vertices (no sampling at all, fastest for dense Meshroom meshes)
+#   "poisson":      Poisson disk sampling of Open3D (evenly spaced points, slowest --> only on demand)
+# The number of points is either fixed or scales with the surface area (points_per_area in points/m²)
+SamplingStrategies = ("uniform", "vertex_voxel", "poisson")
+
+# -----------------------------------------------------------------------
+def TriangleAreas(vertices, triangles):
+    # areas and unit normals of all triangles
+    v0 = vertices[triangles[:,0]]
+    cross = np.cross(vertices[triangles[:,1]] - v0, vertices[triangles[:,2]] - v0)
+    double_area = np.linalg.norm(cross, axis=1)
+    normals = np.divide(cross, double_area[:,None], out=np.zeros_like(cross), where=double_area[:,None] > 0)
+    return double_area / 2, normals
+
+def NumberOfPoints(surface_area, number_of_points=10000, points_per_area=None, min_points=1000, max_points=200000):
+    # fixed number of points or number of points proportional to the surface area (limited to [min_points, max_points])
+    if points_per_area is None: return int(number_of_points)
+    return int(np.clip(round(points_per_area * surface_area), min_points, max_points))
+
+# -----------------------------------------------------------------------
+def SampleUniform(vertices, triangles, number_of_points, seed=None):
+    # area weighted uniform sampling: triangles are drawn proportional to their area (inverse CDF), the points are distributed
+    # uniformly inside the triangle with the square root trick for the barycentric coordinates
+    vertices = np.asarray(vertices, dtype=float); triangles = np.asarray(triangles, dtype=np.int64)
+    areas, face_normals = TriangleAreas(vertices, triangles)
+    rng = np.random.default_rng(seed)
+    cdf = np.cumsum(areas); cdf /= cdf[-1]
+    faces = np.minimum(np.searchsorted(cdf, rng.random(number_of_points), side="right"), len(triangles)-1)
+    r1 = np.sqrt(rng.random(number_of_points)); r2 = rng.random(number_of_points)
+    v0 = vertices[triangles[faces,0]]; v1 = vertices[triangles[faces,1]]; v2 = vertices[triangles[faces,2]]
+    points = (1-r1)[:,None]*v0 + (r1*(1-r2))[:,None]*v1 + (r1*r2)[:,None]*v2
+    return points, face_normals[faces]
+
+def SampleVertexVoxel(vertices, number_of_points, surface_area, vertex_normals=None):
+    # voxel downsampling of the vertices: the voxel size is chosen so that a surface of surface_area gives about number_of_points
+    # (one point per voxel on a surface), the points are the mean of the vertices in a voxel
+    vertices = np.asarray(vertices, dtype=float)
+    voxel_size = np.sqrt(surface_area / number_of_points)
+    voxel = np.floor((vertices - vertices.min(axis=0)) / voxel_size).astype(np.int64)
+    dims = voxel.max(axis=0) + 1
+    key = (voxel[:,0] * dims[1] + voxel[:,1]) * dims[2] + voxel[:,2]        # one integer per voxel --> 1D unique
+    _, group, counts = np.unique(key, return_inverse=True, return_counts=True)
+    points = np.stack([np.bincount(group, weights=vertices[:,i]) for i in range(3)], axis=1) / counts[:,None]
+    if vertex_normals is None: return points, None
+    normals = np.stack([np.bincount(group, weights=vertex_normals[:,i]) for i in range(3)], axis=1)
+    normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+    return points, normals
+
+# -----------------------------------------------------------------------
+def SampleMesh(vertices, triangles, strategy="uniform", number_of_points=10000, points_per_area=None, seed=None, vertex_normals=None):
+    # numpy interface of the strategies "uniform" and "vertex_voxel" --> points (N,3), normals (N,3) or None
+    vertices = np.asarray(vertices, dtype=float); triangles = np.asarray(triangles, dtype=np.int64)
+    surface_area = np.sum(TriangleAreas(vertices, triangles)[0])
+    n = NumberOfPoints(surface_area, number_of_points, points_per_area)
+    if strategy == "uniform": return SampleUniform(vertices, triangles, n, seed)
+    if strategy == "vertex_voxel": return SampleVertexVoxel(vertices, n, surface_area, vertex_normals)
+    raise ValueError(f"Unknown sampling strategy: {strategy} (numpy strategies: uniform, vertex_voxel)")
+
+def SampleMeshOpen3D(mesh, strategy="uniform", number_of_points=10000, points_per_area=None, seed=None):
+    # Open3D interface: TriangleMesh --> PointCloud (same strategies, "poisson" uses Open3D's Poisson disk sampling)
+    import open3d as o3d
+    if strategy == "poisson":
+        n = NumberOfPoints(mesh.get_surface_area(), number_of_points, points_per_area)
+        return mesh.sample_points_poisson_disk(number_of_points=n)
+    vertex_normals = np.asarray(mesh.vertex_normals) if mesh.has_vertex_normals() else None
+    points, normals = SampleMesh(np.asarray(mesh.vertices), np.asarray(mesh.triangles), strategy, number_of_points, points_per_area, seed, vertex_normals)
+    pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points))
+    if normals is not None: pcd.normals = o3d.utility.Vector3dVector(normals)
+    return pcd
+
+##############################################################################################################
+#                                  Benchmark: runtime vs. registration accuracy                             #
+##############################################################################################################
+
+def BenchmarkSamplingStrategies(objects_dir="objects", strategies=SamplingStrategies, number_of_points=10000, voxel_size=1e-3,
+                                repeats=3, seed=42):
+    # For every object (objects/<name>/<name>.obj): the ground truth mesh is moved by a known random rigid transformation (source)
+    # and registered back onto itself with FPFH + RANSAC, sampled with each strategy
+    # --> sampling time, registration time and the rotation (°) / translation (mm) error w.r.t. the known transformation
+    import open3d as o3d
+    from src.GlobalMeshRegistration import preprocess_point_cloud, execute_global_registration
+    from src.TransMatrix_Utils import TransMatrix_from_EulerAngle_and_Location_stacked, GeodesicRotationDistance
+    rng = np.random.default_rng(seed)
+    mesh_paths = sorted(p / (p.name + ".obj") for p in Path(objects_dir).iterdir() if (p / (p.name + ".obj")).is_file())
+    if not mesh_paths: print(f"No objects found in {objects_dir}"); return []
+    results = []
+    for mesh_path in mesh_paths:
+        target_mesh = o3d.io.read_triangle_mesh(str(mesh_path)); target_mesh.compute_vertex_normals()
+        print(f"{mesh_path.stem}: {len(target_mesh.triangles)} triangles")
+        for strategy in strategies:
+            for r in range(repeats):
+                T_true = TransMatrix_from_EulerAngle_and_Location_stacked(rng.normal(scale=0.01, size=3), rng.uniform(-np.pi, np.pi, size=3))[0]
+                source_mesh = copy.deepcopy(target_mesh).transform(T_true)
+                if hasattr(o3d.utility, "random"): o3d.utility.random.seed(int(seed+r))
+                t0 = time.perf_counter()
+                source = SampleMeshOpen3D(source_mesh, strategy, number_of_points, seed=seed+r)
+                target = SampleMeshOpen3D(target_mesh, strategy, number_of_points, seed=seed+r+1)
+                t_sampling = time.perf_counter() - t0
+                t0 = time.perf_counter()
+                source_down, source_fpfh = preprocess_point_cloud(source, voxel_size)
+                target_down, target_fpfh = preprocess_point_cloud(target, voxel_size)
+                T = execute_global_registration(source_down, target_down, source_fpfh, target_fpfh, voxel_size).transformation
+                t_registration = time.perf_counter() - t0
+                T_error = np.asarray(T) @ T_true           # identity for a perfect registration
+                results.append({"object": mesh_path.stem, "strategy": strategy, "points": len(source.points),
+                                "time_sampling": t_sampling, "time_registration": t_registration,
+                                "rotation_error_deg": float(np.rad2deg(GeodesicRotationDistance(T_error[:3,:3], np.eye(3)))),
+                                "translation_error_mm": float(np.linalg.norm(T_error[:3,3])*1000)})
+    import pandas as pd
+    df = pd.DataFrame(results)
+    summary = df.groupby(["object","strategy"]).agg(points=("points","mean"), time_sampling=("time_sampling","median"),
+                                                    time_registration=("time_registration","median"),
+                                                    rotation_error_deg=("rotation_error_deg","median"),
+                                                    translation_error_mm=("translation_error_mm","median"))
+    print(summary.to_string(float_format=lambda x: f"{x:.4f}"))
+    return df
+
+
+if __name__ == "__main__":
+    BenchmarkSamplingStrategies()
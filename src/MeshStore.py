@@ -0,0 +1,181 @@
+import numpy as np
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+import importlib
+import sys
+importlib.reload(sys.modules['src.DiskCache']) if 'src.DiskCache' in sys.modules else None
+from src.DiskCache import DiskCache, FileContentHash
+
+# Shared store of parsed OBJ meshes: an OBJ file is parsed once into numpy arrays, which are saved as .npy files and memory
+# mapped by every later stage (vedo plot, global registration, fine registration, distances, morphology, ...)
+#   <store_dir>/<content hash>/     vertices.npy (N,3), triangles.npy (M,3), uvs.npy (K,2), triangle_uvs.npy (M,3), meta.json
+#   <store_dir>/files/<key>.json    key of (path, size, mtime) --> content hash, the file is only hashed if it changed
+# Copies of the same mesh (e.g. in the case study folders) share one entry. Entries are evicted LRU above max_size_bytes.
+# Adapters: Open3D (legacy TriangleMesh), trimesh (no processing, the arrays are used as they are) and vedo (with texture)
+MESH_ARRAYS = ("vertices", "triangles", "uvs", "triangle_uvs")
+DefaultStoreDir = "cache/meshes"            # None --> meshes are parsed every time (no files are written)
+DefaultStoreSizeMB = 2000
+
+# -----------------------------------------------------------------------
+class ParsedMesh:
+    # vertices (N,3) float64, triangles (M,3) int64, uvs (K,2) float64 and the uv index of every triangle corner (M,3), -1: no uv
+    def __init__(self, vertices, triangles, uvs, triangle_uvs, path=None):
+        self.vertices = vertices; self.triangles = triangles; self.uvs = uvs; self.triangle_uvs = triangle_uvs
+        self.path = path
+
+    @property
+    def has_uvs(self):
+        return len(self.uvs) > 0 and len(self.triangle_uvs) > 0 and bool(np.all(self.triangle_uvs[:1] >= 0))
+
+# -----------------------------------------------------------------------
+def ParseObj(obj_path):
+    # OBJ text --> ParsedMesh (polygons are triangulated as fan, normals and materials are ignored)
+    vertex_lines = []; uv_lines = []; face_lines = []
+    with open(obj_path, 'r') as file:
+        for line in file:
+            if line.startswith('v '): vertex_lines.append(line[2:])
+            elif line.startswith('vt '): uv_lines.append(line[3:])
+            elif line.startswith('f '): face_lines.append(line[2:])
+    vertices = np.array(" ".join(vertex_lines).split(), dtype=float).reshape(len(vertex_lines),-1)[:,:3] if vertex_lines else np.zeros([0,3])
+    uvs = np.array(" ".join(uv_lines).split(), dtype=float).reshape(len(uv_lines),-1)[:,:2] if uv_lines else np.zeros([0,2])
+    corners, lengths = _parse_face_corners(face_lines)
+    # fan triangulation of every polygon: (0, j, j+1), j = 1 .. n-2
+    start = np.cumsum(lengths) - lengths
+    fan = lengths - 2
+    first = np.repeat(start, fan)
+    j = np.arange(fan.sum()) - np.repeat(np.cumsum(fan) - fan, fan) + 1
+    corner_index = np.stack([first, first + j, first + j + 1], axis=1)
+    def to_zero_based(index, count):
+        return np.where(index > 0, index - 1, np.where(index < 0, count + index, -1))   # OBJ: 1-based, negative: relative, 0: missing
+    triangles = to_zero_based(corners[corner_index, 0], len(vertices))
+    triangle_uvs = to_zero_based(corners[corner_index, 1], len(uvs))
+    return ParsedMesh(vertices, triangles.astype(np.int64), uvs, triangle_uvs.astype(np.int64), path=str(obj_path))
+
+def _parse_face_corners(face_lines):
+    # corners (C,2): vertex and uv index of every polygon corner (0: no uv), lengths: number of corners of every polygon
+    # fast path: all corners have the same format (v, v/vt, v//vn or v/vt/vn) --> one numpy conversion for the whole file
+    if not face_lines: return np.zeros([0,2], dtype=np.int64), np.zeros(0, dtype=np.int64)
+    tokens = " ".join(face_lines).split()
+    lengths = np.fromiter((len(line.split()) for line in face_lines), dtype=np.int64, count=len(face_lines))
+    first = tokens[0].split('/')
+    parts = len(first); has_uv = parts > 1 and first[1] != ''
+    text = " ".join(tokens).replace('//', '/0/').replace('/', ' ')
+    try:
+        values = np.array(text.split(), dtype=np.int64)
+        if len(values) != len(tokens)*parts: raise ValueError
+        values = values.reshape(len(tokens), parts)
+        corners = np.stack([values[:,0], values[:,1] if has_uv else np.zeros(len(tokens), dtype=np.int64)], axis=1)
+    except ValueError:
+        # mixed formats --> corner by corner
+        corners = np.zeros([len(tokens),2], dtype=np.int64)
+        for i, token in enumerate(tokens):
+            index = token.split('/')
+            corners[i,0] = int(index[0])
+            if len(index) > 1 and index[1] != '': corners[i,1] = int(index[1])
+    return corners, lengths
+
+# -----------------------------------------------------------------------
+class MeshStore:
+    def __init__(self, store_dir=DefaultStoreDir, max_size_bytes=DefaultStoreSizeMB*2**20):
+        self.store_dir = Path(store_dir)
+        self.max_size_bytes = max_size_bytes
+        (self.store_dir / "files").mkdir(parents=True, exist_ok=True)
+
+    def _file_key(self, obj_path):
+        stat = Path(obj_path).stat()
+        return DiskCache.key(path=str(Path(obj_path).resolve()), size=stat.st_size, mtime=stat.st_mtime_ns)
+
+    def content_hash(self, obj_path):
+        # content hash of the file, from the (path, size, mtime) index if the file has not changed since it was hashed
+        pointer = self.store_dir / "files" / (self._file_key(obj_path) + ".json")
+        try:
+            with open(pointer, 'r') as file: return json.load(file)["hash"]
+        except (OSError, ValueError, KeyError):
+            pass
+        content_hash = FileContentHash(obj_path)
+        try:
+            with open(pointer, 'w') as file: json.dump({"path": str(obj_path), "hash": content_hash}, file)
+        except OSError: pass
+        return content_hash
+
+    def _read(self, entry, obj_path, mmap):
+        if not (entry / "meta.json").is_file(): return None
+        try:
+            arrays = {name: np.load(entry / (name + ".npy"), mmap_mode='r' if mmap else None) for name in MESH_ARRAYS}
+            os.utime(entry)                                         # mark as recently used
+            return ParsedMesh(**arrays, path=str(obj_path))
+        except (OSError, ValueError) as e:
+            print(f"Warning: Stored mesh could not be loaded, parsing it again: {e}")
+            return None
+
+    def load(self, obj_path, mmap=True):
+        # parsed mesh (memory mapped arrays), parsed and stored on the first request
+        entry = self.store_dir / self.content_hash(obj_path)
+        mesh = self._read(entry, obj_path, mmap)
+        if mesh is not None: return mesh
+        t0 = time.perf_counter()
+        mesh = ParseObj(obj_path)
+        t_parse = time.perf_counter() - t0
+        tmp_entry = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+        tmp_entry.mkdir(parents=True, exist_ok=True)
+        for name in MESH_ARRAYS: np.save(tmp_entry / (name + ".npy"), getattr(mesh, name))
+        with open(tmp_entry / "meta.json", 'w') as file:
+            json.dump({"path": str(obj_path), "vertices": len(mesh.vertices), "triangles": len(mesh.triangles), "time_parse": t_parse}, file)
+        try: os.replace(tmp_entry, entry)
+        except OSError: shutil.rmtree(tmp_entry, ignore_errors=True)     # stored by another process in the meantime
+        self.evict(keep=entry)
+        return (self._read(entry, obj_path, mmap) or mesh) if mmap else mesh
+
+    def evict(self, keep=None):
+        # delete the least recently used entries until the store is smaller than the size cap
+        entries = []
+        for entry in self.store_dir.iterdir():
+            if not entry.is_dir() or entry.name == "files" or entry.name.endswith(".tmp"): continue
+            size = sum(f.stat().st_size for f in entry.iterdir())
+            entries.append((entry.stat().st_mtime, size, entry))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total_size <= self.max_size_bytes: break
+            if keep is not None and entry == keep: continue
+            shutil.rmtree(entry, ignore_errors=True); total_size -= size
+        return total_size
+
+# -----------------------------------------------------------------------
+def ConfigureMeshStore(store_dir=DefaultStoreDir, max_size_mb=DefaultStoreSizeMB):
+    # store used by LoadMesh (None --> no store, every request parses the file). The setting is kept in environment variables,
+    # so that it survives the module reloads of the pipeline and is inherited by worker processes
+    os.environ["MESH_STORE_DIR"] = "" if store_dir is None else str(store_dir)
+    os.environ["MESH_STORE_SIZE_MB"] = str(max_size_mb)
+
+def LoadMesh(obj_path, mmap=True):
+    store_dir = os.environ.get("MESH_STORE_DIR", DefaultStoreDir)
+    if not store_dir: return ParseObj(obj_path)
+    return MeshStore(store_dir, float(os.environ.get("MESH_STORE_SIZE_MB", DefaultStoreSizeMB))*2**20).load(obj_path, mmap)
+
+# -----------------------------------------------------------------------
+# Adapters. The numpy arrays are passed on as they are: trimesh uses them without a copy (read-only, memory mapped), Open3D and
+# VTK (vedo) copy them into their own containers, but no text parsing is needed
+def ToOpen3D(mesh, uvs=False):
+    import open3d as o3d
+    mesh_o3d = o3d.geometry.TriangleMesh(o3d.utility.Vector3dVector(np.asarray(mesh.vertices, dtype=np.float64)),
+                                         o3d.utility.Vector3iVector(np.asarray(mesh.triangles, dtype=np.int32)))
+    if uvs and mesh.has_uvs:
+        mesh_o3d.triangle_uvs = o3d.utility.Vector2dVector(np.asarray(mesh.uvs)[np.asarray(mesh.triangle_uvs).ravel()])
+    return mesh_o3d
+
+def ToTrimesh(mesh):
+    import trimesh
+    return trimesh.Trimesh(vertices=mesh.vertices, faces=mesh.triangles, process=False, validate=False)
+
+def ToVedo(mesh, texture_path=None):
+    # vedo needs one uv per point --> the points are split at uv seams (unique (vertex, uv) pairs of the triangle corners)
+    import vedo
+    if texture_path is None or not mesh.has_uvs:
+        return vedo.Mesh([np.asarray(mesh.vertices), np.asarray(mesh.triangles)])
+    pairs = np.stack([np.asarray(mesh.triangles).ravel(), np.asarray(mesh.triangle_uvs).ravel()], axis=1)
+    unique_pairs, corner_point = np.unique(pairs, axis=0, return_inverse=True)
+    mesh_vedo = vedo.Mesh([np.asarray(mesh.vertices)[unique_pairs[:,0]], corner_point.reshape(-1,3)])
+    return mesh_vedo.texture(str(texture_path), tcoords=np.asarray(mesh.uvs)[unique_pairs[:,1]])
@@ -0,0 +1,238 @@
+import numpy as np
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+import importlib
+import sys
+importlib.reload(sys.modules['src.DiskCache']) if 'src.DiskCache' in sys.modules else None
+from src.DiskCache import DiskCache, FileContentHash
+importlib.reload(sys.modules['src.FineMeshRegistrationNative']) if 'src.FineMeshRegistrationNative' in sys.modules else None
+from src.FineMeshRegistrationNative import MeshDistance, ReadObjMesh
+
+# Narrow band signed distance field of a triangle mesh (built once per object, stored on disk, memory mapped on load)
+#   - regular grid (voxel_size) around the mesh, split into bricks of brick_size³ cells, only the bricks within the band
+#     (band voxels around the surface) are stored --> memory ~ surface area / voxel_size² instead of volume / voxel_size³
+#   - every brick stores its (brick_size+1)³ nodes (shared faces are duplicated) --> the 8 corners of a cell are always in one brick
+#   - node values are exact signed distances (MeshDistance, pseudonormal sign), optionally with the exact gradients
+#   - queries: trilinear interpolation of the distance (and gradient), exact fallback (MeshDistance) for points outside of the
+#     stored bricks and for points closer than fallback_distance voxels to the surface, where the interpolation is least accurate
+#   - same query interface as MeshDistance (signed_distances, closest_points, closest_points_normals) --> usable in the
+#     evaluation, the ICP (ScaledPointToPlaneICP) and for inside / outside tests (contains)
+SDF_FILES = ("brick_index", "values", "gradients", "vertices", "triangles")
+
+# -----------------------------------------------------------------------
+class SignedDistanceField:
+    def __init__(self, meta, arrays, workers=-1):
+        self.meta = meta
+        self.voxel_size = float(meta["voxel_size"]); self.brick_size = int(meta["brick_size"])
+        self.origin = np.asarray(meta["origin"], dtype=float); self.dims = np.asarray(meta["dims"], dtype=np.int64)   # nodes per axis
+        self.fallback_distance = float(meta["fallback_distance"]) * self.voxel_size
+        self.brick_index = arrays["brick_index"]; self.values = arrays["values"]; self.gradients = arrays.get("gradients")
+        self.vertices = arrays["vertices"]; self.triangles = arrays["triangles"]
+        self.workers = workers
+        self._mesh_distance = None
+
+    @property
+    def mesh_distance(self):
+        # exact fallback, only built if a query needs it
+        if self._mesh_distance is None:
+            self._mesh_distance = MeshDistance(np.asarray(self.vertices), np.asarray(self.triangles), workers=self.workers)
+        return self._mesh_distance
+
+    @property
+    def nbytes(self):
+        return int(sum(a.nbytes for a in (self.brick_index, self.values, self.gradients) if a is not None))
+
+    # -----------------------------------------------------------------------
+    @classmethod
+    def build(cls, vertices, triangles, voxel_size, band=3, brick_size=8, store_gradients=True, fallback_distance=1.0,
+              chunk_size=200000, workers=-1):
+        vertices = np.asarray(vertices, dtype=float); triangles = np.asarray(triangles, dtype=np.int64)
+        mesh_distance = MeshDistance(vertices, triangles, workers=workers)
+        B = int(brick_size); h = float(voxel_size)
+        origin = vertices.min(axis=0) - (band+1)*h
+        n_bricks = np.ceil((vertices.max(axis=0) + (band+1)*h - origin) / (B*h)).astype(np.int64)
+        dims = n_bricks*B + 1
+        # bricks within the band: the distance is 1-Lipschitz --> a brick can contain |d| <= band*h only if the distance of its
+        # center is at most band*h + half of the brick diagonal
+        brick_ijk = np.stack(np.meshgrid(*[np.arange(n) for n in n_bricks], indexing='ij'), axis=-1).reshape(-1,3)
+        d_center, _, _ = mesh_distance.closest_points(origin + (brick_ijk + 0.5)*B*h)
+        brick_ijk = brick_ijk[d_center <= band*h + np.sqrt(3)*B*h/2]
+        brick_index = np.full(n_bricks, -1, dtype=np.int32)
+        brick_index[tuple(brick_ijk.T)] = np.arange(len(brick_ijk), dtype=np.int32)
+        # exact signed distances (and gradients) at all nodes of the stored bricks
+        local = np.stack(np.meshgrid(*[np.arange(B+1)]*3, indexing='ij'), axis=-1).reshape(-1,3)
+        nodes_per_brick = len(local)
+        values = np.empty(len(brick_ijk)*nodes_per_brick, dtype=np.float32)
+        gradients = np.empty([len(values),3], dtype=np.float32) if store_gradients else None
+        bricks_per_chunk = max(1, chunk_size // nodes_per_brick)
+        for start in range(0, len(brick_ijk), bricks_per_chunk):
+            stop = min(start+bricks_per_chunk, len(brick_ijk))
+            nodes = origin + ((brick_ijk[start:stop,None,:]*B + local[None]).reshape(-1,3))*h
+            d, q, t = mesh_distance.signed_distances(nodes)
+            values[start*nodes_per_brick:stop*nodes_per_brick] = d
+            if store_gradients:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    g = (nodes - q) / d[:,None]                 # points away from the surface for outside and inside nodes
+                on_surface = np.abs(d) < 1e-12
+                g[on_surface] = mesh_distance.pseudonormals(q[on_surface], t[on_surface])
+                gradients[start*nodes_per_brick:stop*nodes_per_brick] = g / np.maximum(np.linalg.norm(g, axis=1, keepdims=True), 1e-300)
+        meta = {"voxel_size": h, "band": band, "brick_size": B, "fallback_distance": fallback_distance,
+                "origin": origin.tolist(), "dims": dims.tolist(), "bricks": int(len(brick_ijk))}
+        arrays = {"brick_index": brick_index, "values": values.reshape(-1,B+1,B+1,B+1), "vertices": vertices, "triangles": triangles}
+        if store_gradients: arrays["gradients"] = gradients.reshape(-1,B+1,B+1,B+1,3)
+        sdf = cls(meta, arrays, workers)
+        sdf._mesh_distance = mesh_distance
+        return sdf
+
+    def save(self, sdf_dir):
+        # one .npy file per array (memory mappable) + meta.json, written to a temporary folder first (atomic for other processes)
+        sdf_dir = Path(sdf_dir)
+        tmp_dir = sdf_dir.with_name(f"{sdf_dir.name}.{os.getpid()}.tmp")
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        for name in SDF_FILES:
+            array = getattr(self, name)
+            if array is not None: np.save(tmp_dir / (name + ".npy"), np.asarray(array))
+        with open(tmp_dir / "meta.json", 'w') as file:
+            json.dump(self.meta, file, indent=4)
+        if sdf_dir.exists(): shutil.rmtree(sdf_dir, ignore_errors=True)
+        os.replace(tmp_dir, sdf_dir)
+
+    @classmethod
+    def load(cls, sdf_dir, mmap=True, workers=-1):
+        sdf_dir = Path(sdf_dir)
+        with open(sdf_dir / "meta.json", 'r') as file:
+            meta = json.load(file)
+        arrays = {name: np.load(sdf_dir / (name + ".npy"), mmap_mode='r' if mmap else None)
+                  for name in SDF_FILES if (sdf_dir / (name + ".npy")).is_file()}
+        return cls(meta, arrays, workers)
+
+    # -----------------------------------------------------------------------
+    def _interpolate(self, points):
+        # trilinear interpolation --> distances (NaN: no brick / outside of the grid) and unit gradients of the valid points
+        B = self.brick_size
+        g = (points - self.origin) / self.voxel_size
+        cell = np.floor(g).astype(np.int64)
+        valid = np.all((cell >= 0) & (cell < self.dims-1), axis=1)
+        cell[~valid] = 0
+        brick = cell // B; lx, ly, lz = (cell - brick*B).T
+        bid = np.asarray(self.brick_index)[brick[:,0], brick[:,1], brick[:,2]].astype(np.int64)
+        valid &= bid >= 0
+        bid[~valid] = 0
+        fx, fy, fz = (g - cell).T
+        distances = np.zeros(len(points)); gradients = np.zeros([len(points),3]); dd = np.zeros([len(points),3])
+        for dx in (0,1):
+            for dy in (0,1):
+                for dz in (0,1):
+                    wx = fx if dx else 1-fx; wy = fy if dy else 1-fy; wz = fz if dz else 1-fz
+                    v = self.values[bid, lx+dx, ly+dy, lz+dz].astype(float)
+                    distances += wx*wy*wz*v
+                    if self.gradients is not None:
+                        gradients += (wx*wy*wz)[:,None] * self.gradients[bid, lx+dx, ly+dy, lz+dz]
+                    else:       # analytic gradient of the trilinear interpolant
+                        dd[:,0] += (1 if dx else -1)*wy*wz*v; dd[:,1] += wx*(1 if dy else -1)*wz*v; dd[:,2] += wx*wy*(1 if dz else -1)*v
+        if self.gradients is None: gradients = dd
+        gradients /= np.maximum(np.linalg.norm(gradients, axis=1, keepdims=True), 1e-300)
+        distances[~valid] = np.nan
+        return distances, gradients
+
+    def signed_distances(self, points, chunk_size=200000):
+        # --> signed distances (N,), closest points (N,3), triangle indices (N,) (-1 for interpolated points)
+        points = np.asarray(points, dtype=float)
+        distances = np.empty(len(points)); closest = np.empty([len(points),3]); triangle = np.full(len(points), -1, dtype=np.int64)
+        for start in range(0, len(points), chunk_size):
+            p = points[start:start+chunk_size]
+            d, n = self._interpolate(p)
+            closest[start:start+len(p)] = p - d[:,None]*n
+            distances[start:start+len(p)] = d
+            exact = start + np.flatnonzero(~(np.abs(d) >= self.fallback_distance))         # NaN or near the surface
+            if len(exact):
+                distances[exact], closest[exact], triangle[exact] = self.mesh_distance.signed_distances(points[exact])
+        return distances, closest, triangle
+
+    def closest_points(self, points):
+        # same as MeshDistance.closest_points (unsigned distances)
+        distances, closest, triangle = self.signed_distances(points)
+        return np.abs(distances), closest, triangle
+
+    def closest_points_normals(self, points):
+        # closest points and normals for the ICP: face normal (exact) or the interpolated gradient, oriented like the face normals
+        points = np.asarray(points, dtype=float)
+        distances, closest, triangle = self.signed_distances(points)
+        exact = triangle >= 0
+        normals = np.empty([len(points),3])
+        normals[exact] = self.mesh_distance.face_normals[triangle[exact]]
+        normals[~exact] = (points[~exact] - closest[~exact]) / distances[~exact,None]
+        return closest, normals
+
+    def contains(self, points):
+        # inside / outside test of a closed mesh
+        return self.signed_distances(points)[0] < 0
+
+# -----------------------------------------------------------------------
+def LoadOrBuildSignedDistanceField(mesh_path, cache_dir="cache/sdf", voxel_size=None, voxel_fraction=1/256, band=3, brick_size=8,
+                                   store_gradients=True, fallback_distance=1.0, workers=-1):
+    # SDF of an obj file, stored in cache_dir/<key> (key: content hash of the mesh and the build parameters)
+    # voxel_size None: voxel_fraction of the bounding box diagonal
+    vertices, triangles = ReadObjMesh(mesh_path)
+    if voxel_size is None: voxel_size = voxel_fraction * float(np.linalg.norm(vertices.max(axis=0) - vertices.min(axis=0)))
+    key = DiskCache.key(mesh=FileContentHash(mesh_path), voxel_size=voxel_size, band=band, brick_size=brick_size,
+                        gradients=store_gradients, fallback_distance=fallback_distance)
+    sdf_dir = Path(cache_dir) / key
+    if (sdf_dir / "meta.json").is_file():
+        try: return SignedDistanceField.load(sdf_dir, workers=workers)
+        except (OSError, ValueError) as e: print(f"Warning: SDF could not be loaded, rebuilding it: {e}")
+    t0 = time.perf_counter()
+    sdf = SignedDistanceField.build(vertices, triangles, voxel_size, band, brick_size, store_gradients, fallback_distance, workers=workers)
+    sdf.save(sdf_dir)
+    print(f"SDF built in {time.perf_counter()-t0:.1f}s: {sdf.meta['bricks']} bricks, {sdf.nbytes/2**20:.1f} MB ({sdf_dir})")
+    return SignedDistanceField.load(sdf_dir, workers=workers)
+
+##############################################################################################################
+#                              Benchmark: memory and query throughput vs. exact                              #
+##############################################################################################################
+
+def BenchmarkSignedDistanceField(mesh_paths=None, objects_dir="objects", voxel_fractions=(1/128, 1/256), bands=(2, 4),
+                                 store_gradients=(True, False), number_of_points=200000, noise_fraction=0.02, seed=42):
+    # For every mesh and SDF configuration: build time, memory, query throughput and distance error w.r.t. the exact
+    # MeshDistance, for points near the surface (surface samples + gaussian noise of noise_fraction of the bbox diagonal)
+    from src.MeshSampling import SampleUniform
+    import pandas as pd
+    if mesh_paths is None:
+        mesh_paths = sorted(p / (p.name + ".obj") for p in Path(objects_dir).iterdir() if (p / (p.name + ".obj")).is_file())
+    if not mesh_paths: print(f"No objects found in {objects_dir}"); return []
+    rng = np.random.default_rng(seed); results = []
+    for mesh_path in mesh_paths:
+        vertices, triangles = ReadObjMesh(mesh_path)
+        diagonal = float(np.linalg.norm(vertices.max(axis=0) - vertices.min(axis=0)))
+        points = SampleUniform(vertices, triangles, number_of_points, seed)[0] + rng.normal(scale=noise_fraction*diagonal, size=(number_of_points,3))
+        t0 = time.perf_counter()
+        exact = MeshDistance(vertices, triangles)
+        d_exact = exact.signed_distances(points)[0]
+        t_exact = time.perf_counter() - t0
+        print(f"{Path(mesh_path).stem}: {len(triangles)} triangles, exact {number_of_points/t_exact:.0f} points/s")
+        for voxel_fraction in voxel_fractions:
+            for band in bands:
+                for gradients in store_gradients:
+                    t0 = time.perf_counter()
+                    sdf = SignedDistanceField.build(vertices, triangles, voxel_fraction*diagonal, band, store_gradients=gradients)
+                    t_build = time.perf_counter() - t0
+                    sdf._mesh_distance = None                   # fallback is built lazily, like after loading from disk
+                    t0 = time.perf_counter()
+                    d, _, triangle = sdf.signed_distances(points)
+                    t_query = time.perf_counter() - t0
+                    error = np.abs(d - d_exact)
+                    results.append({"object": Path(mesh_path).stem, "voxel_fraction": voxel_fraction, "band": band, "gradients": gradients,
+                                    "bricks": sdf.meta["bricks"], "memory_MB": sdf.nbytes/2**20, "time_build": t_build,
+                                    "points_per_s": number_of_points/t_query, "speedup": t_exact/t_query,
+                                    "exact_fraction": float(np.mean(triangle >= 0)), "max_error_voxels": float(error.max()/sdf.voxel_size),
+                                    "sign_errors": int(np.sum(np.sign(d) != np.sign(d_exact)))})
+    df = pd.DataFrame(results)
+    print(df.to_string(float_format=lambda x: f"{x:.4f}"))
+    return df
+
+
+if __name__ == "__main__":
+    BenchmarkSignedDistanceField()
@@ -0,0 +1,148 @@
+import numpy as np
+import json
+import time
+import zipfile
+from pathlib import Path
+import importlib
+import sys
+importlib.reload(sys.modules['src.FineMeshRegistrationNative']) if 'src.FineMeshRegistrationNative' in sys.modules else None
+from src.FineMeshRegistrationNative import MeshDistance, ReadObjMesh
+
+# Symmetric surface distances between the reconstructed and the ground truth mesh (rec --> gt and gt --> rec)
+#   - the points (mesh vertices) are processed in chunks of fixed size, the signed distances of each chunk are streamed into a
+#     compressed .npz file (one array "distances", per vertex --> heatmaps) --> the memory does not grow with the number of points
+#   - statistics from running sums (mean, RMS, chamfer), maxima (Hausdorff) and counts (F-score) of the chunks
+#   - exact percentiles in constant memory: radix selection on the float32 bit patterns (histogram of the upper 16 bits in a
+#     second pass, histogram of the lower 16 bits inside the bins containing the requested percentiles in a third pass)
+DistanceDirections = {"rec2gt": "DistancesRec2GT.npz", "gt2rec": "DistancesGT2Rec.npz"}
+
+# -----------------------------------------------------------------------
+class DistanceWriter:
+    # streams a float32 array chunk by chunk into a compressed .npz file (readable with np.load(path)["distances"])
+    def __init__(self, path, length, name="distances"):
+        self.path = Path(path)
+        self.zip_file = zipfile.ZipFile(self.path, mode='w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        self.file = self.zip_file.open(name + ".npy", mode='w', force_zip64=True)
+        np.lib.format.write_array_header_1_0(self.file, {"descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+                                                         "fortran_order": False, "shape": (int(length),)})
+
+    def write(self, chunk):
+        self.file.write(np.ascontiguousarray(chunk, dtype=np.float32).tobytes())
+
+    def close(self):
+        self.file.close(); self.zip_file.close()
+
+def ReadDistanceChunks(path, chunk_size=1000000, name="distances"):
+    # generator over the chunks of an array written by DistanceWriter (decompressed chunk by chunk)
+    with zipfile.ZipFile(path, 'r') as zip_file, zip_file.open(name + ".npy", 'r') as file:
+        version = np.lib.format.read_magic(file)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1,0) else np.lib.format.read_array_header_2_0
+        shape, _, dtype = read_header(file)
+        remaining = int(np.prod(shape))
+        while remaining > 0:
+            count = min(chunk_size, remaining)
+            yield np.frombuffer(file.read(count*dtype.itemsize), dtype=dtype)
+            remaining -= count
+
+# -----------------------------------------------------------------------
+def ChunkedDistances(points, mesh_distance, distances_path, thresholds=(), chunk_size=1000000):
+    # signed distances of all points to the mesh, streamed to distances_path --> running statistics of the absolute distances
+    stats = {"count": 0, "sum": 0.0, "sum_sq": 0.0, "sum_signed": 0.0, "max": 0.0, "within": np.zeros(len(thresholds), dtype=np.int64)}
+    writer = DistanceWriter(distances_path, len(points))
+    try:
+        for start in range(0, len(points), chunk_size):
+            d = mesh_distance.signed_distances(np.asarray(points[start:start+chunk_size], dtype=float))[0]
+            writer.write(d)
+            a = np.abs(d)
+            stats["count"] += len(a); stats["sum"] += float(a.sum()); stats["sum_sq"] += float(np.dot(a, a)); stats["sum_signed"] += float(d.sum())
+            stats["max"] = max(stats["max"], float(a.max()))
+            stats["within"] += np.array([np.count_nonzero(a <= t) for t in thresholds], dtype=np.int64)
+    finally:
+        writer.close()
+    return stats
+
+def ChunkedPercentiles(distances_path, percentiles, count, chunk_size=1000000):
+    # exact percentiles (numpy's default linear interpolation) of the absolute distances without loading the whole array
+    # the bit pattern of a non-negative float32 is ordered like its value --> two passes over the file with a histogram of 2^16 bins:
+    # pass 1: upper 16 bits of all values, pass 2: lower 16 bits of the values inside the bins that contain the needed order statistics
+    # --> memory depends only on the number of percentiles, not on the number of points or the distribution of the distances
+    if count == 0: return [None]*len(percentiles)
+    positions = np.asarray(percentiles, dtype=float)/100 * (count-1)
+    ranks = np.unique(np.concatenate([np.floor(positions), np.ceil(positions)]).astype(np.int64))   # order statistics needed
+    bins = 2**16
+    histogram = np.zeros(bins, dtype=np.int64)
+    for d in ReadDistanceChunks(distances_path, chunk_size):
+        histogram += np.bincount(np.abs(d.astype(np.float32)).view(np.uint32) >> 16, minlength=bins)
+    cumulative = np.cumsum(histogram)
+    rank_bins = np.searchsorted(cumulative, ranks, side='right')         # upper 16 bits of every needed order statistic
+    wanted = np.unique(rank_bins)
+    histogram_fine = {bin_: np.zeros(bins, dtype=np.int64) for bin_ in wanted}
+    for d in ReadDistanceChunks(distances_path, chunk_size):
+        bits = np.abs(d.astype(np.float32)).view(np.uint32)
+        upper = bits >> 16
+        for bin_ in wanted: histogram_fine[bin_] += np.bincount(bits[upper == bin_] & 0xFFFF, minlength=bins)
+    order_statistic = {}
+    for rank, bin_ in zip(ranks, rank_bins):
+        start = cumulative[bin_] - histogram[bin_]                       # number of values in the lower bins
+        lower = np.searchsorted(np.cumsum(histogram_fine[bin_]), rank - start, side='right')
+        order_statistic[rank] = float(np.array([(bin_ << 16) | lower], dtype=np.uint32).view(np.float32)[0])
+    result = []
+    for position in positions:
+        low = order_statistic[int(np.floor(position))]; high = order_statistic[int(np.ceil(position))]
+        result.append(low + (high - low)*(position - np.floor(position)))
+    return result
+
+# -----------------------------------------------------------------------
+def DirectionStatistics(stats, percentile_values, percentiles, thresholds):
+    n = max(stats["count"], 1)
+    result = {"count": stats["count"], "mean": stats["sum"]/n, "mean_signed": stats["sum_signed"]/n, "rms": float(np.sqrt(stats["sum_sq"]/n)),
+              "max": stats["max"]}
+    result.update({f"P{p:g}": v for p, v in zip(percentiles, percentile_values)})
+    result["within"] = {f"{t:g}": float(w/n) for t, w in zip(thresholds, stats["within"])}
+    return result
+
+def SymmetricMetrics(rec2gt, gt2rec, thresholds):
+    # Hausdorff distance, chamfer distance (sum of the mean distances of both directions, L1 and squared) and F-score
+    # (precision: fraction of the reconstruction within the threshold, recall: fraction of the ground truth within the threshold)
+    metrics = {"hausdorff": max(rec2gt["max"], gt2rec["max"]), "chamfer_l1": rec2gt["mean"] + gt2rec["mean"],
+               "chamfer_l2": rec2gt["rms"]**2 + gt2rec["rms"]**2, "fscore": {}}
+    for t in thresholds:
+        precision = rec2gt["within"][f"{t:g}"]; recall = gt2rec["within"][f"{t:g}"]
+        fscore = 2*precision*recall/(precision+recall) if precision+recall > 0 else 0.0
+        metrics["fscore"][f"{t:g}"] = {"precision": precision, "recall": recall, "fscore": fscore}
+    return metrics
+
+##############################################################################################################
+#                         MAIN FUNCTION  --> SurfaceDistanceMetrics                                          #
+##############################################################################################################
+
+def SurfaceDistanceMetrics(evaluation_path, mesh_gt_path, mesh_r_path, T, thresholds=(0.001, 0.002, 0.005), percentiles=(50, 90, 99),
+                           chunk_size=1000000, sdf_params=None):
+    # rec --> gt: vertices of the reconstructed mesh (transformed with T) to the ground truth mesh
+    # gt --> rec: vertices of the ground truth mesh to the transformed reconstructed mesh
+    # --> SurfaceDistanceMetrics.json and the per vertex signed distances (DistancesRec2GT.npz, DistancesGT2Rec.npz)
+    evaluation_path = Path(evaluation_path); t_start = time.perf_counter()
+    vertices_gt, triangles_gt = ReadObjMesh(mesh_gt_path)
+    vertices_r, triangles_r = ReadObjMesh(mesh_r_path)
+    vertices_r = vertices_r @ T[:3,:3].T + T[:3,3]
+    metrics = {"thresholds": list(thresholds), "percentiles": list(percentiles)}
+    for direction in DistanceDirections:
+        # only one mesh index in memory at a time
+        if direction == "gt2rec":
+            points = vertices_gt; mesh_distance = MeshDistance(vertices_r, triangles_r)
+        elif sdf_params:
+            from src.SignedDistanceField import LoadOrBuildSignedDistanceField
+            points = vertices_r; mesh_distance = LoadOrBuildSignedDistanceField(mesh_gt_path, **sdf_params)
+        else:
+            points = vertices_r; mesh_distance = MeshDistance(vertices_gt, triangles_gt)
+        distances_path = evaluation_path / DistanceDirections[direction]
+        stats = ChunkedDistances(points, mesh_distance, distances_path, thresholds, chunk_size)
+        percentile_values = ChunkedPercentiles(distances_path, percentiles, stats["count"], chunk_size)
+        metrics[direction] = DirectionStatistics(stats, percentile_values, percentiles, thresholds)
+    metrics.update(SymmetricMetrics(metrics["rec2gt"], metrics["gt2rec"], thresholds))
+    metrics["time"] = time.perf_counter() - t_start
+    with open(evaluation_path / "SurfaceDistanceMetrics.json", 'w') as file:
+        json.dump(metrics, file, indent=4)
+    print(f"Surface distances ({metrics['time']:.1f}s): Hausdorff {metrics['hausdorff']:.6f}, chamfer {metrics['chamfer_l1']:.6f}, "
+          + ", ".join(f"F@{t}: {v['fscore']:.3f}" for t, v in metrics["fscore"].items()))
+    return metrics
@@ -3,12 +3,21 @@ from pathlib import Path
 import json
 import subprocess
 import shutil
+import time
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import matplotlib as mpl
 import matplotlib.font_manager as font_manager
 import matplotlib.pyplot as plt
 import skimage as ski
 import numpy as np
 from icecream import ic
+import importlib
+import sys
+importlib.reload(sys.modules['src.BatchedGLCM']) if 'src.BatchedGLCM' in sys.modules else None
+from src.BatchedGLCM import BatchedGLCM, GLCMFeatures
+importlib.reload(sys.modules['src.DiskCache']) if 'src.DiskCache' in sys.modules else None
+from src.DiskCache import DiskCache
 
 # Schriftgroesse
 fsize = 11 # Allgemein
@@ -46,27 +55,42 @@ plt.rcParams['legend.handlelength'] = lhandle
 #fig_height = fig_width*golden_mean      # height in inches
 
 def GetImagesForTextureEvaluation(obj_path,output_path,script_path,blender_path,DebugMode=False):
+    GetImagesForTextureEvaluationJobs([(obj_path,output_path)],script_path,blender_path,DebugMode)
+
+def GetImagesForTextureEvaluationJobs(jobs,script_path,blender_path,DebugMode=False,processes=1):
+    # renders of several objects: jobs [(obj_path, output_path), ...]. One Blender process renders a list of jobs with the same
+    # cameras and lights (created once, only the object is swapped). processes > 1: the jobs are split over concurrent Blender processes
+    processes = max(1, min(processes, len(jobs)))
     # Parameter File Path
     TextureParams_path_input = Path(script_path) / "params_textureEvaluation_default.json"
     # Load Parameter from json file
     with open(TextureParams_path_input, 'r') as file:
         params_texture = json.load(file)
-    # Change parameters. In this case, object path and output path
-    params_texture["io"]["obj_path"] = str(obj_path)
-    params_texture["io"]["output_path"] = str(output_path)
-    # Update Json File
-    TextureParams_path_output = Path(script_path) / "params_textureEvaluation.json"
-    with open(TextureParams_path_output, "w") as json_file:
-        json.dump(params_texture, json_file, indent=5) 
-    # delete output folder if already exist 
-    if os.path.exists(output_path):
-        shutil.rmtree(output_path)
-    # create output folder
-    os.makedirs(output_path)
+    commands = []
+    for i in range(processes):
+        # Change parameters. In this case, object paths and output paths of the jobs of this process
+        process_jobs = [{"obj_path": str(obj_path), "output_path": str(output_path)} for obj_path, output_path in jobs[i::processes]]
+        params_texture["io"]["obj_path"] = process_jobs[0]["obj_path"]
+        params_texture["io"]["output_path"] = process_jobs[0]["output_path"]
+        params_texture["io"]["jobs"] = process_jobs
+        # Update Json File (one file per process)
+        suffix = "" if i == 0 else f".{i}"
+        TextureParams_path_output = Path(script_path) / f"params_textureEvaluation{suffix}.json"
+        with open(TextureParams_path_output, "w") as json_file:
+            json.dump(params_texture, json_file, indent=5) 
+        commands.append((f'{blender_path} --background --python {Path(script_path) / "texture_evaluation.py"} -- "{TextureParams_path_output}"',
+                         Path(script_path) / f"logfile{suffix}.txt"))
+    for _, output_path in jobs:
+        # delete output folder if already exist 
+        if os.path.exists(output_path):
+            shutil.rmtree(output_path)
+        # create output folder
+        os.makedirs(output_path)
     # render images in blender
-    script_path = Path(script_path) / "texture_evaluation.py"
-    command = f"{blender_path} --background --python {script_path}"
-    log_file = Path(script_path).parent / 'logfile.txt'
+    with ThreadPoolExecutor(processes) as pool:
+        list(pool.map(lambda command: RunBlender(*command, DebugMode), commands))
+
+def RunBlender(command,log_file,DebugMode=False):
     with log_file.open('w') as f, subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True) as proc:
         for line in proc.stdout:
             if DebugMode:
@@ -76,11 +100,17 @@ def GetImagesForTextureEvaluation(obj_path,output_path,script_path,blender_path,
   
     
 def GLCM_Evaluation(evaluation_dir,OutputTextureRef_path,OutputTextureRec_path,patch_size,image_number,levels,distances,random_seed=124,
-                    features = ["dissimilarity","correlation"],num_windows=4, offset = [0,0], offset_method = "non-standardized",DisplayPlots=True):
+                    features = ["dissimilarity","correlation"],num_windows=4, offset = [0,0], offset_method = "non-standardized",DisplayPlots=True,
+                    window_selection="mask",min_std=5.0):
+    # window_selection: "mask" --> windows drawn from the textured foreground (foreground mask + local variance), "random" --> rejection sampling
     # create Grey Scale Image
-    image_ref, image_rec, height, width = create_greyscale_image(OutputTextureRef_path,OutputTextureRec_path,levels,image_number)
+    image_ref, image_rec, height, width, mask = create_greyscale_image(OutputTextureRef_path,OutputTextureRec_path,levels,image_number,ReturnMask=True)
     # Identify window on which the object is visible
-    locations, windows_ref, windows_rec = identify_windows_containing_the_object(random_seed,height,width,patch_size,levels,distances,image_ref,image_rec,num_windows,ASM_crit = 0.1)
+    if window_selection == "mask":
+        locations, windows_ref, windows_rec, _ = identify_windows_from_mask(random_seed,patch_size,levels,distances,image_ref,image_rec,mask,num_windows,ASM_crit=0.1,min_std=min_std)
+        if len(locations) == 0: print("Warning: No textured window found. Skip the GLCM evaluation."); return
+    else:
+        locations, windows_ref, windows_rec = identify_windows_containing_the_object(random_seed,height,width,patch_size,levels,distances,image_ref,image_rec,num_windows,ASM_crit = 0.1)
     # Calculate GLCM_features for the choosen windows
     feature_matrix_ref,_ = calculate_GLCM_features(windows_ref,distances,levels,features)
     feature_matrix_rec,_ = calculate_GLCM_features(windows_rec,distances,levels,features)
@@ -92,42 +122,41 @@ def GLCM_Evaluation(evaluation_dir,OutputTextureRef_path,OutputTextureRec_path,p
     # create the figure
     GLCM_figure1(evaluation_dir,image_ref,image_rec,windows_ref,windows_rec,feature_matrix_ref,feature_matrix_rec,features,levels,patch_size,locations,offset,offset_method,DisplayPlots)
     
-def identify_windows_containing_the_object(random_seed,height,width,patch_size,levels,distances,image_ref,image_rec=None,num_windows=4,ASM_crit = 0.01):
+def identify_windows_containing_the_object(random_seed,height,width,patch_size,levels,distances,image_ref,image_rec=None,num_windows=4,ASM_crit = 0.01,
+                                           batch_size=64, max_tries=999):
+    # rejection sampling of windows with texture (ASM <= ASM_crit): the candidates are drawn with the same seed sequence as before
+    # (two seeds per candidate), but their ASM is computed for a batch of candidates at once (BatchedGLCM)
     locations = []
     windows_ref = []
     windows_rec = []
     for i in range(num_windows):
-        count = 1; ASM = 1 
-        while ASM > ASM_crit and count < 1000:
-            np.random.seed(random_seed)
-            random_pixel_x = np.random.randint(0, height-patch_size)
-            random_seed += 1
-            np.random.seed(random_seed)
-            random_pixel_y = np.random.randint(0, width-patch_size)
-            random_seed += 1
-            loc = [random_pixel_x,random_pixel_y]
-            patch_ref = image_ref[loc[0] : loc[0] + patch_size, loc[1] : loc[1] + patch_size]
-            glcm = ski.feature.graycomatrix(
-                patch_ref, distances=[distances], angles=[0], levels=levels, symmetric=True, normed=True
-            )
-            ASM = ski.feature.graycoprops(glcm, 'ASM')[0, 0]
-            count += 1
-        windows_ref.append(patch_ref) 
+        loc = None; tries = 0
+        while loc is None and tries < max_tries:
+            n = min(batch_size, max_tries - tries)
+            candidates = []
+            for t in range(n):
+                np.random.seed(random_seed + 2*t); random_pixel_x = np.random.randint(0, height-patch_size)
+                np.random.seed(random_seed + 2*t + 1); random_pixel_y = np.random.randint(0, width-patch_size)
+                candidates.append([random_pixel_x,random_pixel_y])
+            patches = np.stack([image_ref[x : x + patch_size, y : y + patch_size] for x, y in candidates])
+            ASM = GLCMFeatures(patches, [distances], [0], levels, ["ASM"])[:,0,0,0]
+            accepted = np.flatnonzero(ASM <= ASM_crit)
+            t = accepted[0] if len(accepted) else n-1
+            random_seed += 2*(t+1); tries += t+1
+            if len(accepted) or tries >= max_tries: loc = candidates[t]
+        if len(accepted) == 0: print(f"Warning. After {max_tries} iterations, no image section fulfills criterion: ASM < {ASM_crit}")
+        windows_ref.append(image_ref[loc[0] : loc[0] + patch_size, loc[1] : loc[1] + patch_size])
         locations.append(loc)
-        if count == 1000: print(f"Warning. After 1000 iterations, no image section fulfills criterion: ASM < {ASM_crit}")
         if image_rec is not None:
             windows_rec.append(image_rec[loc[0] : loc[0] + patch_size, loc[1] : loc[1] + patch_size])
     return locations, windows_ref, windows_rec
         
-def calculate_GLCM_features(windows,distances,levels,features):
-    feature_matrix = np.zeros([len(windows),len(features)])
-    for i,window in enumerate(windows):
-        glcm = ski.feature.graycomatrix(
-            window, distances=[distances], angles=[0], levels=levels, symmetric=True, normed=True
-        )
-        for j,feature in enumerate(features):
-            feature_value = ski.feature.graycoprops(glcm, feature)[0, 0]
-            feature_matrix[i,j] = feature_value
+def calculate_GLCM_features(windows,distances,levels,features,angles=[0],reduced_levels=None):
+    # features of all windows in one batch --> (number of windows, number of features), first distance and angle
+    # (all distances / angles: GLCMFeatures) and the GLCM of the last window
+    if len(windows) == 0: return np.zeros([0,len(features)]), None
+    feature_matrix = GLCMFeatures(np.stack(windows), np.atleast_1d(distances), angles, levels, features, reduced_levels=reduced_levels)[:,:,0,0]
+    glcm = BatchedGLCM(windows[-1], np.atleast_1d(distances), angles, levels, reduced_levels=reduced_levels)[0]
     return feature_matrix, glcm
 
 def GLCM_figure1(evaluation_dir,image_ref,image_rec,windows_ref,windows_rec,features_ref,features_rec,features,levels,patch_size,locations,offset,offset_method,DisplayPlots = True):
@@ -209,38 +238,261 @@ def get_image_path_by_number(directory, image_number):
         return None
     return os.path.join(directory, image_files[image_number - 1])
 
-def create_greyscale_image(OutputTextureRef_path,OutputTextureRec_path,levels,image_number):
+def create_greyscale_image(OutputTextureRef_path,OutputTextureRec_path,levels,image_number,ReturnMask=False):
     image_ref_path = get_image_path_by_number(OutputTextureRef_path,image_number)
     image_rec_path = get_image_path_by_number(OutputTextureRec_path,image_number)
     color_image_ref = ski.io.imread(image_ref_path)
     color_image_rec = ski.io.imread(image_rec_path)
-    gray_image_ref = ski.color.rgb2gray(color_image_ref)
-    gray_image_rec = ski.color.rgb2gray(color_image_rec)
-    image_ref = np.uint8(gray_image_ref * (levels-1))
-    image_rec = np.uint8(gray_image_rec * (levels-1))
+    image_ref = GreyscaleImage(color_image_ref, levels)
+    image_rec = GreyscaleImage(color_image_rec, levels)
     height, width = color_image_ref.shape[:2]
+    if ReturnMask:
+        # windows have to show the object in both renders --> intersection of the foreground masks
+        mask = ForegroundMask(color_image_ref) & ForegroundMask(color_image_rec)
+        return image_ref, image_rec, height, width, mask
     return image_ref, image_rec, height, width
 
-def GLCM_feature_correlation(OutputTextureRef_path,OutputTextureRec_path,patch_size,levels,distances,features = ["dissimilarity","correlation"], offset = [0,0], offset_method = "non-standardized"):
-    n_images = 12
-    n_random_seeds = 10
-    n_windows = 10
-    features_rec = np.ones([n_images*n_random_seeds*n_windows,2])*(-1)
-    features_ref = np.ones([n_images*n_random_seeds*n_windows,2])*(-1)
-    start = 0
-    for image_number in np.arange(1,n_images+1):
-        # create Grey Scale Image
-        image_ref, image_rec, height, width = create_greyscale_image(OutputTextureRef_path,OutputTextureRec_path,levels,image_number)
-        # Identify window on which the object is visible
-        for seed in np.arange(1,n_random_seeds+1):
+def ForegroundMask(color_image, background=None, tolerance=0.05):
+    # pixels showing the object: alpha channel of RGBA renders (transparent film), otherwise all pixels whose colour differs from
+    # the background colour (default: median colour of the image border) by more than tolerance (fraction of the value range)
+    color_image = np.asarray(color_image)
+    if color_image.ndim == 2: color_image = color_image[...,None]
+    if color_image.shape[2] == 4 and color_image[...,3].min() < color_image[...,3].max():
+        return color_image[...,3] > 0
+    rgb = color_image[...,:3].astype(float)
+    if background is None:
+        border = np.concatenate([rgb[0], rgb[-1], rgb[:,0], rgb[:,-1]])
+        background = np.median(border, axis=0)
+    value_range = 255.0 if color_image.dtype == np.uint8 else 1.0
+    return np.max(np.abs(rgb - np.asarray(background, dtype=float)), axis=-1) > tolerance*value_range
+
+def IntegralImage(image):
+    # summed area table with a leading row and column of zeros --> sum of any window with 4 lookups
+    table = np.zeros([image.shape[0]+1, image.shape[1]+1])
+    np.cumsum(np.cumsum(image, axis=0, dtype=float), axis=1, out=table[1:,1:])
+    return table
+
+def WindowSums(table, patch_size):
+    # sums of all patch_size x patch_size windows, indexed by the window origin (top left pixel)
+    p = patch_size
+    return table[p:,p:] - table[:-p,p:] - table[p:,:-p] + table[:-p,:-p]
+
+def LocalVarianceMap(image, patch_size):
+    # variance of the grey values of every window (integral images of g and g², computed once per image)
+    image = np.asarray(image, dtype=float); n = patch_size**2
+    mean = WindowSums(IntegralImage(image), patch_size) / n
+    return np.maximum(WindowSums(IntegralImage(image**2), patch_size) / n - mean**2, 0)
+
+def QualifyingWindowOrigins(image, mask, patch_size, min_std=5.0, min_foreground=1.0):
+    # origins (row, column) of all windows which lie (to min_foreground) on the object and are textured (std >= min_std grey levels)
+    foreground = WindowSums(IntegralImage(mask), patch_size) / patch_size**2
+    qualifying = (foreground >= min_foreground - 1e-9) & (LocalVarianceMap(image, patch_size) >= min_std**2)
+    return np.argwhere(qualifying)
+
+def identify_windows_from_mask(random_seed,patch_size,levels,distances,image_ref,image_rec,mask,num_windows=4,ASM_crit=0.1,min_std=5.0,
+                               min_foreground=1.0,batch_size=64,origins=None):
+    # windows drawn directly from the qualifying origins (foreground mask + local variance) in a random order given by the seed,
+    # the ASM criterion is checked for a batch of them at once --> no rejected background samples
+    # origins: QualifyingWindowOrigins of the image (computed once per image if several seeds are drawn), None --> computed here
+    # Returns locations, windows and the number of qualifying origins (warning if fewer than num_windows windows qualify)
+    if origins is None: origins = QualifyingWindowOrigins(image_ref, mask, patch_size, min_std, min_foreground)
+    order = np.random.default_rng(random_seed).permutation(len(origins))
+    locations = []
+    for start in range(0, len(order), batch_size):
+        candidates = origins[order[start:start+batch_size]]
+        if ASM_crit is not None:
+            patches = np.stack([image_ref[x : x + patch_size, y : y + patch_size] for x, y in candidates])
+            candidates = candidates[GLCMFeatures(patches, [distances], [0], levels, ["ASM"])[:,0,0,0] <= ASM_crit]
+        locations.extend(candidates[:num_windows-len(locations)].tolist())
+        if len(locations) == num_windows: break
+    if len(locations) < num_windows:
+        print(f"Warning. Only {len(locations)} of {num_windows} windows fulfill the criteria (foreground >= {min_foreground}, "
+              f"std >= {min_std}, ASM <= {ASM_crit}), {len(origins)} windows on the textured object.")
+    windows_ref = [image_ref[x : x + patch_size, y : y + patch_size] for x, y in locations]
+    windows_rec = [image_rec[x : x + patch_size, y : y + patch_size] for x, y in locations] if image_rec is not None else []
+    return locations, windows_ref, windows_rec, len(origins)
+
+#-----------------------------------------------------------------------
+# Process pool of the texture evaluation
+_WorkerData = None          # data of the pool workers (set by the initializer, inherited without copy by forked processes)
+
+def _init_worker(data):
+    global _WorkerData
+    _WorkerData = data
+
+def MapWithWorkers(function, tasks, data, workers=1):
+    # [function(task) for task in tasks] in a process pool (workers: None --> all CPUs, 1 --> in this process), data --> _WorkerData
+    # a pool spawns new interpreters on Windows, which import the main script again --> only with an if __name__ == "__main__" guard
+    workers = min(os.cpu_count() if workers is None else workers, len(tasks))
+    if workers <= 1:
+        _init_worker(data)
+        try: return [function(task) for task in tasks]
+        finally: _init_worker(None)
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(data,)) as pool:
+        return list(pool.map(function, tasks))
+
+#-----------------------------------------------------------------------
+# Dense GLCM feature maps: features of the windows on a strided grid over the whole reference and reconstruction image
+#   - the windows are a zero-copy view of the image (sliding_window_view), the grid rows are processed in blocks of rows_per_task
+#     rows (one batched GLCMFeatures call per block and image --> bounded memory), the blocks are distributed over a process pool
+#   - feature difference maps (ref - rec, one value per grid block) and statistics over the blocks on the object (foreground mask)
+def _dense_rows(rows, patch_size, stride, distances, angles, levels, features, reduced_levels):
+    # features of the windows of the grid rows [rows[0], rows[1]) --> (number of images, rows, columns, features), mean over distances and angles
+    maps = []
+    for image in _WorkerData:
+        view = np.lib.stride_tricks.sliding_window_view(image, (patch_size, patch_size))[::stride, ::stride][rows[0]:rows[1]]
+        f = GLCMFeatures(view.reshape(-1, patch_size, patch_size), np.atleast_1d(distances), angles, levels, features, reduced_levels=reduced_levels)
+        maps.append(f.mean(axis=(2,3)).reshape(view.shape[0], view.shape[1], len(features)))
+    return np.stack(maps)
+
+def DenseGLCMFeatureMaps(images, patch_size, levels, distances, features, stride=None, angles=[0], reduced_levels=None, rows_per_task=8, workers=1):
+    # feature maps (rows, columns, features) of each image on the grid with the window origins (i*stride, j*stride)
+    # workers: number of processes (None --> all CPUs, 1 --> no pool)
+    stride = stride or patch_size
+    n_rows = (images[0].shape[0] - patch_size) // stride + 1
+    tasks = [(r, min(r + rows_per_task, n_rows)) for r in range(0, n_rows, rows_per_task)]
+    dense_rows = partial(_dense_rows, patch_size=patch_size, stride=stride, distances=distances, angles=angles, levels=levels,
+                         features=features, reduced_levels=reduced_levels)
+    blocks = MapWithWorkers(dense_rows, tasks, images, workers)
+    return list(np.concatenate(blocks, axis=1))
+
+def DenseGridMask(mask, patch_size, stride, min_foreground=1.0):
+    # grid blocks whose window lies (to min_foreground) on the object
+    stride = stride or patch_size
+    return (WindowSums(IntegralImage(mask), patch_size) / patch_size**2)[::stride, ::stride] >= min_foreground - 1e-9
+
+def DenseGLCMStatistics(features_ref, features_rec, block_mask, features):
+    # statistics of the feature differences (ref - rec) over the blocks on the object
+    statistics = {"blocks": int(block_mask.sum()), "blocks_total": int(block_mask.size)}
+    for k, feature in enumerate(features):
+        ref = features_ref[...,k][block_mask]; rec = features_rec[...,k][block_mask]; diff = ref - rec
+        if len(diff) == 0: statistics[feature] = None; continue
+        statistics[feature] = {"mean_ref": float(ref.mean()), "mean_rec": float(rec.mean()), "mean_diff": float(diff.mean()),
+                               "median_diff": float(np.median(diff)), "std_diff": float(diff.std()), "mean_abs_diff": float(np.abs(diff).mean()),
+                               "P90_abs_diff": float(np.percentile(np.abs(diff), 90)),
+                               "RMSE": float(np.sqrt(np.mean(diff**2))),
+                               "correlation": float(np.corrcoef(ref, rec)[0,1]) if len(diff) > 1 and ref.std() > 0 and rec.std() > 0 else None}
+    return statistics
+
+def GLCM_DenseEvaluation(evaluation_dir,OutputTextureRef_path,OutputTextureRec_path,patch_size,image_number,levels,distances,
+                         features = ["dissimilarity","correlation"],stride=None,min_foreground=1.0,reduced_levels=None,workers=1,DisplayPlots=True):
+    # dense feature maps of one image pair --> GLCM_Dense.npz (maps and block mask), GLCM_Dense.json (statistics), GLCM_Dense.svg/pdf
+    t_start = time.perf_counter(); stride = stride or patch_size
+    image_ref, image_rec, height, width, mask = create_greyscale_image(OutputTextureRef_path,OutputTextureRec_path,levels,image_number,ReturnMask=True)
+    features_ref, features_rec = DenseGLCMFeatureMaps([image_ref, image_rec], patch_size, levels, distances, features, stride,
+                                                      reduced_levels=reduced_levels, workers=workers)
+    block_mask = DenseGridMask(mask, patch_size, stride, min_foreground)
+    statistics = DenseGLCMStatistics(features_ref, features_rec, block_mask, features)
+    statistics.update({"patch_size": patch_size, "stride": stride, "image_number": image_number, "time": time.perf_counter() - t_start})
+    np.savez_compressed(Path(evaluation_dir) / "GLCM_Dense.npz", features_ref=features_ref, features_rec=features_rec, block_mask=block_mask,
+                        features=np.array(features), patch_size=patch_size, stride=stride)
+    with open(Path(evaluation_dir) / "GLCM_Dense.json", 'w') as file:
+        json.dump(statistics, file, indent=4)
+    print(f"Dense GLCM maps ({statistics['blocks']} of {statistics['blocks_total']} blocks on the object, {statistics['time']:.1f}s): "
+          + ", ".join(f"{feature}: mean abs. diff. {statistics[feature]['mean_abs_diff']:.3f}" for feature in features if statistics[feature]))
+    GLCM_DenseFigure(evaluation_dir,image_ref,features_ref,features_rec,block_mask,features,levels,patch_size,stride,DisplayPlots)
+    return statistics
+
+def GLCM_DenseFigure(evaluation_dir,image_ref,features_ref,features_rec,block_mask,features,levels,patch_size,stride,DisplayPlots=True):
+    # greyscale reference image and the difference map of each feature (blocks off the object are blank)
+    fig, axs = plt.subplots(1, len(features)+1, layout='constrained', figsize=(3*(len(features)+1), 2.6))
+    axs[0].imshow(image_ref, cmap=plt.cm.gray, vmin=0, vmax=levels-1)
+    axs[0].set_xlabel('Greyscale Image - Ref.')
+    # extent: the block (i,j) covers the pixels of its stride cell, shifted to the center of its window
+    n_rows, n_cols = block_mask.shape; offset = patch_size/2 - stride/2
+    extent = [offset - 0.5, offset + n_cols*stride - 0.5, offset + n_rows*stride - 0.5, offset - 0.5]
+    for k, feature in enumerate(features):
+        diff = np.where(block_mask, features_ref[...,k] - features_rec[...,k], np.nan)
+        limit = np.nanmax(np.abs(diff)) if block_mask.any() else 1
+        im = axs[k+1].imshow(diff, cmap='coolwarm', vmin=-limit, vmax=limit, extent=extent, interpolation='nearest')
+        axs[k+1].set_xlim(axs[0].get_xlim()); axs[k+1].set_ylim(axs[0].get_ylim())
+        axs[k+1].set_xlabel(f'{feature} (Ref. - Rec.)')
+        fig.colorbar(im, ax=axs[k+1], shrink=0.8)
+    for ax in axs: ax.set_xticks([]); ax.set_yticks([])
+    fig.suptitle('Dense grey level co-occurrence matrix features', fontsize=11)
+    fig.savefig(Path(evaluation_dir) / 'GLCM_Dense.svg',format='svg',bbox_inches='tight')
+    fig.savefig(Path(evaluation_dir) / 'GLCM_Dense.pdf',format='pdf',bbox_inches='tight')
+    if DisplayPlots: plt.show()
+    else: plt.close(fig)
+
+#-----------------------------------------------------------------------
+# Texture dataset of a multi image study: both render folders are indexed once, all image pairs are decoded and quantized in a
+# thread pool into one contiguous uint8 array (N, 2, H, W) (0: ref, 1: rec) plus the foreground masks (N, H, W)
+# With cache_dir the arrays are memory mapped .npy files, reused as long as the renders (path, size, mtime) and levels are unchanged
+def IndexRenderFolder(directory):
+    # sorted image files of a render folder, image number n --> files[n-1] (like get_image_path_by_number)
+    directory = Path(directory)
+    if not directory.is_dir(): raise FileNotFoundError(f"The render folder {directory} does not exist.")
+    return sorted(f for f in directory.iterdir() if f.is_file())
+
+def GreyscaleImage(color_image, levels):
+    return np.uint8(ski.color.rgb2gray(color_image[...,:3]) * (levels-1))
+
+def _decode_image_pair(index, files_ref, files_rec, levels, images, masks):
+    color_image_ref = ski.io.imread(files_ref[index]); color_image_rec = ski.io.imread(files_rec[index])
+    images[index, 0] = GreyscaleImage(color_image_ref, levels); images[index, 1] = GreyscaleImage(color_image_rec, levels)
+    masks[index] = ForegroundMask(color_image_ref) & ForegroundMask(color_image_rec)
+
+def LoadTextureDataset(OutputTextureRef_path, OutputTextureRec_path, levels, image_numbers=None, cache_dir=None, workers=None):
+    # --> images (N, 2, H, W) uint8, masks (N, H, W) bool of the image numbers (None --> all images of the folders)
+    files_ref = IndexRenderFolder(OutputTextureRef_path); files_rec = IndexRenderFolder(OutputTextureRec_path)
+    n = min(len(files_ref), len(files_rec))
+    image_numbers = list(range(1, n+1)) if image_numbers is None else [int(k) for k in image_numbers]
+    if len(image_numbers) == 0 or min(image_numbers) < 1 or max(image_numbers) > n:
+        raise ValueError(f"Invalid image numbers. Valid range is 1 to {n}")
+    files_ref = [files_ref[k-1] for k in image_numbers]; files_rec = [files_rec[k-1] for k in image_numbers]
+    entry = None
+    if cache_dir is not None:
+        key = DiskCache.key(files=[(str(f.resolve()), f.stat().st_size, f.stat().st_mtime_ns) for f in files_ref + files_rec], levels=levels)
+        entry = Path(cache_dir) / f"texture_{key}"
+        if (entry / "masks.npy").is_file():
+            return np.load(entry / "images.npy", mmap_mode='r'), np.load(entry / "masks.npy", mmap_mode='r')
+    # the first pair gives the image size, the others are decoded in the thread pool directly into the (memory mapped) arrays
+    height, width = ski.io.imread(files_ref[0]).shape[:2]
+    shape = (len(image_numbers), 2, height, width)
+    if entry is not None:
+        tmp_entry = entry.with_name(f"{entry.name}.{os.getpid()}.tmp"); tmp_entry.mkdir(parents=True, exist_ok=True)
+        images = np.lib.format.open_memmap(tmp_entry / "images.npy", mode='w+', dtype=np.uint8, shape=shape)
+        masks = np.lib.format.open_memmap(tmp_entry / "masks.npy", mode='w+', dtype=bool, shape=(shape[0], height, width))
+    else:
+        images = np.empty(shape, dtype=np.uint8); masks = np.empty((shape[0], height, width), dtype=bool)
+    decode = partial(_decode_image_pair, files_ref=files_ref, files_rec=files_rec, levels=levels, images=images, masks=masks)
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(decode, range(len(image_numbers))))
+    if entry is None: return images, masks
+    images.flush(); masks.flush(); del images, masks
+    try: os.replace(tmp_entry, entry)
+    except OSError: shutil.rmtree(tmp_entry, ignore_errors=True)          # stored by another process in the meantime
+    return np.load(entry / "images.npy", mmap_mode='r'), np.load(entry / "masks.npy", mmap_mode='r')
+
+def _correlation_windows(index, patch_size, levels, distances, features, seeds, n_windows, window_selection, min_std):
+    # features of the windows of all seeds in image pair index --> (windows, features) of ref and rec
+    images, masks = _WorkerData
+    image_ref = np.asarray(images[index, 0]); image_rec = np.asarray(images[index, 1]); height, width = image_ref.shape
+    features_ref = []; features_rec = []
+    if window_selection == "mask":
+        mask = np.asarray(masks[index])
+        origins = QualifyingWindowOrigins(image_ref, mask, patch_size, min_std)      # once per image, shared by all seeds
+    for seed in seeds:
+        if window_selection == "mask":
+            locations, windows_ref, windows_rec, _ = identify_windows_from_mask(int(seed),patch_size,levels,distances,image_ref,image_rec,mask,n_windows,ASM_crit=0.1,min_std=min_std,origins=origins)
+        else:
             locations, windows_ref, windows_rec = identify_windows_containing_the_object(seed,height,width,patch_size,levels,distances,image_ref,image_rec,n_windows,ASM_crit = 0.1)
-            # Calculate GLCM_features for the choosen windows
-            feature_matrix_ref,_ = calculate_GLCM_features(windows_ref,distances,levels,features)
-            feature_matrix_rec,_ = calculate_GLCM_features(windows_rec,distances,levels,features)
-            end = start + n_windows
-            features_rec[start:end,:] = feature_matrix_rec
-            features_ref[start:end,:] = feature_matrix_ref
-            start = end
+        # Calculate GLCM_features for the choosen windows
+        features_ref.append(calculate_GLCM_features(windows_ref,distances,levels,features)[0])
+        features_rec.append(calculate_GLCM_features(windows_rec,distances,levels,features)[0])
+    return np.concatenate(features_ref), np.concatenate(features_rec)
+
+def GLCM_feature_correlation(OutputTextureRef_path,OutputTextureRec_path,patch_size,levels,distances,features = ["dissimilarity","correlation"], offset = [0,0], offset_method = "non-standardized",
+                             window_selection="random",min_std=5.0,n_images=12,n_random_seeds=10,n_windows=10,cache_dir=None,workers=1,threads=None):
+    # all image pairs are loaded once (thread pool with threads threads, optionally memory mapped cache), the windows of each image
+    # pair (all seeds) are evaluated in a process pool (workers: None --> all CPUs, 1 --> no pool)
+    images, masks = LoadTextureDataset(OutputTextureRef_path,OutputTextureRec_path,levels,np.arange(1,n_images+1),cache_dir,threads)
+    correlation_windows = partial(_correlation_windows, patch_size=patch_size, levels=levels, distances=distances, features=features,
+                                  seeds=np.arange(1,n_random_seeds+1), n_windows=n_windows, window_selection=window_selection, min_std=min_std)
+    results = MapWithWorkers(correlation_windows, list(range(len(images))), (images, masks), workers)
+    features_ref = np.concatenate([result[0] for result in results])        # fewer windows if too few qualify (mask)
+    features_rec = np.concatenate([result[1] for result in results])
     if offset_method == "non-standardized":
         features_rec[:,0] += offset[0]; features_rec[:,1] += offset[1]
     else:
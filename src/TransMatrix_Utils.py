@@ -72,7 +72,7 @@ def Get_Location_Rotation3x3_Scale_from_Transformation4x4(T):
     rotation = T[:3, :3]
     # Extract scale
     scale = np.linalg.norm(rotation, axis=0)
-    rotation /= scale
+    rotation = rotation / scale     # new array, T of the caller is not changed
     return location, rotation, scale
 
 def RotationMatrix3x3_To_EulerAngles(rotation_matrix):
@@ -81,4 +81,151 @@ def RotationMatrix3x3_To_EulerAngles(rotation_matrix):
     theta_y = np.arctan2(-rotation_matrix[2, 0], np.sqrt(rotation_matrix[2, 1]**2 + rotation_matrix[2, 2]**2))
     theta_z = np.arctan2(rotation_matrix[1, 0], rotation_matrix[0, 0])
     # Return the Euler angles in ZYX (or XYZ) order
-    return theta_x, theta_y, theta_z
\ No newline at end of file
+    return theta_x, theta_y, theta_z
+
+##############################################################################################################
+#                      Stacked kernels: (N,4,4) transformations, (N,3,3) rotations, (N,3) angles                        #
+##############################################################################################################
+# Same conventions as the scalar functions above (Euler angles: rotation_z @ rotation_y @ rotation_x)
+# A single matrix (4,4) / (3,3) or a single angle triple (3,) is also accepted
+
+def EulerAngles_To_RotationMatrix3x3_stacked(EulerAngle):
+    # EulerAngle (N,3) --> (N,3,3)
+    EulerAngle = np.asarray(EulerAngle, dtype=float).reshape(-1,3)
+    cx, cy, cz = np.cos(EulerAngle).T
+    sx, sy, sz = np.sin(EulerAngle).T
+    R = np.empty([len(EulerAngle),3,3])
+    R[:,0,0] = cz*cy; R[:,0,1] = cz*sy*sx - sz*cx; R[:,0,2] = cz*sy*cx + sz*sx
+    R[:,1,0] = sz*cy; R[:,1,1] = sz*sy*sx + cz*cx; R[:,1,2] = sz*sy*cx - cz*sx
+    R[:,2,0] = -sy;   R[:,2,1] = cy*sx;            R[:,2,2] = cy*cx
+    return R
+
+def TransMatrix_from_EulerAngle_and_Location_stacked(Location, EulerAngle):
+    # stacked version of TransMatrix_from_EulerAngle_and_Location: Location (N,3), EulerAngle (N,3) --> (N,4,4)
+    Location = np.asarray(Location, dtype=float).reshape(-1,3)
+    T = np.zeros([len(Location),4,4])
+    T[:,:3,:3] = EulerAngles_To_RotationMatrix3x3_stacked(EulerAngle)
+    T[:,:3,3] = Location
+    T[:,3,3] = 1
+    return T
+
+def RotationMatrix3x3_To_EulerAngles_stacked(rotation_matrix):
+    # stacked version of RotationMatrix3x3_To_EulerAngles: (N,3,3) (or (N,4,4)) --> (N,3) [theta_x, theta_y, theta_z]
+    R = np.asarray(rotation_matrix)
+    R = R.reshape((-1,)+R.shape[-2:])
+    EulerAngle = np.empty([len(R),3])
+    EulerAngle[:,0] = np.arctan2(R[:,2,1], R[:,2,2])
+    EulerAngle[:,1] = np.arctan2(-R[:,2,0], np.hypot(R[:,2,1], R[:,2,2]))
+    EulerAngle[:,2] = np.arctan2(R[:,1,0], R[:,0,0])
+    return EulerAngle
+
+def Get_Location_Rotation3x3_Scale_from_Transformation4x4_stacked(T):
+    # stacked version of Get_Location_Rotation3x3_Scale_from_Transformation4x4: (N,4,4) --> (N,3), (N,3,3), (N,3)
+    # location is a view of T (no copy), rotation is a new array --> T is never changed
+    T = np.asarray(T)
+    T = T.reshape((-1,4,4))
+    location = T[:,:3,3]
+    scale = np.sqrt(np.einsum('nij,nij->nj', T[:,:3,:3], T[:,:3,:3]))     # length of the column vectors
+    rotation = T[:,:3,:3] / scale[:,None,:]
+    return location, rotation, scale
+
+def InvertRigidTransformation4x4(T):
+    # closed form inverse of rigid transformations [R t; 0 1] --> [R^T -R^T@t; 0 1], (4,4) or (N,4,4)
+    T = np.asarray(T, dtype=float)
+    R_t = np.swapaxes(T[...,:3,:3], -1, -2)
+    T_inv = np.zeros(T.shape)
+    T_inv[...,:3,:3] = R_t
+    T_inv[...,:3,3] = -np.einsum('...ij,...j->...i', R_t, T[...,:3,3])
+    T_inv[...,3,3] = 1
+    return T_inv
+
+def InvertSimilarityTransformation4x4(T):
+    # closed form inverse of similarity transformations [s*R t; 0 1] --> [R^T/s -R^T@t/s; 0 1], (4,4) or (N,4,4)
+    # the scale is the same for all axes --> (s*R)^-1 = (s*R)^T / s^2
+    T = np.asarray(T, dtype=float)
+    A = T[...,:3,:3]
+    s2 = np.einsum('...ij,...ij->...', A, A) / 3          # s^2 = ||s*R||_F^2 / 3
+    A_inv = np.swapaxes(A, -1, -2) / s2[...,None,None]
+    T_inv = np.zeros(T.shape)
+    T_inv[...,:3,:3] = A_inv
+    T_inv[...,:3,3] = -np.einsum('...ij,...j->...i', A_inv, T[...,:3,3])
+    T_inv[...,3,3] = 1
+    return T_inv
+
+def ComposeTransformations4x4(*Ts):
+    # chain of transformations T1 @ T2 @ ... @ Tn, each (4,4) or (N,4,4) (broadcasting)
+    # only the upper 3x4 block is multiplied (last row of affine transformations is [0,0,0,1])
+    T = np.asarray(Ts[-1], dtype=float)
+    A = T[...,:3,:3]; t = T[...,:3,3]
+    for T_left in reversed(Ts[:-1]):
+        T_left = np.asarray(T_left, dtype=float)
+        t = np.einsum('...ij,...j->...i', T_left[...,:3,:3], t) + T_left[...,:3,3]
+        A = T_left[...,:3,:3] @ A
+    T = np.zeros(A.shape[:-2]+(4,4))
+    T[...,:3,:3] = A; T[...,:3,3] = t; T[...,3,3] = 1
+    return T
+
+def GeodesicRotationDistance(R1, R2):
+    # angle (rad) of the relative rotation R1^T @ R2, (3,3) or (N,3,3) (also (4,4) transformations without scale)
+    # atan2 of the sine and cosine part --> accurate also for very small and large angles (arccos is not)
+    R1 = np.asarray(R1)[...,:3,:3]; R2 = np.asarray(R2)[...,:3,:3]
+    R_rel = np.swapaxes(R1, -1, -2) @ R2
+    cos_angle = (np.trace(R_rel, axis1=-2, axis2=-1) - 1) / 2
+    sin_angle = np.linalg.norm(np.stack([R_rel[...,2,1]-R_rel[...,1,2], R_rel[...,0,2]-R_rel[...,2,0], R_rel[...,1,0]-R_rel[...,0,1]], axis=-1), axis=-1) / 2
+    return np.arctan2(sin_angle, cos_angle)
+
+#-----------------------------------------------------------------------
+def BenchmarkTransMatrixKernels(sizes=(1,10,100,1000,10000,100000), repeats=3, seed=42):
+    # micro benchmark: loop over the scalar functions vs. stacked kernels, also checks that the results agree
+    import time
+    rng = np.random.default_rng(seed)
+    def best_of(func):
+        times = []
+        for _ in range(repeats):
+            t0 = time.perf_counter(); result = func(); times.append(time.perf_counter()-t0)
+        return min(times), result
+    results = []
+    for n in sizes:
+        Location = rng.normal(size=[n,3]); EulerAngle = rng.uniform(-np.pi/2+0.1, np.pi/2-0.1, size=[n,3])
+        # Euler --> matrix
+        t_loop, T_loop = best_of(lambda: np.array([TransMatrix_from_EulerAngle_and_Location(*l, *e) for l, e in zip(Location, EulerAngle)]))
+        t_stack, T = best_of(lambda: TransMatrix_from_EulerAngle_and_Location_stacked(Location, EulerAngle))
+        assert np.allclose(T_loop, T, atol=1e-12)
+        results.append(("Euler -> 4x4", n, t_loop, t_stack))
+        # matrix --> Euler
+        t_loop, E_loop = best_of(lambda: np.array([RotationMatrix3x3_To_EulerAngles(T_i[:3,:3]) for T_i in T]))
+        t_stack, E = best_of(lambda: RotationMatrix3x3_To_EulerAngles_stacked(T[:,:3,:3]))
+        assert np.allclose(E_loop, E, atol=1e-12) and np.allclose(E, EulerAngle, atol=1e-9)
+        results.append(("4x4 -> Euler", n, t_loop, t_stack))
+        # inverse (rigid and similarity)
+        t_loop, T_inv_loop = best_of(lambda: np.array([np.linalg.inv(T_i) for T_i in T]))
+        t_stack, T_inv = best_of(lambda: InvertRigidTransformation4x4(T))
+        assert np.allclose(T_inv_loop, T_inv, atol=1e-9)
+        results.append(("inverse rigid", n, t_loop, t_stack))
+        S = T.copy(); S[:,:3,:3] *= rng.uniform(0.1, 10, size=[n,1,1])
+        t_loop, S_inv_loop = best_of(lambda: np.array([np.linalg.inv(S_i) for S_i in S]))
+        t_stack, S_inv = best_of(lambda: InvertSimilarityTransformation4x4(S))
+        assert np.allclose(S_inv_loop, S_inv, atol=1e-9)
+        results.append(("inverse Sim(3)", n, t_loop, t_stack))
+        # decomposition
+        t_loop, D_loop = best_of(lambda: [Get_Location_Rotation3x3_Scale_from_Transformation4x4(S_i) for S_i in S])
+        t_stack, D = best_of(lambda: Get_Location_Rotation3x3_Scale_from_Transformation4x4_stacked(S))
+        assert np.allclose(np.array([d[1] for d in D_loop]), D[1]) and np.allclose(np.array([d[2] for d in D_loop]), D[2])
+        results.append(("decomposition", n, t_loop, t_stack))
+        # composition chain of three transformations
+        t_loop, C_loop = best_of(lambda: np.array([a @ b @ c for a, b, c in zip(T, S, T_inv)]))
+        t_stack, C = best_of(lambda: ComposeTransformations4x4(T, S, T_inv))
+        assert np.allclose(C_loop, C, atol=1e-9)
+        results.append(("compose (3 matrices)", n, t_loop, t_stack))
+        # geodesic distance
+        t_loop, G_loop = best_of(lambda: np.array([np.arccos(np.clip((np.trace(a[:3,:3].T @ b[:3,:3])-1)/2, -1, 1)) for a, b in zip(T, T_inv)]))
+        t_stack, G = best_of(lambda: GeodesicRotationDistance(T, T_inv))
+        assert np.allclose(G_loop, G, atol=1e-6)
+        results.append(("geodesic distance", n, t_loop, t_stack))
+    print(f"{'kernel':<22}{'N':>8}{'loop [ms]':>14}{'stacked [ms]':>14}{'speedup':>10}")
+    for name, n, t_loop, t_stack in results:
+        print(f"{name:<22}{n:>8}{t_loop*1000:>14.3f}{t_stack*1000:>14.3f}{t_loop/t_stack:>10.1f}")
+    return results
+
+if __name__ == "__main__":
+    BenchmarkTransMatrixKernels()
@@ -4,7 +4,9 @@ import importlib
 importlib.reload(sys.modules['src.TransMatrix_Utils']) if 'src.TransMatrix_Utils' in sys.modules else None
 from src.TransMatrix_Utils import rotation_matrix_x, \
                             TransMatrix_from_EulerAngle_and_Location, \
+                            TransMatrix_from_EulerAngle_and_Location_stacked, \
                             Transformation4x4_from_Location3x1_and_Rotation3x3, \
+                            InvertRigidTransformation4x4, \
                             rotation_matrix_z    
 
 class camera_reconstructed: 
@@ -71,7 +73,7 @@ class camera_reference:
         #   T_obj_rel = T_obj @ inv(T_obj0)
         # Inverted or reversed position change of the object 
         #   T_obj_rel_inv = inv(T_obj_rel) = inv(T_obj @ inv(T_obj0)) =  T_obj0 @ inv(T_obj)
-        T_obj_rel_inv = T_obj0 @ np.linalg.inv(T_obj)
+        T_obj_rel_inv = T_obj0 @ InvertRigidTransformation4x4(T_obj)     # object poses are rigid --> closed form inverse
         # Transformation rule between dynamic and static scene
         T_Dyn2Static = T_cam2obj0_transl @ T_obj_rel_inv
         # Calculate Transformation matrix in the static case
@@ -92,4 +94,200 @@ class object:
         transformation_4x4 = TransMatrix_from_EulerAngle_and_Location(x, y, z, theta_x, theta_y, theta_z)
         # Returning and saving the matrix
         self.Transformation = transformation_4x4
-        return transformation_4x4           
\ No newline at end of file
+        return transformation_4x4
+
+
+######################################################################################
+#                       Array-backed camera and object containers                     #
+######################################################################################
+# All cameras (or object poses) are stored in columns: (N,3) locations, (N,3,3) rotations, (N,4,4) transformations, ...
+# Batch operations work on the whole set at once. Indexing returns a view (CameraView / ObjectView) with the
+# attributes of camera_reference / camera_reconstructed / object, so existing code can still iterate over the set.
+# Missing values: transformations are NaN, correspondence indices are -1 (None in the views)
+
+class CameraSet:
+    def __init__(self, ImageFileName, Location, Rotation=None, EulerAngle=None, TimeStep=None, CorrespondigIndex=None, CorrespondigIndexObject=None,
+                 TransformationStatic=None, TransformationDynamic=None, reconstructed=False):
+        n = len(ImageFileName)
+        self.reconstructed = reconstructed          # reconstructed cameras (Meshroom convention) or reference cameras (Blender convention)
+        self.ImageFileName = np.asarray(ImageFileName, dtype=object)
+        self.Location = np.asarray(Location, dtype=float).reshape(n,3)
+        self.Rotation = np.full([n,3,3], np.nan) if Rotation is None else np.asarray(Rotation, dtype=float).reshape(n,3,3)
+        self.EulerAngle = np.full([n,3], np.nan) if EulerAngle is None else np.asarray(EulerAngle, dtype=float).reshape(n,3)
+        self.TimeStep = np.full(n, -1, dtype=np.int64) if TimeStep is None else np.asarray(TimeStep, dtype=np.int64)
+        self.CorrespondigIndex = np.full(n, -1, dtype=np.int64) if CorrespondigIndex is None else np.asarray(CorrespondigIndex, dtype=np.int64)
+        self.CorrespondigIndexObject = np.full(n, -1, dtype=np.int64) if CorrespondigIndexObject is None else np.asarray(CorrespondigIndexObject, dtype=np.int64)
+        self.TransformationStatic = np.full([n,4,4], np.nan) if TransformationStatic is None else np.asarray(TransformationStatic, dtype=float)
+        self.TransformationDynamic = np.full([n,4,4], np.nan) if TransformationDynamic is None else np.asarray(TransformationDynamic, dtype=float)
+        self.FileNameIndex = {name: i for i, name in enumerate(self.ImageFileName)}    # image file name --> index
+
+    @classmethod
+    def from_cameras(cls, cams):
+        # create the container from a list of camera_reference or camera_reconstructed objects
+        reconstructed = len(cams) > 0 and isinstance(cams[0], camera_reconstructed)
+        def stack(attr, shape):
+            values = [getattr(cam, attr, None) for cam in cams]
+            return np.array([np.full(shape, np.nan) if v is None else np.asarray(v, dtype=float).reshape(shape) for v in values]).reshape((len(cams),)+shape)
+        def index(attr):
+            return np.array([-1 if getattr(cam, attr, None) is None else getattr(cam, attr) for cam in cams], dtype=np.int64)
+        return cls([cam.ImageFileName for cam in cams], stack("Location",(3,)),
+                   Rotation = stack("Rotation",(3,3)) if reconstructed else None,
+                   EulerAngle = None if reconstructed else stack("EulerAngle",(3,)),
+                   TimeStep = index("TimeStep"), CorrespondigIndex = index("CorrespondigIndex"),
+                   CorrespondigIndexObject = index("CorrespondigIndexObject"),
+                   TransformationStatic = stack("TransformationStatic",(4,4)), TransformationDynamic = stack("TransformationDynamic",(4,4)),
+                   reconstructed = reconstructed)
+
+    def __len__(self):
+        return len(self.ImageFileName)
+
+    def __getitem__(self, i):
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self): raise IndexError("camera index out of range")
+        return CameraView(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield CameraView(self, i)
+
+    def index(self, ImageFileName):
+        # index of a camera by its image file name (None if not existing)
+        return self.FileNameIndex.get(ImageFileName)
+
+    @property
+    def Centers(self):
+        # (N,3) camera centers of the static scene
+        return self.TransformationStatic[:,:3,3]
+
+    def Transformation2WorldCoordinateSystem(self, T=None, focuspoint=None):
+        if self.reconstructed:
+            # same transformation chain as camera_reconstructed.Transformation2WorldCoordinateSystem for all cameras at once
+            # T_(rec->glob) = T_(ref->glob) @ T @ rot_x(180°) @ T_(meshroom->rec)
+            trans_4x4_reconstructed = np.zeros([len(self),4,4])
+            trans_4x4_reconstructed[:,:3,:3] = self.Rotation; trans_4x4_reconstructed[:,:3,3] = self.Location; trans_4x4_reconstructed[:,3,3] = 1
+            translation_4x4 = np.eye(4,4); translation_4x4[2,3] += focuspoint[2]
+            rot_x_meshroom_plot_cam = rotation_matrix_x(np.deg2rad(180))
+            self.TransformationStatic = (translation_4x4 @ T @ rot_x_meshroom_plot_cam) @ trans_4x4_reconstructed
+            return self.TransformationStatic
+        # reference cameras: transformation of Blender camera coordinate convention into camera plot convention (180° around x)
+        EulerAngle = self.EulerAngle.copy(); EulerAngle[:,0] += np.deg2rad(180)
+        transformation_4x4 = TransMatrix_from_EulerAngle_and_Location_stacked(self.Location, EulerAngle)
+        self.TransformationDynamic = transformation_4x4
+        self.TransformationStatic = transformation_4x4.copy()
+        return transformation_4x4
+
+    def Dynamic2StaticScene(self, objs, T_obj0, focuspoint, indices=None):
+        # batch version of camera_reference.Dynamic2StaticScene
+        # objs: ObjectTrajectory (or list of object), the object pose of each camera is selected by CorrespondigIndexObject
+        indices = np.arange(len(self)) if indices is None else np.asarray(indices)
+        T_objs = objs.Transformation if isinstance(getattr(objs,"Transformation",None), np.ndarray) else np.array([obj.Transformation for obj in objs])
+        T_obj = T_objs[self.CorrespondigIndexObject[indices]]
+        T_cam2obj0_transl = np.eye(4)
+        T_cam2obj0_transl[:3,3] = np.asarray(focuspoint) - T_obj0[:3,3]
+        # T_Dyn2Static = T_cam2obj0_transl @ T_obj0 @ inv(T_obj)
+        T_Dyn2Static = (T_cam2obj0_transl @ T_obj0) @ InvertRigidTransformation4x4(T_obj)
+        self.TransformationStatic[indices] = T_Dyn2Static @ self.TransformationDynamic[indices]
+        return T_Dyn2Static
+
+
+class CameraView:
+    # view of a single camera of a CameraSet, reading and writing goes directly to the arrays of the set
+    _arrays = ("Location", "Rotation", "EulerAngle", "TransformationStatic", "TransformationDynamic")
+    _indices = ("CorrespondigIndex", "CorrespondigIndexObject")
+
+    def __init__(self, camera_set, i):
+        self.__dict__["_set"] = camera_set          # bypass __setattr__
+        self.__dict__["_i"] = i
+
+    def __getattr__(self, name):
+        # only called for attributes that are not stored in the view itself
+        cams = self.__dict__["_set"]; i = self.__dict__["_i"]
+        if name == "ImageFileName": return cams.ImageFileName[i]
+        if name == "TimeStep": return int(cams.TimeStep[i]) if cams.TimeStep[i] >= 0 else None
+        if name in CameraView._indices:
+            value = getattr(cams, name)[i]
+            return None if value < 0 else int(value)
+        if name in CameraView._arrays:
+            value = getattr(cams, name)[i]
+            return None if np.isnan(value).all() else value
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        cams = self._set; i = self._i
+        if name in CameraView._indices or name == "TimeStep":
+            getattr(cams, name)[i] = -1 if value is None else value
+        elif name in CameraView._arrays:
+            getattr(cams, name)[i] = np.nan if value is None else value
+        elif name == "ImageFileName":
+            cams.FileNameIndex.pop(cams.ImageFileName[i], None)
+            cams.ImageFileName[i] = value; cams.FileNameIndex[value] = i
+        else: raise AttributeError(name)
+
+    def Transformation2WorldCoordinateSystem(self, T=None, focuspoint=None):
+        if self._set.reconstructed:
+            cam = camera_reconstructed(self.ImageFileName, {"center": self.Location, "rotation": self.Rotation.ravel()})
+            self.TransformationStatic = cam.Transformation2WorldCoordinateSystem(T, focuspoint)
+            return self.TransformationStatic
+        cam = camera_reference(self.ImageFileName, self.Location, self.EulerAngle, self.TimeStep)
+        transformation_4x4 = cam.Transformation2WorldCoordinateSystem()
+        self.TransformationDynamic = transformation_4x4; self.TransformationStatic = transformation_4x4
+        return transformation_4x4
+
+    def Dynamic2StaticScene(self, T_obj, T_obj0, focuspoint):
+        cam = camera_reference(self.ImageFileName, self.Location, self.EulerAngle, self.TimeStep, TransformationDynamic=self.TransformationDynamic)
+        T_Dyn2Static = cam.Dynamic2StaticScene(T_obj, T_obj0, focuspoint)
+        self.TransformationStatic = cam.TransformationStatic
+        return T_Dyn2Static
+
+
+class ObjectTrajectory:
+    def __init__(self, TimeStep, Location, EulerAngle, Transformation=None):
+        n = len(TimeStep)
+        self.TimeStep = np.asarray(TimeStep, dtype=np.int64)
+        self.Location = np.asarray(Location, dtype=float).reshape(n,3)
+        self.EulerAngle = np.asarray(EulerAngle, dtype=float).reshape(n,3)
+        self.Transformation = np.full([n,4,4], np.nan) if Transformation is None else np.asarray(Transformation, dtype=float)
+
+    @classmethod
+    def from_objects(cls, objs):
+        return cls([obj.TimeStep for obj in objs], [obj.Location for obj in objs], [obj.EulerAngle for obj in objs],
+                   np.array([np.full([4,4], np.nan) if obj.Transformation is None else obj.Transformation for obj in objs]).reshape(len(objs),4,4))
+
+    def __len__(self):
+        return len(self.TimeStep)
+
+    def __getitem__(self, i):
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self): raise IndexError("object index out of range")
+        return ObjectView(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield ObjectView(self, i)
+
+    def Transformation2WorldCoordinateSystem(self):
+        self.Transformation = TransMatrix_from_EulerAngle_and_Location_stacked(self.Location, self.EulerAngle)
+        return self.Transformation
+
+
+class ObjectView:
+    # view of a single object pose of an ObjectTrajectory
+    def __init__(self, trajectory, i):
+        self._trajectory = trajectory; self._i = i
+
+    @property
+    def TimeStep(self): return int(self._trajectory.TimeStep[self._i])
+    @property
+    def Location(self): return self._trajectory.Location[self._i]
+    @property
+    def EulerAngle(self): return self._trajectory.EulerAngle[self._i]
+    @property
+    def Transformation(self):
+        value = self._trajectory.Transformation[self._i]
+        return None if np.isnan(value).all() else value
+    @Transformation.setter
+    def Transformation(self, value): self._trajectory.Transformation[self._i] = np.nan if value is None else value
+
+    def Transformation2WorldCoordinateSystem(self):
+        self.Transformation = TransMatrix_from_EulerAngle_and_Location(*self.Location, *self.EulerAngle)
+        return self.Transformation
@@ -125,23 +125,32 @@ def LoadAppPaths():
         app_paths = json.load(data)
     return app_paths
 
-def ImportCameras(output_path,image_dir):
+def ImportCameras(output_path,image_dir,scaling_params=None):
+    # scaling_params["Incremental"]: the scaling factor is estimated while the SfM-File is read
+    # --> the estimator is returned as third output (None otherwise) and passed to ScaleScene
+    # cams_rec, cams_ref: CameraSet (arrays), indexing/iterating gives views of the single cameras
     from src.CameraProcessing import read_camera_alignment_reconstruction, read_camera_alignment_reference, match_cameras
-    cams_ref = read_camera_alignment_reference(image_dir)
+    cams_ref = read_camera_alignment_reference(image_dir,UseSidecar=True,CameraSetOutput=True)
     logging.info('Imported reference cameras')
-    cams_rec = read_camera_alignment_reconstruction(output_path)
+    scaling_estimator = None
+    if scaling_params is not None and scaling_params.get("Incremental",False):
+        from src.scaling_factor import IncrementalScalingFactor
+        n_cam = int(len(cams_ref)/cams_ref.TimeStep[-1])      # number of cameras per time step
+        scaling_estimator = IncrementalScalingFactor(n_cam,scaling_params["PreOutlierDetection"],scaling_params["threshold"],scaling_params["criterion"])
+        logging.info('Calculate scaling factor while the reconstructed cameras are imported')
+    cams_rec = read_camera_alignment_reconstruction(output_path,cams_ref,scaling_estimator,CameraSetOutput=True)
     if len(cams_rec) > 0:
         logging.info('Imported reconstructed cameras')
         cams_rec, cams_ref  = match_cameras(cams_rec,cams_ref)
         logging.info('Assigned reconstructed and reference cameras')
     else:
         logging.warning("The reconstruction of the cameras was not successful. Skip the comparison between the reconstructed and reference cameras")
-    return cams_rec, cams_ref
+    return cams_rec, cams_ref, scaling_estimator
 
 def ImportObject(image_dir):
     from src.CameraProcessing import read_object_alignment
-    objs,obj0 = read_object_alignment(image_dir)
-    if objs == None:
+    objs,obj0 = read_object_alignment(image_dir,UseSidecar=True,ObjectTrajectoryOutput=True)     # ObjectTrajectory (arrays) and the initial pose
+    if objs is None:
         logging.info('Static scene detected')
         obj_moving = False
     else:
@@ -149,18 +158,34 @@ def ImportObject(image_dir):
         obj_moving = True
     return obj_moving, objs, obj0
 
-def ScaleScene(cams_rec,cams_ref,evaluation_path,scaling_params,DisplayAllPlots=False,extract_plot = False):
+def ScaleScene(cams_rec,cams_ref,evaluation_path,scaling_params,DisplayAllPlots=False,extract_plot = False,scaling_estimator=None):
     from src.scaling_factor import scaling_factor
     logging.info('Calculate scaling factor')
     print(f"{len(cams_rec)} of {len(cams_ref)} cameras could be reconstructed!")
-    factor_mean, factor_median, factor_std, fig, number_inliers, number_outliers  = scaling_factor(cams_rec,cams_ref,evaluation_path,scaling_params["PreOutlierDetection"],scaling_params["threshold"],scaling_params["criterion"],True,DisplayAllPlots) 
+    if scaling_estimator is not None:
+        # incremental estimation (see ImportCameras): the estimate is already complete after reading the SfM-File, no plot
+        result = scaling_estimator.result() if len(cams_rec) > 0 else None
+        if result is None:
+            print("Warning: No scaling factor could be determined because no two cameras could be reconstructed at the same time step.")
+            result = {"median": None, "mean": None, "std": None, "number_inliers": None, "number_outliers": None}
+        factor_mean, factor_median, factor_std = result["mean"], result["median"], result["std"]
+        number_inliers, number_outliers, dict_ci, fig = result["number_inliers"], result["number_outliers"], None, None
+    else:
+        ConfidenceInterval = scaling_params.get("ConfidenceInterval",None)     # e.g. {"method": "block", "n_resamples": 10000, "confidence": 0.95, "chunk_size": 1000}
+        factor_mean, factor_median, factor_std, fig, number_inliers, number_outliers, dict_ci  = scaling_factor(cams_rec,cams_ref,evaluation_path,scaling_params["PreOutlierDetection"],scaling_params["threshold"],scaling_params["criterion"],True,DisplayAllPlots,ConfidenceInterval) 
     scaling = factor_median
     if factor_mean is not None: print(f"Scaling factor: {scaling}")
-    dict_scaling = {"median": factor_median, "mean": factor_mean, "std": factor_std, "number_inliers": number_inliers, "number_outliers": number_outliers} 
+    dict_scaling = {"median": factor_median, "mean": factor_mean, "std": factor_std, "number_inliers": number_inliers, "number_outliers": number_outliers, "confidence_interval": dict_ci} 
     if extract_plot:
         return scaling, dict_scaling, fig
     return scaling, dict_scaling
 
+def InitMeshStore(params_MeshRegis):
+    # all evaluation stages read the OBJ files through the shared mesh store (parsed once, memory mapped afterwards)
+    from src.MeshStore import ConfigureMeshStore
+    store_dir = params_MeshRegis.get("MeshStoreDir", "cache/meshes")
+    ConfigureMeshStore(Path.cwd() / store_dir if store_dir else None, params_MeshRegis.get("MeshStoreSizeMB", 2000))
+
 def PlotReconstructedObject(project_name,evaluation_path,DisplayPlots):
     from src.plot_mesh_vedo import plot_mesh_vedo
     fig,screenshot_path = plot_mesh_vedo(project_name,evaluation_path,DisplayPlots)
@@ -217,7 +242,28 @@ def GetEvaluationAndImageDirAndObjPath(output_path,imageANDobject_path):
     return evaluation_dir, image_dir, obj_path
 
 
-def GlobalMeshRegistration(evaluation_dir,obj_path,params_MeshRegis,scaling_factor,DebugMode=False):
+def CameraBasedRegistration(obj_moving,cams_rec,cams_ref,objs,obj0,scene_params,evaluation_dir,params_MeshRegis):
+    # Similarity transformation (reconstruction --> reference) from the matched camera centers (Umeyama + RANSAC)
+    if params_MeshRegis.get("GlobalRegistrationMethod","FPFH") != "Cameras":
+        return None
+    if len(cams_rec) == 0:
+        logging.warning("No reconstructed cameras available. Skip camera based registration")
+        return None
+    logging.info('Estimate the transformation from the reconstructed and the reference camera centers')
+    from src.CameraBasedRegistration import CameraBasedRegistration
+    focuspoint = scene_params["cam"]["focuspoint"]
+    threshold = params_MeshRegis.get("CameraRegistrationThreshold",0.01)      # inlier threshold in m
+    T_cams, inliers = CameraBasedRegistration(cams_rec,cams_ref,obj_moving,objs,obj0,focuspoint,threshold)
+    if T_cams is not None:
+        np.savetxt(evaluation_dir / 'CameraTransformationMatrix.txt',T_cams)
+    return T_cams
+
+def GlobalMeshRegistration(evaluation_dir,obj_path,params_MeshRegis,scaling_factor,DebugMode=False,T_cams=None):
+    if T_cams is not None:
+        # the transformation from the camera based registration replaces the feature based global registration
+        T_global_path = evaluation_dir / 'GlobalTransformationMatrix.txt'
+        np.savetxt(T_global_path,T_cams)
+        return T_cams
     if scaling_factor is None:
         logging.warning("No scaling factor available. Skip global registration")
         return None
@@ -235,9 +281,32 @@ def GlobalMeshRegistration(evaluation_dir,obj_path,params_MeshRegis,scaling_fact
         voxel_size = 1*10**(-3)
         if DebugMode: draw_registration = 4
         else: draw_registration = 0 # choose 0,1,2,3,4 --> 0 = no plot appears --> 4 = all plots appears 
-        T_global = GlobalMeshRegistration(mesh_r_path,obj_path,voxel_size,draw_registration,
-                                    T_scale,ThreePointRegistration)
+        # persistent cache of the preprocessed ground truth meshes (None --> no cache)
+        target_cache = None
+        if params_MeshRegis.get("TargetCacheDir", "cache/registration"):
+            from src.DiskCache import DiskCache
+            target_cache = DiskCache(Path.cwd() / params_MeshRegis.get("TargetCacheDir", "cache/registration"),
+                                     max_size_bytes=params_MeshRegis.get("TargetCacheSizeMB", 500)*2**20)
+        pyramid = params_MeshRegis.get("GlobalRegistrationPyramid")
+        starts = params_MeshRegis.get("GlobalRegistrationStarts", 1)
+        if starts > 1 and not ThreePointRegistration:
+            # multi start registration on a process pool, all candidates are saved next to the transformation matrix
+            from src.GlobalMeshRegistration import MultiStartGlobalRegistration
+            T_global, candidates, best = MultiStartGlobalRegistration(mesh_r_path,obj_path,voxel_size,T_scale,starts,
+                                                                      params_MeshRegis.get("RotationGridInit", False),target_cache,pyramid,
+                                                                      params_MeshRegis.get("GlobalRegistrationWorkers"),
+                                                                      sampling=params_MeshRegis.get("Sampling"))
+            with open(evaluation_dir / 'GlobalRegistrationCandidates.json', 'w') as file:
+                json.dump({"best": best, "candidates": candidates}, file, indent=4)
+            levels = candidates[best]["levels"]
+        else:
+            T_global, info = GlobalMeshRegistration(mesh_r_path,obj_path,voxel_size,draw_registration,
+                                        T_scale,ThreePointRegistration,target_cache,pyramid=pyramid,ReturnInfo=True,
+                                        sampling=params_MeshRegis.get("Sampling"))
+            levels = info["levels"]
         np.savetxt(T_global_path,T_global)
+        with open(evaluation_dir / 'GlobalRegistrationLevels.json', 'w') as file:     # fitness, RMSE and time of each level
+            json.dump(levels, file, indent=4)
     else:
         T_global = np.loadtxt(T_global_path)   
     return T_global
@@ -246,6 +315,29 @@ def FineMeshRegistration(evaluation_dir,obj_path,app_paths,params_MeshRegis,Debu
     Recalculation = params_MeshRegis["Recalculation"]
     log_path = evaluation_dir / "log_CloudCompare.txt"                     # Path to log file
     T_path = evaluation_dir / "TransformationMatrix.txt"
+    if not params_MeshRegis.get("FineRegistration",True):
+        # the global transformation is used as final transformation (e.g. camera based registration), no ICP
+        T_global_path = evaluation_dir / 'GlobalTransformationMatrix.txt'
+        if not T_global_path.is_file(): 
+            logging.warning("No global registration matrix available. Skip local registration")
+            return None
+        T = np.loadtxt(T_global_path)
+        np.savetxt(T_path,T)
+        return T
+    if params_MeshRegis.get("FineRegistrationEngine", "CloudCompare") == "native":
+        # in-process ICP and cloud to mesh distances (no CloudCompare), results in C2MDistance.json instead of the log file
+        c2m_path = evaluation_dir / "C2MDistance.json"
+        if Recalculation==False and (c2m_path.exists() and T_path.exists()):
+            return np.loadtxt(T_path)
+        T_global_path = evaluation_dir / 'GlobalTransformationMatrix.txt'
+        if not T_global_path.is_file(): 
+            logging.warning("No global registration matrix available. Skip local registration")
+            return None
+        from src.FineMeshRegistrationNative import FineMeshRegistrationNative
+        T,T_ICP,distances_before,distances_after = FineMeshRegistrationNative(evaluation_dir,obj_path,evaluation_dir / 'texturedMesh.obj',
+                                                                              T_global_path,params_MeshRegis.get("ICP"),
+                                                                              params_MeshRegis.get("SDF"))
+        return T
     if not (Recalculation==False and (log_path.exists() and T_path.exists())):
         cc_path = app_paths["cloudcompare_exe"]
         T_global_path = evaluation_dir / 'GlobalTransformationMatrix.txt'
@@ -267,10 +359,15 @@ def FineMeshRegistration(evaluation_dir,obj_path,app_paths,params_MeshRegis,Debu
     return T
         
 def EvaluateRecMesh(evaluation_dir):
-    # read mean distance and standard deviation from the log file
+    # read mean distance and standard deviation from the results of the native fine registration or from the log file of CloudCompare
+    # (the newer file is used if both exist)
     from src.read_c2m_distance_from_log import read_c2m_distance_from_log
     log_path = evaluation_dir / "log_CloudCompare.txt"
-    if log_path.is_file():
+    c2m_path = evaluation_dir / "C2MDistance.json"
+    if c2m_path.is_file() and (not log_path.is_file() or c2m_path.stat().st_mtime >= log_path.stat().st_mtime):
+        with open(c2m_path, 'r') as file: c2m = json.load(file)
+        mean_distance = [c2m["before"]["mean"], c2m["after"]["mean"]]; std_deviation = [c2m["before"]["std"], c2m["after"]["std"]]
+    elif log_path.is_file():
         mean_distance, std_deviation = read_c2m_distance_from_log(log_path)
     else:
         mean_distance = [None,None]; std_deviation = [None,None] 
@@ -278,44 +375,74 @@ def EvaluateRecMesh(evaluation_dir):
     dict_M2M = {"mean": mean_distance[1], "std": std_deviation[1]}
     return dict_M2M
 
+def EvaluateSurfaceDistances(evaluation_dir,obj_path,T,evaluation_params):
+    # symmetric distance distribution (percentiles, Hausdorff, chamfer, F-score) between the aligned reconstruction and the ground truth
+    params = evaluation_params.get("SurfaceDistances", {"active": False})
+    if not params.get("active", False): return None
+    if T is None:
+        logging.warning("No transformation matrix exists. Skip the surface distance evaluation.")
+        return None
+    metrics_path = evaluation_dir / "SurfaceDistanceMetrics.json"
+    if params.get("Recalculation", True) == False and metrics_path.is_file():
+        with open(metrics_path, 'r') as file: return json.load(file)
+    from src.SurfaceDistanceMetrics import SurfaceDistanceMetrics
+    return SurfaceDistanceMetrics(evaluation_dir,obj_path,evaluation_dir / 'texturedMesh.obj',T,
+                                  thresholds=params.get("thresholds",(0.001,0.002,0.005)),percentiles=params.get("percentiles",(50,90,99)),
+                                  chunk_size=params.get("chunk_size",1000000),sdf_params=evaluation_params["MeshRegistration"].get("SDF"))
+
 def EvaluateSizeProperties(evaluation_path,object_path,T,T_global):
     from src.EvaluateVolumeSurfaceArea import EvaluateVolumeSurfaceArea
-    df = EvaluateVolumeSurfaceArea(evaluation_path,object_path,T_global,T)
+    morphology = EvaluateVolumeSurfaceArea(evaluation_path,object_path,T_global,T)
+    fields = ("volume","surface","surf2vol","sphericity","hull_volume","solidity","feret_max","feret_min","principal_moments")
+    def record_to_dict(record):
+        if record is None: return {field: None for field in fields}
+        return {field: record[field].tolist() for field in fields}
     dict_morphology = {
-        "ref": {"volume": df.iloc[2,1], "surface": df.iloc[2,2], "surf2vol": df.iloc[2,4], "sphericity": df.iloc[2,5]},
-        "rec": {"volume": df.iloc[0,1], "surface": df.iloc[0,2], "surf2vol": df.iloc[0,4], "sphericity": df.iloc[0,5]}
-        #"rec_CC": {"volume": df.iloc[1,1]}
+        "ref": record_to_dict(morphology["ref"]),
+        "rec": record_to_dict(morphology["rec"])
+        #"rec_CC": record_to_dict(morphology["rec_CC"])
     }
     return dict_morphology
     
 def EvaluateCameraPoses(obj_moving,cams_rec,cams_ref,objs,obj0,T,scene_params,evaluation_dir,CamEvalParams,DisplayPlots=False):
     if T is not None:
         focuspoint = scene_params["cam"]["focuspoint"]
-        # Calculate camera parameters in relation to the global coordinate system
-        for i, cam in enumerate(cams_rec): cam.Transformation2WorldCoordinateSystem(T,focuspoint)
+        from src.classes import CameraSet
+        # lists of camera objects --> arrays (CameraSet is recognized by its arrays, the class may have been reloaded in between)
+        if not isinstance(getattr(cams_rec,"CorrespondigIndex",None), np.ndarray): cams_rec = CameraSet.from_cameras(cams_rec)
+        if not isinstance(getattr(cams_ref,"CorrespondigIndex",None), np.ndarray): cams_ref = CameraSet.from_cameras(cams_ref)
+        # Calculate camera parameters in relation to the global coordinate system (all cameras at once)
+        cams_rec.Transformation2WorldCoordinateSystem(T,focuspoint)
         # Calculate camera positions in the dynamic (object is moving) and the static case (object is fixed)
-        for cam in cams_ref:
-            if obj_moving: 
-                Tdynamic2static = cam.Dynamic2StaticScene(objs[cam.CorrespondigIndexObject].Transformation, obj0.Transformation,focuspoint)
-                if cam.CorrespondigIndex != None:
-                    cam_rec = cams_rec[cam.CorrespondigIndex]
-                    cam_rec.TransformationDynamic = np.linalg.inv(Tdynamic2static) @ cam_rec.TransformationStatic
-            else:
-                cam.TransformationDynamic = None    # delete Transformation Matrix of the dynamic case if the object is not moving 
+        if obj_moving:
+            Tdynamic2static = cams_ref.Dynamic2StaticScene(objs, obj0.Transformation, focuspoint)
+            ind_ref = np.flatnonzero(cams_ref.CorrespondigIndex >= 0); ind_rec = cams_ref.CorrespondigIndex[ind_ref]
+            from src.TransMatrix_Utils import InvertRigidTransformation4x4
+            cams_rec.TransformationDynamic[ind_rec] = InvertRigidTransformation4x4(Tdynamic2static[ind_ref]) @ cams_rec.TransformationStatic[ind_rec]
+        else:
+            cams_ref.TransformationDynamic[:] = np.nan      # delete Transformation Matrix of the dynamic case if the object is not moving
         # Visual Evaluation
         PlotCameraPoses(cams_ref,cams_rec,scene_params,obj_moving,evaluation_dir,DisplayPlots)
-        # Quantitativ evaluation of the reconstructed camera positions
-        from src.CameraPositionEvaluation import CreateCameraDataSets
-        pos_x,pos_y,Rx,Ry = CreateCameraDataSets(cams_rec,cams_ref)
+        # Quantitativ evaluation of the reconstructed camera positions (all cameras at once)
+        from src.CameraPositionEvaluation import StackCameraTransformations, CameraPoseErrors, SaveCameraPoseErrors
+        T_rec, T_ref, CorrespondingIndex, TimeStep, CameraId = StackCameraTransformations(cams_rec,cams_ref,scene="dynamic" if obj_moving else "static")
+        errors, per_timestep, per_camera = CameraPoseErrors(T_rec,T_ref,CorrespondingIndex,focuspoint,TimeStep,CameraId)
+        SaveCameraPoseErrors(evaluation_dir,errors,per_timestep,per_camera)
+        print(f"{len(cams_rec)} cameras from {len(cams_ref)} cameras were reconstructed ({len(cams_rec)/len(cams_ref)*100} %)")
+        pos_x = T_rec[errors["rec_index"],:3,3]; pos_y = T_ref[errors["ref_index"],:3,3]
         from src.CameraPositionEvaluation import PlotAbsPositionError_for_xyz, PositionError
         PlotAbsPositionError_for_xyz(evaluation_dir,pos_x,pos_y,DisplayPlots)
         threshold = CamEvalParams["threshold"] 
-        mean_error, std_deviation, mean_error_rel, std_deviation_rel, outliers_count = PositionError(evaluation_dir,pos_x,pos_y,outlier_criterion=threshold,DisplayPlots=DisplayPlots)
+        mean_error, std_deviation, mean_error_rel, std_deviation_rel, outliers_count = PositionError(evaluation_dir,pos_x,pos_y,outlier_criterion=threshold,focuspoint=focuspoint,DisplayPlots=DisplayPlots)
+        mean_angle_error = float(np.mean(errors["angle_error"])) if len(errors) else None
+        std_angle_error = float(np.std(errors["angle_error"])) if len(errors) else None
     else:
         logging.warning("No global registration matrix exists. Skip camera pose evaluation.")
         mean_error = None; std_deviation =  None; mean_error_rel = None; std_deviation_rel = None; outliers_count =  None
+        mean_angle_error = None; std_angle_error = None
     # return results in an dict
     dict_camera = {"mean_abs_error": mean_error, "std_abs_error": std_deviation, "mean_rel_error": mean_error_rel, "std_rel_error": std_deviation_rel,
+                   "mean_angle_error": mean_angle_error, "std_angle_error": std_angle_error,
                    "images": len(cams_ref), "rec_cams": len(cams_rec), "outliers": outliers_count}
     return dict_camera
     
@@ -384,7 +511,7 @@ def PlotCameraPoses_DataGen(cams_ref,scene_params,obj_moving):
     visualizer2.show()
     
 def TextureEvaluation(evaluation_dir,obj_path,app_paths,evaluation_params,DebugMode,DisplayPlots):
-    from src.TextureEvaluation import GetImagesForTextureEvaluation, GLCM_Evaluation
+    from src.TextureEvaluation import GetImagesForTextureEvaluationJobs, GLCM_Evaluation, GLCM_DenseEvaluation
     text_params = evaluation_params["TextureEvaluation"]
     if text_params["active"]:
         # Generate Data for Texture Evaluation
@@ -392,18 +519,32 @@ def TextureEvaluation(evaluation_dir,obj_path,app_paths,evaluation_params,DebugM
         blender_path = app_paths["blender_exe"]
         script_path = Path(__file__).resolve().parent.parent / "blender_pipeline"
         mesh_r_trans_path = evaluation_dir / "texturedMesh_TRANSFORMED.obj"
+        T_path = evaluation_dir / "TransformationMatrix.txt"
+        if T_path.is_file() and (not mesh_r_trans_path.is_file() or mesh_r_trans_path.stat().st_mtime < T_path.stat().st_mtime):
+            # transformed mesh missing or older than the final transformation (e.g. global transformation without ICP) --> write it again
+            from src.FineMeshRegistrationNative import TransformObjFile
+            TransformObjFile(evaluation_dir / "texturedMesh.obj", mesh_r_trans_path, np.loadtxt(T_path))
+            Recalculation = True                            # the rendered textures belong to the old transformation
         if not mesh_r_trans_path.is_file():
             logging.warning("Mesh file of the registered reconstructed object not found. Skip the texture evaluation.")
             return
         OutputTextureRef_path = evaluation_dir / "TextureReference"
         OutputTextureRec_path = evaluation_dir / "TextureReconstruction"
         if (Recalculation or not (OutputTextureRef_path.exists() and OutputTextureRec_path.exists())):
-            GetImagesForTextureEvaluation(obj_path,OutputTextureRef_path,script_path,blender_path,DebugMode)
-            GetImagesForTextureEvaluation(mesh_r_trans_path,OutputTextureRec_path,script_path,blender_path,DebugMode)
+            # reference and reconstruction rendered with the same scene in one Blender session (or two concurrent sessions)
+            GetImagesForTextureEvaluationJobs([(obj_path,OutputTextureRef_path),(mesh_r_trans_path,OutputTextureRec_path)],script_path,blender_path,DebugMode,
+                                              processes=text_params.get("blender_processes",1))
         # Texture Evaluation
         patch_size = text_params["patch_size"]; image_number = text_params["image_number"]; levels = text_params["levels"]; 
         distances = text_params["distances"]; features = text_params["features"]
-        GLCM_Evaluation(evaluation_dir,OutputTextureRef_path,OutputTextureRec_path,patch_size,image_number,levels,distances,random_seed=124,features = features,num_windows=4,DisplayPlots=DisplayPlots)
+        GLCM_Evaluation(evaluation_dir,OutputTextureRef_path,OutputTextureRec_path,patch_size,image_number,levels,distances,random_seed=124,features = features,num_windows=4,DisplayPlots=DisplayPlots,
+                        window_selection=text_params.get("window_selection","mask"),min_std=text_params.get("min_std",5.0))
+        dense_params = text_params.get("DenseMaps")
+        if dense_params and dense_params.get("active", True):
+            # dense feature maps on a strided grid over the whole image pair, statistics over the blocks on the object
+            GLCM_DenseEvaluation(evaluation_dir,OutputTextureRef_path,OutputTextureRec_path,patch_size,image_number,levels,distances,features=features,
+                                 stride=dense_params.get("stride"),min_foreground=dense_params.get("min_foreground",1.0),
+                                 reduced_levels=dense_params.get("reduced_levels"),workers=dense_params.get("workers",1),DisplayPlots=DisplayPlots)
     
 def CopyDataToCaseStudyFolder(study_output_dir,output_dir,image_dir,obj_path):
     # Copy the data from the data generation and the 3D reconstruction together into a folder in the case study folder
@@ -463,15 +604,23 @@ def QuantitativeEvaluationData2DataFrame(data):
     df_data = {
         "Scaling_median": [data["ScalingFactor"]["median"]],
         "Scaling_std": [data["ScalingFactor"]["std"]],
+        "Scaling_ci_low": [(data["ScalingFactor"].get("confidence_interval") or {}).get("ci_low")],
+        "Scaling_ci_high": [(data["ScalingFactor"].get("confidence_interval") or {}).get("ci_high")],
         #"Scaling_error_percent": [scaling_rel_error],
         "Mesh2MeshDist_mean": [data["Mesh2MeshDistance"]["mean"]],
         "Mesh2MeshDist_std": [data["Mesh2MeshDistance"]["std"]],
+        "Hausdorff": [(data.get("SurfaceDistances") or {}).get("hausdorff")],
+        "Chamfer_L1": [(data.get("SurfaceDistances") or {}).get("chamfer_l1")],
         "volume_ref": [data["Morphology"]["ref"]["volume"]],
         "volume_rec": [data["Morphology"]["rec"]["volume"]],
         "surface_ref": [data["Morphology"]["ref"]["surface"]],
         "surface_rec": [data["Morphology"]["rec"]["surface"]],
         "sphericity_ref": [data["Morphology"]["ref"]["sphericity"]],
         "sphericity_rec": [data["Morphology"]["rec"]["sphericity"]],
+        "solidity_ref": [data["Morphology"]["ref"].get("solidity")],
+        "solidity_rec": [data["Morphology"]["rec"].get("solidity")],
+        "feret_max_ref": [data["Morphology"]["ref"].get("feret_max")],
+        "feret_max_rec": [data["Morphology"]["rec"].get("feret_max")],
         "cam_mean_abs_error": [data["Camera"]["mean_abs_error"]],
         "cam_std_abs_error": [data["Camera"]["std_abs_error"]],
         "cam_mean_rel_error": [data["Camera"]["mean_rel_error"]],
@@ -481,6 +630,11 @@ def QuantitativeEvaluationData2DataFrame(data):
         "rec_cams": [data["Camera"]["rec_cams"]],
         "images": [data["Camera"]["images"]]
     }
+    for direction in ("rec2gt","gt2rec"):
+        for key, value in ((data.get("SurfaceDistances") or {}).get(direction) or {}).items():
+            if key.startswith("P"): df_data[f"{direction}_{key}"] = [value]
+    for threshold, value in ((data.get("SurfaceDistances") or {}).get("fscore") or {}).items():
+        df_data[f"Fscore_{threshold}"] = [value["fscore"]]
     df = pd.DataFrame(df_data)
     return df
 
@@ -1,6 +1,10 @@
 import numpy as np
 from pathlib import Path
 import vedo
+import importlib
+import sys
+importlib.reload(sys.modules['src.MeshStore']) if 'src.MeshStore' in sys.modules else None
+from src.MeshStore import LoadMesh, ToVedo
 vedo.settings.default_backend = 'vtk'
 def plot_mesh_vedo(project_name,output_path,DisplayPlots = False,Transformed = False):
     texture_path = Path(output_path) /'texture_1001.png'
@@ -10,7 +14,7 @@ def plot_mesh_vedo(project_name,output_path,DisplayPlots = False,Transformed = F
         print("Warning: Mesh file and/or texture file not existing.")
         return None, None
     
-    mesh_vedo = vedo.Mesh(str(mesh_path)).texture(str(texture_path))
+    mesh_vedo = ToVedo(LoadMesh(mesh_path),texture_path)
 
     # List of planes
     planes = ['xy', 'yz', 'xz']
@@ -49,7 +53,7 @@ def plot_mesh_vedo_one_window(mesh_path,texture_path,screenshot_path = None):
         obj_exists = False
         return obj_exists
     else: obj_exists = True
-    mesh_vedo = vedo.Mesh(str(mesh_path)).texture(str(texture_path))
+    mesh_vedo = ToVedo(LoadMesh(mesh_path),texture_path)
 
     plt = vedo.show(mesh_vedo, interactive=False)
     plt.interactive()
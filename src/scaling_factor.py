@@ -1,14 +1,12 @@
 import json
 import os
+import time
 from pathlib import Path
 import pandas as pd
 import numpy as np
 np.seterr(divide='ignore',invalid='ignore')
-from scipy.spatial.distance import cdist
 import matplotlib.pyplot as plt
 import seaborn as sns
-from sklearn import linear_model
-from sklearn.preprocessing import StandardScaler
 # Plot Settings
 plt.rc ('font', size = 11) # steuert die Standardtextgröße
 plt.rc ('axes', titlesize = 11) # Schriftgröße des Titels
@@ -20,34 +18,38 @@ sns.set(style='white',font='Arial')
 
 #-----------------------------------------------------------------------
 
-def scaling_factor(cams_rec,cams_ref,evaluation_path,PreOutlierDetection=False,threshold = 0.025, criterion = "abs",plot=True,DisplayAllPlots=True):
+def scaling_factor(cams_rec,cams_ref,evaluation_path,PreOutlierDetection=False,threshold = 0.025, criterion = "abs",plot=True,DisplayAllPlots=True,ConfidenceInterval=None):
     # calculate distance between the reconstructed cameras within a timestep for all timesteps (x)
     # calculate the same for the reference cameras (y)
     # Calculation of an information matrix containing the corresponding time steps and camera indices for all x and y values
     y, x, cams_info = CalculateDistancesWithinOneTimeStep(cams_ref,cams_rec)
     if len(y) == 0:
         print("Warning: No scaling factor could be determined because no two cameras could be reconstructed at the same time step.")
-        return None, None, None, None, None, None
+        return None, None, None, None, None, None, None
     # Detect and remove outliers that do not agree with the consistency rules
     if PreOutlierDetection:
-        cams_info = np.vstack(cams_info)
         total_number = len(y)
-        y, x = ConsistencyBasedOutlierDetection(y,x,cams_info,threshold,criterion)
+        y, x, IsInlier = ConsistencyBasedOutlierDetection(y,x,cams_info,threshold,criterion,ReturnInlierMask=True)
+        cams_info = cams_info[IsInlier]
         number_inliers = len(y);     number_outliers = total_number - number_inliers; 
     else: number_outliers = None; number_inliers = len(y)
     # calculate scaling factor and statistical measurements 
     if len(y) == 0:
         print("Warning: No scaling factor could be determined as no camera distances have successfully completed the outlier detection step.")
-        return None, None, None, None, None, None
+        return None, None, None, None, None, None, None
     factor_vec = np.divide(y,x)                     # Scaling factor = distance_ref / distance_rec     
     factor_mean = np.mean(factor_vec)               # Calculate mean scaling factor
     factor_median = np.median(factor_vec)           # Calculate median scaling factor
     factor_std = np.std(factor_vec)                 # Calculate standard deviation of scaling factors
+    # confidence interval of the median scaling factor (bootstrap or jackknife)
+    if ConfidenceInterval is not None:
+        dict_ci = ConfidenceIntervalScalingFactor(factor_vec,cams_info[:,2],**ConfidenceInterval)
+    else: dict_ci = None
     # plot and return
     if plot:
         fig = scaling_factor_plot(factor_vec,factor_mean,factor_median,factor_std,evaluation_path,DisplayAllPlots)
     else: fig = None
-    return factor_mean, factor_median, factor_std, fig, number_inliers, number_outliers 
+    return factor_mean, factor_median, factor_std, fig, number_inliers, number_outliers, dict_ci
    
 
 #-----------------------------------------------------------------------
@@ -68,153 +70,356 @@ def scaling_factor_RANSAC(cams_rec,cams_ref,evaluation_path,PreOutlierDetection,
     # n_img = len(cams_ref); n_TimeSteps = cams_ref[-1].TimeStep
     # n_cam = int(n_img/n_TimeSteps) 
     if  PreOutlierDetection:
-        cams_info = np.vstack(cams_info)
         y,x = ConsistencyBasedOutlierDetection(y,x,cams_info,threshold,criterion)
     if len(y) == 0:
         print("Warning: No scaling factor could be determined as no camera distances have successfully completed the outlier detection step.")
         return None
-    # allows a RANSAC solution in certain cases by introducing an artificial point at (0, 0)  
-    y = np.append(y,0); x = np.append(x,0); 
-    # Standardize features by removing the mean and scaling to unit variance (not necessary)
-    #sc = StandardScaler(with_mean=False); X = sc.fit_transform(x.reshape(-1, 1))
-    X = x.reshape(-1, 1)
-    # Fit line using all data
-    lr = linear_model.LinearRegression(fit_intercept=False)
-    lr.fit(X, y)
-    # Robustly fit linear model with RANSAC algorithm
-    try:
-        ransac = linear_model.RANSACRegressor(estimator=linear_model.LinearRegression(fit_intercept=False),random_state = 42)
-        ransac.fit(X, y)
-        inlier_mask = ransac.inlier_mask_
-        outlier_mask = np.logical_not(inlier_mask)
-        successful = True
-    except Exception as e:
-        print("An error occurred:",e)
-        successful = False
+    # Fit line through the origin using all data (least squares)
+    coef_lr = np.sum(x*y)/np.sum(x*x)
+    # Robustly fit the scaling factor (line through the origin) with RANSAC
+    coef_ransac, inlier_mask = RANSACScalingFactor(x,y,seed=42)
+    successful = inlier_mask is not None
+    if successful: outlier_mask = np.logical_not(inlier_mask)
+    else: print("An error occurred: RANSAC could not find a valid consensus set.")
     # plot and print results and return the solution found with RANSAC
-    #if successful: fig = ransac_plot(lr,ransac,X[:-1],y[:-1],inlier_mask[:-1],outlier_mask[:-1],successful)
-    #else: fig = ransac_plot(lr,ransac,X[:-1],y[:-1],1,1,successful)
-    #if successful: fig = ransac_plot(lr,ransac,X,y,inlier_mask,outlier_mask,successful)
-    #else: fig = ransac_plot(lr,ransac,X,y,1,1,successful)
-    if successful: return ransac.estimator_.coef_[0]
-    else: return lr.coef_[0]
+    #if successful: fig = ransac_plot(coef_lr,coef_ransac,x.reshape(-1, 1),y,inlier_mask,outlier_mask,successful)
+    #else: fig = ransac_plot(coef_lr,coef_ransac,x.reshape(-1, 1),y,1,1,successful)
+    if successful: return coef_ransac
+    else: return coef_lr
     
 #-----------------------------------------------------------------------   
 
+def RANSACScalingFactor(x, y, residual_threshold=None, scoring="msac", local_optimization=True, confidence=0.99, max_trials=1000, batch_size=256, seed=42):
+    # RANSAC for the model y = s*x (line through the origin)
+    # --> the minimal sample is one distance pair, every hypothesis is the ratio s = y_k / x_k
+    # --> a batch of hypotheses is scored at once with a broadcasted residual matrix (hypotheses x distances)
+    # scoring: "ransac" (number of inliers) or "msac" (truncated quadratic loss)
+    # local_optimization: refit the best hypothesis on its inliers (LO-RANSAC)
+    # the number of trials is adapted to the inlier ratio of the best hypothesis (confidence)
+    x = np.asarray(x, dtype=float); y = np.asarray(y, dtype=float)
+    n = len(x)
+    if residual_threshold is None:
+        residual_threshold = np.median(np.abs(y - np.median(y)))     # median absolute deviation of y (as in sklearn)
+    candidates = np.flatnonzero(x != 0)                              # x = 0 does not define a scaling factor
+    if len(candidates) == 0: return None, None
+    rng = np.random.default_rng(seed)
+    batch_size = max(1, min(batch_size, 2**24 // max(n,1)))         # limit the size of the residual matrix
+    best_score = np.inf; best_scale = None; best_n_inliers = 0
+    trials = 0; required_trials = max_trials
+    while trials < min(required_trials, max_trials):
+        k = rng.choice(candidates, size=min(batch_size, max_trials-trials))
+        scales = y[k]/x[k]                                           # one hypothesis per sample
+        residuals = np.abs(y[None,:] - scales[:,None]*x[None,:])    # (hypotheses, distances)
+        is_inlier = residuals <= residual_threshold
+        n_inliers = np.sum(is_inlier, axis=1)
+        if scoring == "msac": score = np.sum(np.minimum(residuals, residual_threshold)**2, axis=1)
+        else: score = -n_inliers.astype(float)
+        best = np.argmin(score)
+        if score[best] < best_score:
+            best_score = score[best]; best_scale = scales[best]; best_n_inliers = n_inliers[best]
+            # adaptive number of trials: log(1-confidence) / log(1-inlier_ratio)
+            inlier_ratio = best_n_inliers / n
+            if inlier_ratio >= 1: required_trials = 0
+            elif inlier_ratio > 0: required_trials = int(np.ceil(np.log(1-confidence) / np.log(1-inlier_ratio)))
+        trials += len(k)
+    if best_scale is None or best_n_inliers == 0: return None, None
+    inlier_mask = np.abs(y - best_scale*x) <= residual_threshold
+    # final (least squares) fit on the consensus set, with local optimization repeated until the consensus set is stable
+    for _ in range(10 if local_optimization else 1):
+        scale = np.sum(x[inlier_mask]*y[inlier_mask]) / np.sum(x[inlier_mask]**2)
+        if not local_optimization: break
+        inlier_mask_new = np.abs(y - scale*x) <= residual_threshold
+        if np.array_equal(inlier_mask_new, inlier_mask) or not inlier_mask_new.any(): break
+        inlier_mask = inlier_mask_new
+    return scale, inlier_mask
+
+#-----------------------------------------------------------------------   
+
 def CalculateDistancesWithinOneTimeStep(cams_ref,cams_rec):
     # calculate distance between the reconstructed cameras within a timestep for all timesteps (x)
     # calculate the same for the reference cameras (y)
     # Calculation of an information matrix containing the corresponding time steps and camera indices for all x and y values
+    # --> all timesteps are processed at once, see PackCameraCenters and CalculateDistancesAllTimeSteps
+    pos_ref, pos_rec, IsReconstructed = PackCameraCenters(cams_ref,cams_rec)
+    y, x, cams_info = CalculateDistancesAllTimeSteps(pos_ref,pos_rec,IsReconstructed)
+    return y, x, cams_info
+
+#-----------------------------------------------------------------------   
+
+def PackCameraCenters(cams_ref,cams_rec,n_cam=None):
+    # Pack the camera centers of the reference and the reconstructed cameras into (T,C,3) arrays
+    # T: number of timesteps, C: number of cameras per timestep
+    # IsReconstructed (T,C): True, if a corresponding reconstructed camera exists (missing-camera mask)
+    # n_cam: number of cameras per timestep, only necessary if cams_ref does not start with the first timestep (batch of timesteps)
     n_img = len(cams_ref)                          # number of images
-    n_TimeSteps = cams_ref[-1].TimeStep            # numer of timesteps
-    n_cam = int(n_img/n_TimeSteps)                 # calculate the number of cameras per time step
-    dist_vec_ref = []; dist_vec_rec = []; cams_info = []
-    ind_ref = 0                                     # Index for accessing camera positions
-    for i in range(n_TimeSteps):                    # Iterate over all time steps
-        pos_matrix_ref = np.zeros([n_cam,3])        # Initialize a matrix to store ground truth camera positions within a time step
-        pos_matrix_rec = np.zeros([n_cam,3])        # Initialize a matrix to store ground reconstructed camera positions within a time step
-        NotRecCams = []; RecCams = []               # Create a list for the reconstructed and the not reconstructed cameras within a timestep
-        for j in range(n_cam):                      # Iterate over all cameras within this timestep
-            ind_rec = cams_ref[ind_ref].CorrespondigIndex                   # corresponding reconstructed camera to the reference camera
-            if ind_rec != None:                                             # reconstructed camera exists? 
-                x_ref = cams_ref[ind_ref].Location                          # Extract XYZ coordinates (reference camera)
-                x_rec = cams_rec[ind_rec].Location                          # Extract XYZ coordinates (reconstructed camera)
-                pos_matrix_ref[j,:] = x_ref; pos_matrix_rec[j,:] = x_rec    # Store camera positions in a matrix  within a time step
-                RecCams.append(j)                                           # Store the index of the reconstructed camera within a timestep
-            else: NotRecCams.append(j)                                      # Store the index of the not reconstructed camera within a timestep
-            ind_ref += 1                                                    # Update Index for accessing camera positions
-        pos_matrix_ref = np.delete(pos_matrix_ref,NotRecCams,0)             # delete not reconstructed cameras from the position matrix (reference)
-        pos_matrix_rec = np.delete(pos_matrix_rec,NotRecCams,0)             # delete not reconstructed cameras from the position matrix (reconstructed)
-        dist_matrix_ref = cdist(pos_matrix_ref,pos_matrix_ref,'euclidean')  # Compute euklidean distance between each pair of the cameras (groud truth)   --> Euclidean distance matrix
-        dist_matrix_rec = cdist(pos_matrix_rec,pos_matrix_rec,'euclidean')  # Compute euklidean distance between each pair of the cameras (reconstructed) --> Euclidean distance matrix
-        # distance between cam i and j is the same as the distance between cam j and i, the distance between a camera i and i is always zero 
-        # --> the distance matrices are squared and symmetrical with a zero vector on the main diagonal
-        # --> thus the upper triangular matrix, without the main diagonal, contains the complete information content
-        dist_vec_ref.append(GetValuesUpperTriangularMatrixWithoutDiagonal(dist_matrix_ref,GetIndMatrix=False))              # flatten the upper triangular matrix w.o. the diagonal to vector
-        dist_vec_timestep,IndMatrix = GetValuesUpperTriangularMatrixWithoutDiagonal(dist_matrix_rec,GetIndMatrix=True)      # flatten the upper triangular matrix w.o. the diagonal to vector
-        cams_info_timestep = IndMatrix2CamInfoMatrix(IndMatrix,RecCams,Timestepm1=i)         # calculate the information matrix for all cameras within the timestep
-        cams_info.append(cams_info_timestep); dist_vec_rec.append(dist_vec_timestep)      # append the calculated vector / matrix
-    # define response variable y and explanatory variable x
-    y = np.concatenate(dist_vec_ref)
-    x = np.concatenate(dist_vec_rec)
+    if n_cam is None:
+        n_TimeSteps = int(cams_ref[-1].TimeStep)   # numer of timesteps
+        n_cam = int(n_img/n_TimeSteps)             # calculate the number of cameras per time step
+    else: n_TimeSteps = n_img // n_cam
+    n = n_TimeSteps*n_cam                          # number of cameras that are considered
+    pos_ref = np.zeros([n,3])                      # positions of the reference cameras
+    pos_rec = np.zeros([n,3])                      # positions of the reconstructed cameras (zero if not reconstructed)
+    IsReconstructed = np.zeros(n, dtype=bool)
+    if isinstance(getattr(cams_ref,"CorrespondigIndex",None), np.ndarray) and isinstance(getattr(cams_rec,"Location",None), np.ndarray):
+        # array-backed cameras (CameraSet) --> no iteration necessary
+        ind_rec = cams_ref.CorrespondigIndex[:n]
+        IsReconstructed = ind_rec >= 0
+        pos_ref[IsReconstructed] = cams_ref.Location[:n][IsReconstructed]
+        pos_rec[IsReconstructed] = cams_rec.Location[ind_rec[IsReconstructed]]
+    else:
+        for k in range(n):
+            ind_rec = cams_ref[k].CorrespondigIndex    # corresponding reconstructed camera to the reference camera
+            if ind_rec is not None:                    # reconstructed camera exists?
+                pos_ref[k,:] = cams_ref[k].Location
+                pos_rec[k,:] = cams_rec[ind_rec].Location
+                IsReconstructed[k] = True
+    return pos_ref.reshape(n_TimeSteps,n_cam,3), pos_rec.reshape(n_TimeSteps,n_cam,3), IsReconstructed.reshape(n_TimeSteps,n_cam)
+
+#-----------------------------------------------------------------------   
+
+def CalculateDistancesAllTimeSteps(pos_ref,pos_rec,IsReconstructed):
+    # pos_ref, pos_rec: (T,C,3) camera centers, IsReconstructed: (T,C) missing-camera mask
+    # distance between cam i and j is the same as the distance between cam j and i, the distance between a camera i and i is always zero 
+    # --> only the camera pairs of the upper triangular matrix, without the main diagonal, are evaluated
+    n_TimeSteps, n_cam = IsReconstructed.shape
+    cam1, cam2 = np.triu_indices(n_cam,k=1)                             # indices of all camera pairs (row by row, like the flattened upper triangular matrix)
+    # a distance exists only if both cameras of the pair were reconstructed within the timestep
+    IsValid = IsReconstructed[:,cam1] & IsReconstructed[:,cam2]         # (T,P) mask
+    # euclidean distance between the camera pairs for all timesteps at once (T,P)
+    dist_ref = np.sqrt(np.sum((pos_ref[:,cam1,:]-pos_ref[:,cam2,:])**2,axis=2))
+    dist_rec = np.sqrt(np.sum((pos_rec[:,cam1,:]-pos_rec[:,cam2,:])**2,axis=2))
+    # define response variable y and explanatory variable x (boolean indexing keeps the order: timestep, cam1, cam2)
+    y = dist_ref[IsValid]
+    x = dist_rec[IsValid]
+    # information matrix: camera index 1, camera index 2 and timestep (starting from 1) of each distance
+    TimeStep, Pair = np.nonzero(IsValid)
+    cams_info = np.column_stack([cam1[Pair],cam2[Pair],TimeStep+1]).astype(float)
     return y, x, cams_info
 
 #-----------------------------------------------------------------------   
 
-def GetValuesUpperTriangularMatrixWithoutDiagonal(matrix,GetIndMatrix=False):
-    # matrix is quadratic
-    n = len(matrix)
-    vec = np.zeros(int(n*(n-1)/2))
-    # form a matrix that stores the indexes of the camera pairs for the respective vector entry
-    IndMatrix = np.zeros([int(n*(n-1)/2),2])
-    row = 0; column = 1
-    ind = 0
-    for i in range(int(n*(n+1)/2)):
-        if column < n:
-            vec[ind] = matrix[row,column]
-            IndMatrix[ind,:] = [row,column] 
-            ind += 1; column += 1
+def ConfidenceIntervalScalingFactor(factor_vec, TimeSteps=None, method="block", n_resamples=10000, confidence=0.95, chunk_size=None, seed=42):
+    # Confidence interval of the median scaling factor
+    # method: "bootstrap" --> resampling of the individual scaling factors
+    #         "block"     --> resampling of complete timesteps (distances within one timestep are correlated)
+    #         "jackknife" --> leave-one-out (leave-one-timestep-out, if TimeSteps is given)
+    # The resamples are drawn chunk by chunk, chunk_size limits the number of resamples held in memory at once
+    factor_vec = np.asarray(factor_vec, dtype=float)
+    n = len(factor_vec)
+    median = np.median(factor_vec)
+    chunk_size = n_resamples if chunk_size is None else chunk_size
+    alpha = 1 - confidence
+    rng = np.random.default_rng(seed)
+    if method == "bootstrap":
+        # the index matrix is drawn chunk by chunk (same random stream as drawing it at once)
+        medians = np.concatenate([np.median(factor_vec[rng.integers(0, n, size=[min(chunk_size,n_resamples-i),n])],axis=1) for i in range(0,n_resamples,chunk_size)])
+    elif method == "block" or (method == "jackknife" and TimeSteps is not None):
+        # sort the scaling factors once, each resample is described by the number of times each timestep was drawn
+        _, block = np.unique(TimeSteps, return_inverse=True)
+        n_blocks = np.max(block) + 1
+        order = np.argsort(factor_vec, kind='stable'); factor_sorted = factor_vec[order]; block_sorted = block[order]
+        if method == "block":
+            # the drawn timesteps and their counts are built chunk by chunk --> at most chunk_size resamples are held in memory
+            medians = []
+            for i in range(0,n_resamples,chunk_size):
+                m = min(chunk_size,n_resamples-i)
+                indices = rng.integers(0, n_blocks, size=[m,n_blocks])
+                counts = np.zeros([m,n_blocks]); np.add.at(counts, (np.arange(m)[:,None],indices), 1)
+                medians.append(WeightedMedianSorted(factor_sorted,counts[:,block_sorted]))
+            medians = np.concatenate(medians)
         else:
-            row += 1; column = row+1
-    if GetIndMatrix == False:
-        return vec
-    else: return vec,IndMatrix
+            counts = 1 - np.eye(n_blocks)                    # delete one timestep per resample
+            medians = np.concatenate([WeightedMedianSorted(factor_sorted,counts[i:i+chunk_size][:,block_sorted]) for i in range(0,len(counts),chunk_size)])
+    elif method == "jackknife":
+        # delete-one medians without resampling: removing the value with rank k shifts all higher ranks by one
+        factor_sorted = np.sort(factor_vec)
+        k = np.arange(n)[:,None]
+        ranks = np.array([(n-2)//2, (n-1)//2])[None,:]    # ranks of the median of n-1 values
+        medians = np.mean(factor_sorted[ranks + (ranks >= k)], axis=1)
+    else:
+        raise ValueError(f"Unknown method for the confidence interval: {method}")
+    medians = medians[np.isfinite(medians)]
+    if method == "jackknife":
+        m = len(medians)
+        se = np.sqrt((m-1)/m*np.sum((medians-np.mean(medians))**2))
+        bias = (m-1)*(np.mean(medians)-median)
+        from scipy.stats import norm
+        z = norm.ppf(1-alpha/2)
+        ci_low = median - z*se; ci_high = median + z*se
+    else:
+        se = np.std(medians, ddof=1)
+        bias = np.mean(medians) - median
+        ci_low, ci_high = np.quantile(medians, [alpha/2, 1-alpha/2])       # percentile interval
+    print(f"{confidence*100:.0f}% confidence interval of the median scaling factor ({method}): [{ci_low:.5f}, {ci_high:.5f}]")
+    return {"method": method, "confidence": confidence, "n_resamples": int(len(medians)), "ci_low": float(ci_low), "ci_high": float(ci_high),
+            "se": float(se), "bias": float(bias)}
+
+def WeightedMedianSorted(values_sorted, weights):
+    # median of the sample, in which each (sorted) value occurs weights[i,j] times (one row per resample)
+    # identical to np.median of the expanded sample (mean of the two middle values for an even number of values)
+    cum_weights = np.cumsum(weights, axis=1)
+    total = cum_weights[:,-1]
+    lower = np.argmax(cum_weights > ((total-1)//2)[:,None], axis=1)
+    upper = np.argmax(cum_weights > (total//2)[:,None], axis=1)
+    median = (values_sorted[lower] + values_sorted[upper]) / 2
+    median[total == 0] = np.nan
+    return median
 
 #-----------------------------------------------------------------------   
-    
-def IndMatrix2CamInfoMatrix(IndMatrix,RecCams,Timestepm1):
-    n = len(IndMatrix[:,0])
-    CamsInfoMatrix = np.ones([n,3])*(-1)
-    for row in range(n):
-         for column in range(2):
-            Ind = int(IndMatrix[row,column])
-            CamsInfoMatrix[row,column] = RecCams[Ind]
-    CamsInfoMatrix[:,2] = Timestepm1 + 1
-    return CamsInfoMatrix
+
+class QuantileSketch:
+    # Bounded-memory quantile sketch (KLL-like compactor hierarchy)
+    # Each level stores at most k values, a value on level l represents 2^l original values
+    # --> memory grows only with k*log2(n/k), the rank error is approximately 1/k
+    def __init__(self, k=512, seed=42):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.n += len(values)
+        self.compress()
+
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self.k:
+                values = np.sort(self.levels[level])
+                if len(values) % 2:                         # an odd value remains on the current level
+                    self.levels[level] = values[-1:]; values = values[:-1]
+                else: self.levels[level] = np.empty(0)
+                if level+1 == len(self.levels): self.levels.append(np.empty(0))
+                # keep every second value (random offset) --> each kept value represents twice as many values 
+                self.levels[level+1] = np.concatenate([self.levels[level+1], values[self.rng.integers(2)::2]])
+            level += 1
+
+    def quantile(self, q):
+        if self.n == 0: return None
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(values_level), 2.0**level) for level,values_level in enumerate(self.levels)])
+        order = np.argsort(values)
+        cum_weights = np.cumsum(weights[order])
+        ind = np.searchsorted(cum_weights, np.asarray(q)*cum_weights[-1], side='left')
+        return values[order][np.minimum(ind,len(values)-1)]
+
+#-----------------------------------------------------------------------   
+
+class IncrementalScalingFactor:
+    # Streaming estimation of the scaling factor for long recordings
+    # Camera batches (complete timesteps) can be added while the SfM output is still read.
+    # Median and IQR come from a quantile sketch, mean and std are updated with the running (Chan/Welford) formulas.
+    # The consistency outlier test is applied per camera pair: a distance is an inlier as soon as a distance of the same
+    # camera pair at another timestep fulfills the criterion. For each camera pair only the last history_size distances
+    # are kept, distances that are not confirmed before they leave the history are counted as outliers.
+    # The mean distances of the criteria "rel" and "abs_norm" are the running means of all distances seen so far.
+    def __init__(self, n_cam, PreOutlierDetection=True, threshold=0.025, criterion="abs", history_size=64, sketch_size=512):
+        self.n_cam = n_cam
+        self.PreOutlierDetection = PreOutlierDetection
+        self.threshold = threshold
+        self.criterion = criterion
+        self.sketch = QuantileSketch(sketch_size)
+        self.n_TimeSteps = 0
+        self.count = 0; self.mean = 0.0; self.M2 = 0.0         # running statistics of the accepted scaling factors
+        self.number_outliers = 0
+        self.sum_x = 0.0; self.sum_y = 0.0; self.n_distances = 0
+        n_pairs = n_cam*(n_cam-1)//2
+        # history of each camera pair (ring buffer): reconstructed distance, reference distance, weighted threshold, pending flag
+        self.hist_x = np.full([n_pairs,history_size], np.nan)
+        self.hist_y = np.full([n_pairs,history_size], np.nan)
+        self.hist_r = np.full([n_pairs,history_size], np.nan)
+        self.hist_pending = np.zeros([n_pairs,history_size], dtype=bool)
+        self.hist_pointer = np.zeros(n_pairs, dtype=np.int64)
+
+    def add_cameras(self, cams_ref, cams_rec):
+        # cams_ref: reference cameras of complete timesteps (ordered by timestep), cams_rec: all reconstructed cameras parsed so far
+        pos_ref, pos_rec, IsReconstructed = PackCameraCenters(cams_ref,cams_rec,self.n_cam)
+        self.add_batch(pos_ref,pos_rec,IsReconstructed)
+
+    def add_batch(self, pos_ref, pos_rec, IsReconstructed):
+        # pos_ref, pos_rec: (T,C,3) camera centers of the new timesteps, IsReconstructed: (T,C) missing-camera mask
+        y, x, cams_info = CalculateDistancesAllTimeSteps(pos_ref,pos_rec,IsReconstructed)
+        n_TimeSteps = IsReconstructed.shape[0]
+        self.sum_x += np.sum(x); self.sum_y += np.sum(y); self.n_distances += len(y)
+        if not self.PreOutlierDetection:
+            self.accept(y,x)
+        else:
+            cam1, cam2 = np.triu_indices(self.n_cam,k=1)
+            pair_index = np.full([self.n_cam,self.n_cam], -1); pair_index[cam1,cam2] = np.arange(len(cam1))
+            pairs = pair_index[cams_info[:,0].astype(np.int64),cams_info[:,1].astype(np.int64)]
+            for t in range(1,n_TimeSteps+1):                # a camera pair occurs only once per timestep
+                ind = cams_info[:,2] == t
+                if np.any(ind): self.add_timestep(y[ind],x[ind],pairs[ind])
+        self.n_TimeSteps += n_TimeSteps
+
+    def add_timestep(self, y, x, pairs):
+        # weighted threshold of the new distances
+        y_mean = self.sum_y/self.n_distances; x_mean = self.sum_x/self.n_distances
+        if self.criterion == "rel": beta = x_mean / y_mean * y
+        elif self.criterion == "abs_norm": beta = y_mean/y
+        else: beta = np.ones(len(y))
+        r = beta*self.threshold
+        # compare the new distances with the history of the same camera pair (both directions of the criterion)
+        d_diff = np.abs(x[:,None] - self.hist_x[pairs])
+        crit_fulfilled = (d_diff <= r[:,None]) | (d_diff <= self.hist_r[pairs])
+        IsInlier = np.any(crit_fulfilled, axis=1)
+        # pending distances of the history, which are now confirmed
+        confirmed = crit_fulfilled & self.hist_pending[pairs]
+        rows, slots = np.nonzero(confirmed)
+        self.accept(self.hist_y[pairs[rows],slots],self.hist_x[pairs[rows],slots])
+        self.hist_pending[pairs[rows],slots] = False
+        self.accept(y[IsInlier],x[IsInlier])
+        # store the new distances in the history, pending distances that are overwritten are outliers
+        slot = self.hist_pointer[pairs]
+        self.number_outliers += int(np.sum(self.hist_pending[pairs,slot]))
+        self.hist_x[pairs,slot] = x; self.hist_y[pairs,slot] = y; self.hist_r[pairs,slot] = r
+        self.hist_pending[pairs,slot] = ~IsInlier
+        self.hist_pointer[pairs] = (slot + 1) % self.hist_x.shape[1]
+
+    def accept(self, y, x):
+        factor_vec = np.divide(y,x)
+        if len(factor_vec) == 0: return
+        self.sketch.update(factor_vec)
+        # merge the statistics of the batch with the running statistics (Chan et al.)
+        n_batch = len(factor_vec); mean_batch = np.mean(factor_vec); M2_batch = np.sum((factor_vec-mean_batch)**2)
+        delta = mean_batch - self.mean; n_total = self.count + n_batch
+        self.mean += delta*n_batch/n_total
+        self.M2 += M2_batch + delta**2*self.count*n_batch/n_total
+        self.count = n_total
+
+    def result(self):
+        # current estimate of the scaling factor (can be called at any time)
+        if self.PreOutlierDetection and self.n_TimeSteps == 1:
+            # only one timestep --> no consistency check possible (as in ConsistencyBasedOutlierDetection)
+            pending = self.hist_pending
+            factor_vec = np.divide(self.hist_y[pending],self.hist_x[pending])
+            if len(factor_vec) == 0: return None
+            q25, median, q75 = np.quantile(factor_vec,[0.25,0.5,0.75])
+            mean = np.mean(factor_vec); std = np.std(factor_vec)
+            number_inliers = len(factor_vec); number_outliers = None
+        else:
+            if self.count == 0: return None
+            q25, median, q75 = self.sketch.quantile([0.25,0.5,0.75])
+            mean = self.mean; std = np.sqrt(self.M2/self.count)
+            number_inliers = self.count
+            number_outliers = self.number_outliers + int(np.sum(self.hist_pending)) if self.PreOutlierDetection else None
+        return {"median": float(median), "mean": float(mean), "std": float(std), "q25": float(q25), "q75": float(q75), "iqr": float(q75-q25),
+                "number_inliers": number_inliers, "number_outliers": number_outliers, "timesteps": self.n_TimeSteps}
 
 #-----------------------------------------------------------------------   
 
-def ConsistencyBasedOutlierDetection(y, x, cam_rec_info, threshold=0.025, criterion = "abs"):
-    y_mean = np.mean(y)             # calculate the mean distance between two cameras (reference cams)
-    x_mean = np.mean(x)             # calculate the mean distance between two cameras (reconstructed cams)
+def ConsistencyBasedOutlierDetection(y, x, cam_rec_info, threshold=0.025, criterion = "abs", ReturnInlierMask = False):
+    IsInlier = np.ones(len(y), dtype=bool)
     if cam_rec_info[-1, 2] != 1:    # only works in a dynamic case (object is moving)
         n = len(y)                  # number of measured distances between cameras 
-        IsInlier = np.zeros(n, dtype=bool)      # initialize a numpy vector: value = 1, if a camera could be an inlier
-        inlier_cameras = set()                  # create a class to save potential  inlier cameras
-        for i in range(n):                      # iterate over all distances
-            if not IsInlier[i]:                 # if distance is already identified as inlier, then skip the next steps
-                cam1_ind1, cam2_ind1, t_ind1 = cam_rec_info[i] # get camera indexes
-                # get the indexes of all distances that were determined from the same camera combination at different time steps
-                same_camera_indices = np.where((cam_rec_info[:, 2] != t_ind1) &
-                                                (cam_rec_info[:, 0] == cam1_ind1) & 
-                                                (cam_rec_info[:, 1] == cam2_ind1))[0]
-                for j in same_camera_indices:   # Iterate over the associated camera pairs
-                    cam1_ind2, cam2_ind2, t_ind2  = cam_rec_info[j]
-                    d_diff = x[i] - x[j]        # Calculate the deviation of the two distances
-                    # Determine weight on the threshold
-                    if criterion == "rel": beta = x_mean / y_mean * y[i]
-                    elif criterion == "abs_norm": beta = y_mean/y[i]
-                    else: beta = 1
-                    # criterion 
-                    crit_fulfilled =  np.abs(d_diff) <= beta*threshold
-                    if crit_fulfilled: # if the relative deviation is smaller than the weighted threshold --> Inlier
-                        IsInlier[i] = True                          # both distances are detected as inliers 
-                        IsInlier[j] = True
-                        inlier_cameras.add((t_ind1, cam1_ind1))     # all four corresponding cameras are detected as inliers 
-                        inlier_cameras.add((t_ind1, cam2_ind1))
-                        inlier_cameras.add((t_ind2, cam1_ind2))
-                        inlier_cameras.add((t_ind2, cam2_ind2))
+        # identify the inlier distances, the camera pairs are evaluated group by group
+        IsInlier, outlier_cameras = ConsistencyBasedOutlierDetectionGrouped(y,x,cam_rec_info,threshold,criterion)
         number_outlier = n - np.sum(IsInlier)
         if criterion == "rel": print(f"{number_outlier} of {n} measured distances between camera pairs were detected as outliers (relative threshold: {threshold*100:.1f}%)")
         elif criterion == "abs_norm": print(f"{number_outlier} of {n} measured distances between camera pairs were detected as outliers (absolute normalized threshold: {threshold*1000:.0f}mm)")
         else:  print(f"{number_outlier} of {n} measured distances between camera pairs were detected as outliers (absolute threshold: {threshold*1000:.0f}mm)")
-        outlier_cameras = set()                                     # define a class to save the outliers
-        # first set all cameras as outliers and the remove the inliers from the outliers
-        for i, (cam1, cam2, t) in enumerate(cam_rec_info):           
-                outlier_cameras.add((t, cam1))
-                outlier_cameras.add((t, cam2))
-        for inlier_cam in inlier_cameras:
-            outlier_cameras.remove(inlier_cam)
         # print outlier cameras
         if outlier_cameras != {}:
             print(f"{len(outlier_cameras)} Outlier Camera has been detected:")
@@ -224,10 +429,104 @@ def ConsistencyBasedOutlierDetection(y, x, cam_rec_info, threshold=0.025, criter
         y = y[IsInlier]
         x = x[IsInlier]
         
+    if ReturnInlierMask: return y, x, IsInlier
     return y, x 
 
 #-----------------------------------------------------------------------   
 
+def ConsistencyBasedOutlierDetectionGrouped(y, x, cam_rec_info, threshold=0.025, criterion = "abs"):
+    # A distance is an inlier if the distance of the same camera pair at another time step deviates by less than the (weighted) threshold
+    # --> only distances of the same camera pair have to be compared with each other
+    # --> group the distances by camera pair and run the comparison inside each group
+    y = np.asarray(y); x = np.asarray(x)
+    n = len(y)                                              # number of measured distances between cameras 
+    y_mean = np.mean(y)                                     # calculate the mean distance between two cameras (reference cams)
+    x_mean = np.mean(x)                                     # calculate the mean distance between two cameras (reconstructed cams)
+    # Determine weight on the threshold for every distance
+    if criterion == "rel": beta = x_mean / y_mean * y
+    elif criterion == "abs_norm": beta = y_mean/y
+    else: beta = np.ones(n)
+    radius = beta*threshold                                 # maximum deviation of a distance to be consistent
+    # sort the distances by camera pair, the stable sort keeps the original order within a group
+    cam1 = cam_rec_info[:,0].astype(np.int64); cam2 = cam_rec_info[:,1].astype(np.int64)
+    key = cam1*(np.max(cam2)+1) + cam2
+    order = np.argsort(key, kind='stable')
+    bounds = np.flatnonzero(np.diff(key[order])) + 1
+    IsInlier = np.zeros(n, dtype=bool)
+    for group in np.split(order,bounds):                    # iterate over all camera pairs
+        IsInlier[group] = _ConsistencyWithinGroup(x[group],radius[group])
+    # all cameras of the inlier distances are inliers, all other cameras are outliers
+    TimeStep = cam_rec_info[:,2].astype(np.int64)
+    n_cam = max(np.max(cam1),np.max(cam2)) + 1
+    cameras = np.concatenate([TimeStep*n_cam + cam1, TimeStep*n_cam + cam2])     # unique key (timestep, camera) for each camera
+    IsCamera = np.zeros(np.max(cameras)+1, dtype=bool); IsCamera[cameras] = True
+    IsInlierCamera = np.zeros_like(IsCamera); IsInlierCamera[cameras[np.tile(IsInlier,2)]] = True
+    outlier_keys = np.flatnonzero(IsCamera & ~IsInlierCamera)
+    outlier_cameras = set(zip((outlier_keys // n_cam).astype(float), (outlier_keys % n_cam).astype(float)))
+    return IsInlier, outlier_cameras
+
+#-----------------------------------------------------------------------   
+
+def _ConsistencyWithinGroup(x, radius, window=1024):
+    # same result as the pairwise comparison: the distances are visited in their original order, a distance that is already
+    # an inlier is skipped, otherwise it and all distances within its radius become inliers
+    # --> a distance with a partner within its own radius is always an inlier (closest neighbour in the sorted order)
+    # --> other distances only become inliers if they lie within the radius of a visited distance that was not yet an inlier ("leader")
+    # The leaders are found in the original order, only the leaders are visited (vectorized search for the next uncovered candidate)
+    n = len(x)
+    IsInlier = np.zeros(n, dtype=bool)
+    if n < 2: return IsInlier
+    order = np.argsort(x, kind='stable'); x_sorted = x[order]
+    gap = np.abs(np.diff(x_sorted))
+    gap_closest = np.minimum(np.concatenate([[np.inf],gap]), np.concatenate([gap,[np.inf]]))
+    IsInlier[order] = gap_closest <= radius[order]
+    number_inliers = np.count_nonzero(IsInlier)
+    if number_inliers == n or np.all(radius == radius[0]):
+        return IsInlier                                     # early exit, with a constant radius no other distance can become an inlier
+    candidates = np.flatnonzero(IsInlier)                   # distances that fulfill the criterion themselves (original order)
+    covered = np.zeros(n, dtype=bool)                       # already an inlier when the distance is visited
+    # candidate window of each distance in the sorted order, slightly enlarged so that rounding cannot exclude a candidate
+    slack = 1e-9*(np.abs(x)+np.abs(radius))
+    lower = np.searchsorted(x_sorted, x-radius-slack, side='left')
+    upper = np.searchsorted(x_sorted, x+radius+slack, side='right')
+    k = 0
+    while k < len(candidates) and number_inliers < n:     # early exit, every distance is already an inlier
+        # next candidate that is not covered by a previous leader
+        uncovered = ~covered[candidates[k:k+window]]
+        if not uncovered.any():
+            k += window; continue
+        k += int(np.argmax(uncovered))
+        i = candidates[k]; k += 1
+        matches = order[lower[i]:upper[i]]
+        matches = matches[np.abs(x[i] - x[matches]) <= radius[i]]
+        number_inliers += np.count_nonzero(~IsInlier[matches])
+        IsInlier[matches] = True; covered[matches] = True
+    return IsInlier
+
+#-----------------------------------------------------------------------   
+
+def BenchmarkConsistencyBasedOutlierDetection(n_distances = [10**4,10**5,10**6], n_cam = 16, threshold = 0.025, outlier_ratio = 0.05, seed = 42):
+    # runtime of the grouped outlier detection for synthetic recordings (random camera positions, 5% outliers)
+    rng = np.random.default_rng(seed)
+    n_pairs = n_cam*(n_cam-1)//2
+    results = []
+    for n in n_distances:
+        n_TimeSteps = int(np.ceil(n/n_pairs))
+        pos_ref = rng.normal(0,0.2,[n_TimeSteps,n_cam,3])
+        pos_rec = pos_ref/4 + rng.normal(0,1e-4,[n_TimeSteps,n_cam,3])
+        IsOutlier = rng.random([n_TimeSteps,n_cam]) < outlier_ratio
+        pos_rec[IsOutlier] += rng.normal(0,0.05,[np.sum(IsOutlier),3])
+        y, x, cams_info = CalculateDistancesAllTimeSteps(pos_ref,pos_rec,np.ones([n_TimeSteps,n_cam],dtype=bool))
+        for criterion in ["abs","abs_norm","rel"]:
+            start = time.perf_counter()
+            IsInlier,_ = ConsistencyBasedOutlierDetectionGrouped(y,x,cams_info,threshold,criterion)
+            runtime = time.perf_counter() - start
+            results.append([len(y),criterion,runtime,len(y)-np.sum(IsInlier)])
+            print(f"{len(y):>8} distances, criterion: {criterion:>8}, runtime: {runtime:.3f}s, outliers: {len(y)-np.sum(IsInlier)}")
+    return pd.DataFrame(results,columns=["distances","criterion","runtime","outliers"])
+
+#-----------------------------------------------------------------------   
+
 def scaling_factor_plot(factor_vec,factor_mean,factor_median,factor_std,evaluation_path,DisplayAllPlots=True):
     fig = plt.figure(figsize=(6.4,4.8))
     g = sns.histplot(data=pd.DataFrame(factor_vec),legend=False, kde=True,fill=False)
@@ -250,16 +549,16 @@ def scaling_factor_plot(factor_vec,factor_mean,factor_median,factor_std,evaluati
 
 #-----------------------------------------------------------------------   
 
-def ransac_plot(lr,ransac,X,y,inlier_mask,outlier_mask,successful):
-    # Predict data of estimated models
+def ransac_plot(coef_lr,coef_ransac,X,y,inlier_mask,outlier_mask,successful):
+    # Predict data of estimated models (lines through the origin)
     line_X = np.linspace(X.min(), X.max(),2)[:, np.newaxis]
-    line_y = lr.predict(line_X)
+    line_y = coef_lr*line_X
     if successful:
-        line_y_ransac = ransac.predict(line_X)
+        line_y_ransac = coef_ransac*line_X
     # Compare estimated coefficients
     print("Estimated coefficients (true, linear regression, RANSAC):")
-    if successful: print("coef", lr.coef_, ransac.estimator_.coef_)
-    else: print("coef", lr.coef_, "not found")
+    if successful: print("coef", coef_lr, coef_ransac)
+    else: print("coef", coef_lr, "not found")
     fig = plt.figure(); lw = 2
     if successful:
         plt.scatter(X[inlier_mask], y[inlier_mask], color="yellowgreen", marker=".", label="Inliers")
@@ -272,4 +571,8 @@ def ransac_plot(lr,ransac,X,y,inlier_mask,outlier_mask,successful):
     plt.xlabel("Input")
     plt.ylabel("Response")
     plt.show()
-    return fig
\ No newline at end of file
+    return fig
+
+
+if __name__ == "__main__":
+    BenchmarkConsistencyBasedOutlierDetection()
@@ -21,16 +21,41 @@ evaluation_params = {
     "MeshRegistration": {
             "ManualGlobalRegistration": False,
             "ThreePointRegistration":   False,
-            "Recalculation":            False
+            "Recalculation":            False,
+            "GlobalRegistrationMethod": "FPFH",     # "FPFH" (Open3D feature matching) or "Cameras" (similarity transformation from the camera centers)
+            "FineRegistration":         True,       # False: the global transformation is the final transformation (no ICP with CloudCompare)
+            "FineRegistrationEngine":   "native",   # "native" (in-process scaled ICP and cloud to mesh distances) or "CloudCompare"
+            "ICP":                      {"max_iterations": 100, "min_error_diff": 1e-7, "adjust_scale": True, "overlap": 1.0, "number_of_points": 50000},
+            "SDF":                      None,       # e.g. {"cache_dir": "cache/sdf", "voxel_fraction": 1/256, "band": 3, "brick_size": 8, "store_gradients": True, "fallback_distance": 1.0} --> narrow band SDF queries
+            "TargetCacheDir":           "cache/registration",   # cache of the preprocessed ground truth meshes (None --> no cache)
+            "TargetCacheSizeMB":        500,
+            "MeshStoreDir":             "cache/meshes",   # parsed OBJ files shared by all evaluation stages (None --> parse every time)
+            "MeshStoreSizeMB":          2000,
+            "GlobalRegistrationPyramid": None,    # e.g. {"levels": 3, "coarse_fraction": 0.05, "fine_fraction": 0.005, "tolerance": 1e-3} --> coarse to fine registration
+            "GlobalRegistrationStarts":  1,      # > 1 --> multi start registration on a process pool, the best scored result is kept
+            "RotationGridInit":          False,  # initial rotations of the starts from a rotation grid (symmetric objects)
+            "GlobalRegistrationWorkers": None,    # number of processes (None --> number of CPUs)
+            "Sampling": {"strategy": "uniform", "number_of_points": 10000, "points_per_area": None}   # "uniform", "vertex_voxel" or "poisson", points_per_area (points/m²) --> number of points scales with the surface
         },
+    "SurfaceDistances": {
+        "active": True,
+        "Recalculation": True,
+        "thresholds": [0.001, 0.002, 0.005],    # F-score thresholds in m
+        "percentiles": [50, 90, 99],
+        "chunk_size": 1000000               # points per chunk (bounds the memory)
+    },
     "TextureEvaluation": {
         "active": False,
         "Recalculation": False,
+        "blender_processes": 1,          # renders of reference and reconstruction: 1 --> one Blender session, 2 --> two concurrent sessions
         "patch_size": 21,
         "levels": 256,
         "distances": 5,
         "image_number": 2,
-        "features":  ["dissimilarity","correlation"]    # "contrast", "dissimilarity", "homogeneity", "ASM", "energy", "correlation"
+        "features":  ["dissimilarity","correlation"],   # "contrast", "dissimilarity", "homogeneity", "ASM", "energy", "correlation"
+        "window_selection": "mask",       # "mask": windows from the textured foreground (mask + local variance), "random": rejection sampling
+        "min_std": 5.0,                  # min. std of the grey values of a window (window_selection "mask")
+        "DenseMaps": {"active": True, "stride": 7, "min_foreground": 1.0, "reduced_levels": None, "workers": 1}   # dense feature maps (stride in pixels, workers: None --> all CPUs, needs an if __name__ == "__main__" guard on Windows)
     },
     "CameraPositioning": {
         "threshold": 0.01 # outlier criterion: error > treshold*(actual distance from the camera to the center of the scene)
@@ -40,9 +65,11 @@ evaluation_params = {
 scaling_params = {        
     "PreOutlierDetection": True,
     "threshold": 0.05,
-    "criterion": "rel"      # criterion="abs","abs_norm" or "rel",
+    "criterion": "rel",     # criterion="abs","abs_norm" or "rel",
     # relative criterion: threshold = 0.07 --> 7%,    absolute normed criterion: threshold: 0.1m   --> measured on the scale of the reconstruction program --> ca. 2cm (real scale)
     # absolute criterion: treshold: 0.1m
+    "ConfidenceInterval": None, # None or e.g. {"method": "block", "n_resamples": 10000, "confidence": 0.95, "chunk_size": 1000}, method="bootstrap","block" or "jackknife"
+    "Incremental": False        # True: the scaling factor is estimated while the SfM-File is read (IncrementalScalingFactor, no plot and no confidence interval)
 }
 
 ############################################################# Loop #################################################################################
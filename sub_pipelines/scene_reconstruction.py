@@ -22,8 +22,8 @@ def SceneReconstruction(rec_params,scaling_params,image_dir,scaling=True,DebugMo
     command = CreateMeshroomCommand(app_paths,image_dir,rec_params)
     PhotogrammetryMeshroom(command,rec_params,DebugMode)
     if scaling == True:
-        cams_rec, cams_ref = ImportCameras(output_path,image_dir)
-        scaling_factor = ScaleScene(cams_rec,cams_ref,evaluation_path,scaling_params)
+        cams_rec, cams_ref, scaling_estimator = ImportCameras(output_path,image_dir,scaling_params)
+        scaling_factor = ScaleScene(cams_rec,cams_ref,evaluation_path,scaling_params,scaling_estimator=scaling_estimator)
     else: scaling_factor = None
     WriteCacheForSubsequentEvaluation(ref_params,rec_params,image_dir)
     if SaveImagesObj: PlotReconstructedObject(ref_params["io"]["name"],rec_params["evaluation_path"],DisplayPlots)
@@ -53,9 +53,10 @@ if __name__ == "__main__":
     scaling_params = {        
         "PreOutlierDetection": True,
         "threshold": 0.05,
-        "criterion": "rel"      # criterion="abs","abs_norm" or "rel",
+        "criterion": "rel",     # criterion="abs","abs_norm" or "rel",
         # relative criterion: threshold = 0.07 --> 7%,    absolute normed criterion: threshold: 0.1m   --> measured on the scale of the reconstruction program --> ca. 2cm (real scale)
         # absolute criterion: treshold: 0.1m
+        "Incremental": False        # True: the scaling factor is estimated while the SfM-File is read (IncrementalScalingFactor, no plot and no confidence interval)
     }   
     output_path, scaling_factor = SceneReconstruction(params_rec,scaling_params,image_dir,scaling,DebugMode)
     print(f"output path: {output_path}")
\ No newline at end of file